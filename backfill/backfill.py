@@ -3,7 +3,9 @@ import botocore
 from botocore.exceptions import BotoCoreError, ClientError, NoCredentialsError, PartialCredentialsError, ParamValidationError, WaiterError
 import loguru
 from loguru import logger
+import argparse
 import os
+import sys
 import io
 from io import BytesIO, StringIO
 import pandas as pd
@@ -12,278 +14,40 @@ import datetime
 from datetime import datetime 
 from datetime import timedelta
 
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from common.aws import get_s3_client
+from common.athena import AthenaQueryResult, iter_athena_query_chunks, run_athena_query
+from common.engines import DAILY_STATS_ENGINE, get_engine
+from common.queries import build_line_items_query, build_daily_stats_query, build_first_orders_query, build_partition_bounds_query
+from common.sinks import daily_stats_table, write_daily_stats_partitions
+from common.partitions import register_partitions
+from common.customer_state import CUSTOMER_STATE_KEY, S3CustomerStateStore, merge_customer_state
+from common.checkpoints import CHUNK_DAYS, BackfillCheckpoint, checkpoint_key, chunk_dates, parse_shard, shard_dates
+from common.manifests import S3ManifestStore
+from common.streaming import StreamingDailyStats
+from common.out_of_core import OutOfCoreDailyStats, use_out_of_core
+
 
 AWS_ACCESS_KEY_ID=os.environ['AWS_ACCESS_KEY']
 AWS_SECRET_ACCESS_KEY=os.environ['AWS_ACCESS_SECRET']
 
 
-# ---------------------------------------
-# FUNCTIONS
-# ---------------------------------------
-
-# FUNCTION TO EXECUTE ATHENA QUERY AND RETURN RESULTS
-# ----------
-
-def run_athena_query(query:str, database: str, region:str):
-
-        
-    # Initialize Athena client
-    athena_client = boto3.client('athena', 
-                                 region_name=region,
-                                 aws_access_key_id=AWS_ACCESS_KEY_ID,
-                                 aws_secret_access_key=AWS_SECRET_ACCESS_KEY)
-
-    # Execute the query
-    try:
-        response = athena_client.start_query_execution(
-            QueryString=query,
-            QueryExecutionContext={
-                'Database': database
-            },
-            ResultConfiguration={
-                'OutputLocation': 's3://prymal-ops/athena_query_results/'  # Specify your S3 bucket for query results
-            }
-        )
-
-        query_execution_id = response['QueryExecutionId']
-
-        # Wait for the query to complete
-        state = 'RUNNING'
-
-        while (state in ['RUNNING', 'QUEUED']):
-            response = athena_client.get_query_execution(QueryExecutionId = query_execution_id)
-            logger.info(f'Query is in {state} state..')
-            if 'QueryExecution' in response and 'Status' in response['QueryExecution'] and 'State' in response['QueryExecution']['Status']:
-                # Get currentstate
-                state = response['QueryExecution']['Status']['State']
-
-                if state == 'FAILED':
-                    logger.error('Query Failed!')
-                elif state == 'SUCCEEDED':
-                    logger.info('Query Succeeded!')
-            
-
-        # OBTAIN DATA
-
-        # --------------
-
-
-
-        query_results = athena_client.get_query_results(QueryExecutionId=query_execution_id,
-                                                MaxResults= 1000)
-        
-
-
-        # Extract qury result column names into a list  
-
-        cols = query_results['ResultSet']['ResultSetMetadata']['ColumnInfo']
-        col_names = [col['Name'] for col in cols]
-
-
-
-        # Extract query result data rows
-        data_rows = query_results['ResultSet']['Rows'][1:]
-
-
-
-        # Convert data rows into a list of lists
-        query_results_data = [[r['VarCharValue'] if 'VarCharValue' in r else np.NaN for r in row['Data']] for row in data_rows]
-
-
-
-        # Paginate Results if necessary
-        while 'NextToken' in query_results:
-                query_results = athena_client.get_query_results(QueryExecutionId=query_execution_id,
-                                                NextToken=query_results['NextToken'],
-                                                MaxResults= 1000)
-
-
-
-                # Extract quuery result data rows
-                data_rows = query_results['ResultSet']['Rows'][1:]
-
-
-                # Convert data rows into a list of lists
-                query_results_data.extend([[r['VarCharValue'] if 'VarCharValue' in r else np.NaN for r in row['Data']] for row in data_rows])
-
-
-
-        results_df = pd.DataFrame(query_results_data, columns = col_names)
-        
-        return results_df
-
-
-    except ParamValidationError as e:
-        logger.error(f"Validation Error (potential SQL query issue): {e}")
-        # Handle invalid parameters in the request, such as an invalid SQL query
-
-    except WaiterError as e:
-        logger.error(f"Waiter Error: {e}")
-        # Handle errors related to waiting for query execution
-
-    except ClientError as e:
-        error_code = e.response['Error']['Code']
-        error_message = e.response['Error']['Message']
-        
-        if error_code == 'InvalidRequestException':
-            logger.error(f"Invalid Request Exception: {error_message}")
-            # Handle issues with the Athena request, such as invalid SQL syntax
-            
-        elif error_code == 'ResourceNotFoundException':
-            logger.error(f"Resource Not Found Exception: {error_message}")
-            # Handle cases where the database or query execution does not exist
-            
-        elif error_code == 'AccessDeniedException':
-            logger.error(f"Access Denied Exception: {error_message}")
-            # Handle cases where the IAM role does not have sufficient permissions
-            
-        else:
-            logger.error(f"Athena Error: {error_code} - {error_message}")
-            # Handle other Athena-related errors
-
-    except Exception as e:
-        logger.error(f"Other Exception: {str(e)}")
-        # Handle any other unexpected exceptions
-
-
-# Check S3 Path for Existing Data
-# -----------
-
-def check_path_for_objects(bucket: str, s3_prefix:str):
-
-  logger.info(f'Checking for existing data in {bucket}/{s3_prefix}')
-
-  # Create s3 client
-  s3_client = boto3.client('s3', 
-                          region_name = REGION,
-                          aws_access_key_id=AWS_ACCESS_KEY_ID,
-                          aws_secret_access_key=AWS_SECRET_ACCESS_KEY)
-
-  # List objects in s3_prefix
-  result = s3_client.list_objects_v2(Bucket=bucket, Prefix=s3_prefix)
-
-  # Instantiate objects_exist
-  objects_exist=False
-
-  # Set objects_exist to true if objects are in prefix
-  if 'Contents' in result:
-      objects_exist=True
-
-      logger.info('Data already exists!')
-
-  return objects_exist
-
-# Delete Existing Data from S3 Path
-# -----------
-
-def delete_s3_prefix_data(bucket:str, s3_prefix:str):
-
-
-  logger.info(f'Deleting existing data from {bucket}/{s3_prefix}')
-
-  # Create an S3 client
-  s3_client = boto3.client('s3', 
-                          region_name = REGION,
-                          aws_access_key_id=AWS_ACCESS_KEY_ID,
-                          aws_secret_access_key=AWS_SECRET_ACCESS_KEY)
-
-  # Use list_objects_v2 to list all objects within the specified prefix
-  objects_to_delete = s3_client.list_objects_v2(Bucket=bucket, Prefix=s3_prefix)
-
-  # Extract the list of object keys
-  keys_to_delete = [obj['Key'] for obj in objects_to_delete.get('Contents', [])]
-
-  # Check if there are objects to delete
-  if keys_to_delete:
-      # Delete the objects using 'delete_objects'
-      response = s3_client.delete_objects(
-          Bucket=bucket,
-          Delete={'Objects': [{'Key': key} for key in keys_to_delete]}
-      )
-      logger.info(f"Deleted {len(keys_to_delete)} objects")
-  else:
-      logger.info("No objects to delete")
-
-
-
-
-# --------------
-# Function to run Athena query , not return results
-# --------------
-
-
-def run_athena_query_no_results(query:str, database: str):
-
-        
-    # Initialize Athena client
-    athena_client = boto3.client('athena', 
-                                 region_name='us-east-1',
-                                 aws_access_key_id=AWS_ACCESS_KEY_ID,
-                                 aws_secret_access_key=AWS_SECRET_ACCESS_KEY)
-
-    # Execute the query
-    try:
-        response = athena_client.start_query_execution(
-            QueryString=query,
-            QueryExecutionContext={
-                'Database': database
-            },
-            ResultConfiguration={
-                'OutputLocation': 's3://prymal-ops/athena_query_results/'  # Specify your S3 bucket for query results
-            }
-        )
-
-        query_execution_id = response['QueryExecutionId']
-
-        # Wait for the query to complete
-        state = 'RUNNING'
-
-        while (state in ['RUNNING', 'QUEUED']):
-            response = athena_client.get_query_execution(QueryExecutionId = query_execution_id)
-            logger.info(f'Query is in {state} state..')
-            if 'QueryExecution' in response and 'Status' in response['QueryExecution'] and 'State' in response['QueryExecution']['Status']:
-                # Get currentstate
-                state = response['QueryExecution']['Status']['State']
-
-                if state == 'FAILED':
-                    logger.error('Query Failed!')
-                elif state == 'SUCCEEDED':
-                    logger.info('Query Succeeded!')
-
-                    
-    except ParamValidationError as e:
-        logger.error(f"Validation Error (potential SQL query issue): {e}")
-        # Handle invalid parameters in the request, such as an invalid SQL query
-
-    except WaiterError as e:
-        logger.error(f"Waiter Error: {e}")
-        # Handle errors related to waiting for query execution
-
-    except ClientError as e:
-        error_code = e.response['Error']['Code']
-        error_message = e.response['Error']['Message']
-        
-        if error_code == 'InvalidRequestException':
-            logger.error(f"Invalid Request Exception: {error_message}")
-            # Handle issues with the Athena request, such as invalid SQL syntax
-            
-        elif error_code == 'ResourceNotFoundException':
-            logger.error(f"Resource Not Found Exception: {error_message}")
-            # Handle cases where the database or query execution does not exist
-            
-        elif error_code == 'AccessDeniedException':
-            logger.error(f"Access Denied Exception: {error_message}")
-            # Handle cases where the IAM role does not have sufficient permissions
-            
-        else:
-            logger.error(f"Athena Error: {error_code} - {error_message}")
-            # Handle other Athena-related errors
-
-    except Exception as e:
-        logger.error(f"Other Exception: {str(e)}")
-        # Handle any other unexpected exceptions
+# ========================================================================
+# Arguments
+# ========================================================================
 
+# Without arguments the whole history is backfilled by a single worker.
+# Workers sharing a run (same --start/--end) split the days with --shard i/n
+# and each resumes from its own checkpoint when re-run.
 
+parser = argparse.ArgumentParser(description='Backfill shopify_daily_stats')
+parser.add_argument('--start', default=None, help='First order date (YYYY-MM-DD), defaults to the first source partition')
+parser.add_argument('--end', default=None, help='Last order date (YYYY-MM-DD), defaults to yesterday')
+parser.add_argument('--shard', default='0/1', help='This worker\'s shard i/n, shards are numbered from 0')
+parser.add_argument('--chunk-days', type=int, default=CHUNK_DAYS, help='Days written between checkpoints')
+parser.add_argument('--run-id', default=None, help='Checkpoint name, defaults to <start>_<end>')
+parser.add_argument('--restart', action='store_true', help='Ignore the checkpoint and redo every day')
+args = parser.parse_args()
 
 
 # ========================================================================
@@ -293,176 +57,158 @@ def run_athena_query_no_results(query:str, database: str):
 DATABASE = 'prymal'
 REGION = 'us-east-1'
 
+# How query results are fetched: 'auto', 'paginate', 's3_csv' or 'unload' (Parquet)
+FETCH_MODE = os.environ.get('ATHENA_FETCH_MODE', 'auto')
 
-# Construct query to pull data by product
-# ----
 
 yesterday = pd.to_datetime(pd.to_datetime('today') - timedelta(1)).strftime('%Y-%m-%d')
-yesterday_y = pd.to_datetime(pd.to_datetime('today') - timedelta(1)).strftime('%Y')
-yesterday_m = pd.to_datetime(pd.to_datetime('today') - timedelta(1)).strftime('%m')
-yesterday_d = pd.to_datetime(pd.to_datetime('today') - timedelta(1)).strftime('%d')
-
-QUERY = f"""SELECT *
-            FROM shopify_line_items
-        """
 
-# Query datalake to get quantiy sold per sku for the last 120 days
-# ----
+# Where the daily stats are computed:
+#   'pandas'    - pull line items and aggregate them with DAILY_STATS_ENGINE (common/engines.py:
+#                 pandas reference, duckdb or polars), out of core above OUT_OF_CORE_THRESHOLD_MB
+#   'streaming' - same as 'pandas' but aggregates the results chunk by chunk
+#   'athena'    - aggregate inside Athena and pull back one row per day
+STATS_MODE = os.environ.get('DAILY_STATS_MODE', 'pandas')
 
-result_df = run_athena_query(query=QUERY, database=DATABASE, region=REGION)
-# result_df.columns = ['partition_date','order_date','sku','sku_name','qty_sold']
+logger.info(f'Computing daily stats in {STATS_MODE} mode')
 
-logger.info(result_df.head(3))
-logger.info(result_df.info())
-logger.info(f"Count of NULL RECORDS: {len(result_df.loc[result_df['order_date'].isna()])}")
-# Format datatypes & new columns
-result_df['order_date'] = pd.to_datetime(result_df['order_date']).dt.strftime('%Y-%m-%d')
-result_df['week'] = pd.to_datetime(result_df['order_date']).dt.strftime('%Y-%W')
-result_df['product_rev'] = result_df['quantity'].astype(float) * result_df['price'].astype(float)
+# The pandas engine aggregates across AGGREGATION_WORKERS processes when set above 1,
+# pair it with a larger --chunk-days so each chunk has enough days to split
 
-logger.info(f"MIN DATE: {result_df['order_date'].min()}")
-logger.info(f"MAX DATE: {result_df['order_date'].max()}")
+# Create s3 client
+s3_client = get_s3_client(REGION)
 
+# Set bucket
+BUCKET = os.environ['S3_PRYMAL_ANALYTICS']
 
-# Create dataframe copy
-shopify_line_item_df = result_df.copy()
 
 # --------------------
-# calculate first order date & age at time of purchase
+# DATES FOR THIS SHARD
 # --------------------
 
-first_order_df = shopify_line_item_df.groupby('email',as_index=False).agg({
-                                    'order_date':'min'
+START_DATE = args.start
+END_DATE = args.end if args.end is not None else yesterday
 
-})
+if START_DATE is None:
+    bounds_df = run_athena_query(query=build_partition_bounds_query(), database=DATABASE, region=REGION, fetch_mode='paginate')
+    START_DATE = bounds_df['min_partition_date'].iloc[0]
 
-first_order_df.columns = ['email','first_order_date']
+SHARD_INDEX, SHARD_COUNT = parse_shard(args.shard)
 
-shopify_line_item_df = shopify_line_item_df.merge(first_order_df, how='left',on='email')
-shopify_line_item_df['age'] = (pd.to_datetime(shopify_line_item_df['order_date'])- pd.to_datetime(shopify_line_item_df['first_order_date'])).dt.days
-shopify_line_item_df['cuttoff_60_days'] = pd.to_datetime(pd.to_datetime(shopify_line_item_df['first_order_date']) + timedelta(60)).dt.strftime('%Y-%m-%d')
-shopify_line_item_df['first_order_month'] = pd.to_datetime(shopify_line_item_df['first_order_date']).dt.strftime('%Y-%m')
+RUN_ID = args.run_id if args.run_id is not None else f'{START_DATE}_{END_DATE}'
 
+checkpoint = BackfillCheckpoint(store=S3ManifestStore(bucket=BUCKET, key=checkpoint_key(RUN_ID, SHARD_INDEX, SHARD_COUNT), s3_client=s3_client),
+                                run_id=RUN_ID, shard_index=SHARD_INDEX, shard_count=SHARD_COUNT).load(restart=args.restart)
 
-shopify_line_item_df['first_order_fl'] = 0
-shopify_line_item_df.loc[shopify_line_item_df['order_date']==shopify_line_item_df['first_order_date'],'first_order_fl'] = 1
+shard_days = shard_dates(START_DATE, END_DATE, shard_index=SHARD_INDEX, shard_count=SHARD_COUNT)
 
-# --------------------
-# Calculate summary statistics for each day
-# --------------------
+chunks = chunk_dates(checkpoint.pending(shard_days), chunk_days=args.chunk_days)
 
-df = shopify_line_item_df.copy()
+logger.info(f'Backfill {RUN_ID} shard {SHARD_INDEX}/{SHARD_COUNT}: {len(shard_days)} days, {len(chunks)} chunks to run')
 
 
-# Group by order date and agg
-daily_stats_df = df.groupby('order_date',as_index=False).agg(
-                                total_product_revenue=('product_rev', 'sum'),
-                                total_order_count=('order_id', 'nunique'),
-                                total_customer_count=('email', 'nunique')
+# --------------------
+# COMPUTE & WRITE EACH CHUNK
+# --------------------
 
-                     
+# In pandas and streaming mode the first order dates of everything before a chunk come
+# from the customer state, carried forward between contiguous chunks and
+# rebuilt with one query whenever a chunk doesn't follow the previous one.
 
-)
+state_df = None
+state_through = None
+failed_dates = []
 
-#Calulate lifetime AOV
-daily_stats_df['daily_aov'] = daily_stats_df['total_product_revenue'] / daily_stats_df['total_order_count']
+for chunk in chunks:
 
-logger.info(daily_stats_df.columns)
+    chunk_start, chunk_end = chunk[0], chunk[-1]
 
+    logger.info(f'Backfilling {chunk_start} - {chunk_end}')
 
-# --------------------
-# Calculate (and merge) additional metrics
+    if STATS_MODE in ('pandas', 'streaming'):
 
-# --- new vs returning cust count
-# --- 
-# --------------------
+        if state_through is None or pd.Timestamp(chunk_start) - pd.Timestamp(state_through) != timedelta(1):
+            first_orders_end = (pd.Timestamp(chunk_start) - timedelta(1)).strftime('%Y-%m-%d')
+            state_df = run_athena_query(query=build_first_orders_query(end_date=first_orders_end),
+                                        database=DATABASE, region=REGION, fetch_mode=FETCH_MODE)
 
-new_custs = df.loc[df['first_order_fl']==1].groupby('order_date',as_index=False).agg(
-                                                new_customer_count=('email','nunique'),
-                                                new_customer_spend=('product_rev','sum')
-)
+    if STATS_MODE == 'streaming':
 
-repeat_custs = df.loc[df['first_order_fl']==0].groupby('order_date',as_index=False).agg(
-                                                repeat_customer_count=('email','nunique'),
-                                                repeat_customer_spend=('product_rev','sum')
-)
+        # Line items reduced chunk by chunk straight from the query results
+        daily_stats_df, first_order_df = (StreamingDailyStats()
+                                          .add_chunks(iter_athena_query_chunks(query=build_line_items_query(start_date=chunk_start, end_date=chunk_end),
+                                                                               database=DATABASE, region=REGION))
+                                          .finalize(state_df=state_df))
 
-logger.info(new_custs.head())
-logger.info(repeat_custs.head())
+        state_df = merge_customer_state(state_df=state_df, first_order_df=first_order_df)
+        state_through = chunk_end
 
-# Merge additinal stats
-daily_stats_df = daily_stats_df.merge(new_custs,how='left',on='order_date').merge(repeat_custs,how='left',on='order_date')
+    elif STATS_MODE == 'pandas':
 
+        # Only the columns the stats need, for the chunk's partitions
+        # With 'unload' the query runs as an UNLOAD and its Parquet output is sized & read
+        line_items_result = AthenaQueryResult(query=build_line_items_query(start_date=chunk_start, end_date=chunk_end),
+                                              database=DATABASE, region=REGION, fetch_mode=FETCH_MODE)
 
-logger.info(daily_stats_df.columns)
-logger.info(daily_stats_df.head())
+        if use_out_of_core(line_items_result.result_bytes(), result_format=line_items_result.result_format):
 
+            # Spilled to customer buckets on disk and aggregated one bucket at a time
+            with OutOfCoreDailyStats() as out_of_core_stats:
+                daily_stats_df, first_order_df = (out_of_core_stats
+                                                  .add_chunks(line_items_result.iter_chunks())
+                                                  .finalize(state_df=state_df))
 
-# --------------------
-# WRITE TO S3
-# --------------------
-
-# Create s3 client
-s3_client = boto3.client('s3', 
-                          region_name = REGION,
-                          aws_access_key_id=AWS_ACCESS_KEY_ID,
-                          aws_secret_access_key=AWS_SECRET_ACCESS_KEY
-                          )
-
-# Set bucket
-BUCKET = os.environ['S3_PRYMAL_ANALYTICS']
+        else:
 
+            result_df = line_items_result.read()
 
-for d in daily_stats_df['order_date'].unique():
+            # First order date & summary statistics for each day, the pandas
+            # engine spreads the days across AGGREGATION_WORKERS processes
+            daily_stats_df, first_order_df = get_engine(DAILY_STATS_ENGINE).compute(result_df, state_df=state_df)
 
-    df_write = daily_stats_df.loc[daily_stats_df['order_date']==d]
+        state_df = merge_customer_state(state_df=state_df, first_order_df=first_order_df)
+        state_through = chunk_end
 
-    # Log number of rows
-    logger.info(f'{len(df_write)} rows in daily_stats_df ({d})')
-    
-    # Configure S3 Prefix
-    S3_PREFIX_PATH = f"shopify/daily_stats/partition_date={d}/shopify_daily_stats_{d}.csv"
+    elif STATS_MODE == 'athena':
 
-    # Check if data already exists for this partition
-    data_already_exists = check_path_for_objects(bucket=BUCKET, s3_prefix=S3_PREFIX_PATH)
+        # One row per day, computed server side
+        daily_stats_df = run_athena_query(query=build_daily_stats_query(start_date=chunk_start, end_date=chunk_end),
+                                          database=DATABASE, region=REGION, fetch_mode='paginate')
 
-    # If data already exists, delete it .. 
-    if data_already_exists == True:
-        
-        # Delete data 
-        delete_s3_prefix_data(bucket=BUCKET, s3_prefix=S3_PREFIX_PATH)
+        daily_stats_df['order_date'] = pd.to_datetime(daily_stats_df['order_date']).dt.strftime('%Y-%m-%d')
 
+    daily_stats_df = daily_stats_df.loc[daily_stats_df['order_date'].isin(chunk)]
 
-    logger.info(f'Writing to {S3_PREFIX_PATH}')
+    # Split by day once & upload the partitions concurrently
+    written_dates = write_daily_stats_partitions(s3_client=s3_client, bucket=BUCKET, daily_stats_df=daily_stats_df)
 
+    # RUN 'ATHENA ALTER TABLE' TO UPDATE TABLE
+    unregistered_dates = register_partitions(partition_dates=written_dates, table=daily_stats_table())
 
-    with io.StringIO() as csv_buffer:
-        df_write.to_csv(csv_buffer, index=False)
+    chunk_failed = sorted((set(daily_stats_df['order_date']) - set(written_dates)) | set(unregistered_dates))
+    failed_dates.extend(chunk_failed)
 
-        response = s3_client.put_object(
-            Bucket=BUCKET, 
-            Key=S3_PREFIX_PATH, 
-            Body=csv_buffer.getvalue()
-        )
+    # Days without orders are done too, only failed writes & registrations stay pending
+    checkpoint.mark_completed([d for d in chunk if d not in chunk_failed])
 
-        status = response['ResponseMetadata']['HTTPStatusCode']
 
-        if status == 200:
-            logger.info(f"Successful S3 put_object response for PUT ({S3_PREFIX_PATH}). Status - {status}")
-        else:
-            logger.error(f"Unsuccessful S3 put_object response for PUT ({S3_PREFIX_PATH}. Status - {status}")
+# --------------------
+# RESEED CUSTOMER STATE USED BY THE DAILY JOB
+# --------------------
 
+# Done once, by the last shard
+if SHARD_INDEX == SHARD_COUNT - 1 and not failed_dates:
 
-        # --------------------
-        # RUN 'ATHENA ALTER TABLE' TO UPDATE TABLE 
-        # --------------------
+    first_order_df = run_athena_query(query=build_first_orders_query(), database=DATABASE, region=REGION, fetch_mode=FETCH_MODE)
 
+    customer_state_store = S3CustomerStateStore(bucket=BUCKET, key=CUSTOMER_STATE_KEY, s3_client=s3_client)
 
-        QUERY = f"""
+    # Days after END_DATE may hold first orders too, the daily job re-scans
+    # them from the watermark and the earliest date per customer wins
+    customer_state_store.save(first_order_df, state_through=END_DATE)
 
-        ALTER TABLE shopify_daily_stats ADD
-        PARTITION (partition_date = '{d}')
-        
-        """
 
-        run_athena_query_no_results(query=QUERY, database='prymal-analytics')
+# Fail the run so missing days are retried instead of silently skipped
+if failed_dates:
+    logger.error(f'{len(failed_dates)} daily_stats partitions were not written: {failed_dates}')
+    sys.exit(1)
@@ -0,0 +1,80 @@
+from concurrent.futures import ThreadPoolExecutor
+from loguru import logger
+import os
+import sys
+import pandas as pd
+
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from common.aws import get_s3_client
+from common.sinks import DAILY_STATS_OUTPUTS, WRITE_WORKERS, daily_stats_table, write_daily_stats_partitions
+from common.partitions import register_partitions
+
+
+# ========================================================================
+# Copy the CSV daily stats partitions into the Parquet table
+# ========================================================================
+
+# One-off migration: reads every partition under shopify/daily_stats/,
+# rewrites it with the Parquet schema under shopify/daily_stats_parquet/
+# and registers the partitions on shopify_daily_stats_parquet. Re-running
+# overwrites the Parquet partitions, the CSV ones are left untouched.
+
+REGION = 'us-east-1'
+BUCKET = 'prymal-analytics'
+
+
+# List every CSV object under the daily stats prefix
+# -----------
+
+def list_csv_partition_keys(s3_client, bucket: str, prefix: str):
+
+    keys = []
+
+    paginator = s3_client.get_paginator('list_objects_v2')
+
+    for page in paginator.paginate(Bucket=bucket, Prefix=f'{prefix}/'):
+        keys.extend(obj['Key'] for obj in page.get('Contents', []) if obj['Key'].endswith('.csv'))
+
+    return keys
+
+
+def read_csv_partition(s3_client, bucket: str, key: str):
+
+    response = s3_client.get_object(Bucket=bucket, Key=key)
+
+    return pd.read_csv(response['Body'], dtype={'order_date': str})
+
+
+# ========================================================================
+# Execute Code
+# ========================================================================
+
+s3_client = get_s3_client(REGION)
+
+CSV_PREFIX = DAILY_STATS_OUTPUTS['csv']['prefix']
+
+keys = list_csv_partition_keys(s3_client=s3_client, bucket=BUCKET, prefix=CSV_PREFIX)
+
+logger.info(f'{len(keys)} CSV partitions found under {BUCKET}/{CSV_PREFIX}')
+
+with ThreadPoolExecutor(max_workers=WRITE_WORKERS) as executor:
+    partition_dfs = list(executor.map(lambda key: read_csv_partition(s3_client, BUCKET, key), keys))
+
+if partition_dfs:
+
+    daily_stats_df = pd.concat(partition_dfs, ignore_index=True)
+
+    written_dates = write_daily_stats_partitions(s3_client=s3_client, bucket=BUCKET, daily_stats_df=daily_stats_df,
+                                                 output_format='parquet')
+
+    unregistered_dates = register_partitions(partition_dates=written_dates, table=daily_stats_table('parquet'))
+
+    logger.info(f'Migrated {len(written_dates)} of {len(keys)} partitions to {daily_stats_table("parquet")}')
+
+    # Re-running the migration rewrites nothing that is unchanged, so it can simply be retried
+    if len(written_dates) < len(keys) or unregistered_dates:
+        logger.error(f'{len(keys) - len(written_dates)} partitions were not written, {len(unregistered_dates)} not registered')
+        sys.exit(1)
+
+else:
+    logger.info('No CSV partitions to migrate')
@@ -0,0 +1,291 @@
+from loguru import logger
+import os
+import sys
+
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from common.aws import get_glue_client, get_s3_client
+from common.athena import AthenaQueryResult, run_athena_query
+from common.compaction import (COMPACTION_MANIFEST_KEY, MONTHLY_PREFIX, closed_months, compact_months, list_partition_objects,
+                               list_partition_values, month_fingerprints)
+from common.customer_state import CUSTOMER_STATE_KEY, S3CustomerStateStore, empty_customer_state, first_order_changes, merge_customer_state
+from common.engines import DAILY_STATS_ENGINE, get_engine
+from common.out_of_core import OutOfCoreDailyStats, use_out_of_core
+from common.queries import (build_affected_order_dates_query, build_first_orders_query, build_line_items_query,
+                            build_partition_row_counts_query)
+from common.s3 import delete_s3_keys, list_s3_keys
+from common.sinks import DAILY_STATS_OUTPUTS, OUTPUT_FORMAT, daily_stats_partition_prefix, daily_stats_table, write_daily_stats_partitions
+from common.partitions import register_partitions
+from common.manifests import S3ManifestStore
+from common.source_changes import (FIRST_ORDERS_SNAPSHOT_KEY, SOURCE_MANIFEST_KEY, changed_partitions, fingerprint_source_partitions,
+                                   get_table_location)
+
+
+# ========================================================================
+# Recompute only the days whose source line items changed
+# ========================================================================
+
+# Compares the S3 fingerprints of the shopify_line_items partitions with the
+# manifest saved by the previous run, then recomputes and rewrites the daily
+# stats of just the order dates that depend on changed partitions: the order
+# dates in them, plus the old and new first order date of every customer whose
+# first order moved. Days left without line items lose their partition, and
+# the customer state and any monthly file holding a restated day are
+# refreshed too.
+#
+# Partitions after the previous manifest are new days, which the daily job
+# computes - they are recorded, not restated. First orders come from the
+# snapshot the previous run saved, updated from the partitions since the
+# first changed one, so history before it is never scanned again.
+
+DATABASE = 'prymal'
+REGION = 'us-east-1'
+SOURCE_TABLE = 'shopify_line_items'
+
+# How query results are fetched: 'auto', 'paginate', 's3_csv' or 'unload' (Parquet)
+FETCH_MODE = os.environ.get('ATHENA_FETCH_MODE', 'auto')
+
+BUCKET = os.environ['S3_PRYMAL_ANALYTICS']
+
+s3_client = get_s3_client(REGION)
+
+
+# --------------------
+# FINGERPRINT SOURCE PARTITIONS
+# --------------------
+
+source_location = get_table_location(get_glue_client(REGION), database=DATABASE, table=SOURCE_TABLE)
+
+current_manifest = fingerprint_source_partitions(s3_client=s3_client, location=source_location)
+
+manifest_store = S3ManifestStore(bucket=BUCKET, key=SOURCE_MANIFEST_KEY, s3_client=s3_client)
+
+# First order per customer as of the fingerprinted partitions
+first_orders_store = S3CustomerStateStore(bucket=BUCKET, key=FIRST_ORDERS_SNAPSHOT_KEY, s3_client=s3_client)
+
+customer_state_store = S3CustomerStateStore(bucket=BUCKET, key=CUSTOMER_STATE_KEY, s3_client=s3_client)
+
+if not manifest_store.exists():
+
+    state_through = customer_state_store.load_state_through() if customer_state_store.exists() else None
+
+    if state_through is not None:
+        # The daily job's state already holds the first orders through its
+        # watermark, later partitions are picked up as new days next run
+        logger.info(f'No source manifest yet, recording the fingerprints through {state_through} without recomputing')
+        first_orders_store.save(customer_state_store.load(), state_through=state_through)
+        manifest_store.save({d: entry for d, entry in current_manifest.items() if d <= state_through})
+
+    else:
+        logger.info('No source manifest or customer state yet, recording the current fingerprints without recomputing')
+        first_orders_store.save(run_athena_query(query=build_first_orders_query(), database=DATABASE, region=REGION, fetch_mode=FETCH_MODE),
+                                state_through=max(current_manifest, default=None))
+        manifest_store.save(current_manifest)
+
+    sys.exit(0)
+
+previous_manifest = manifest_store.load()
+
+previous_through = max(previous_manifest, default=None)
+
+changed_dates = changed_partitions(previous=previous_manifest, current=current_manifest)
+
+# Days after the previous manifest are the daily job's
+new_dates = [d for d in changed_dates if previous_through is None or d > previous_through]
+changed_dates = [d for d in changed_dates if d not in new_dates]
+
+# Unchanged partitions keep the row counts recorded earlier
+for partition_date, entry in current_manifest.items():
+    if previous_manifest.get(partition_date, {}).get('fingerprint') == entry['fingerprint'] and 'row_count' in previous_manifest[partition_date]:
+        entry['row_count'] = previous_manifest[partition_date]['row_count']
+
+logger.info(f'{len(changed_dates)} of {len(current_manifest)} source partitions changed: {changed_dates}, {len(new_dates)} new')
+
+if not changed_dates and not new_dates:
+    sys.exit(0)
+
+
+# --------------------
+# ROW COUNTS OF THE CHANGED & NEW PARTITIONS
+# --------------------
+
+present_dates = [d for d in changed_dates + new_dates if d in current_manifest]
+
+if present_dates:
+
+    row_counts_df = run_athena_query(query=build_partition_row_counts_query(partition_dates=present_dates),
+                                     database=DATABASE,
+                                     region=REGION,
+                                     fetch_mode='paginate')
+
+    for partition_date, row_count in zip(row_counts_df['partition_date'], row_counts_df['row_count']):
+
+        current_manifest[partition_date]['row_count'] = int(row_count)
+
+        previous_count = previous_manifest.get(partition_date, {}).get('row_count')
+        logger.info(f'{partition_date}: {previous_count} -> {int(row_count)} line items')
+
+
+# --------------------
+# FIRST ORDERS THAT MOVED
+# --------------------
+
+# Manifests recorded before the snapshot existed fall back to the daily job's
+# customer state, or to one full scan
+if first_orders_store.exists():
+    previous_first_orders_df = first_orders_store.load()
+elif customer_state_store.exists():
+    logger.warning('No first orders snapshot yet, comparing with the customer state')
+    previous_first_orders_df = customer_state_store.load()
+else:
+    logger.warning('No first orders snapshot or customer state yet, every first order date counts as changed')
+    previous_first_orders_df = None
+
+# As the daily job computed the new days: the earlier first orders plus their customers
+if previous_first_orders_df is not None and new_dates:
+    new_first_orders_df = run_athena_query(query=build_first_orders_query(start_date=new_dates[0]),
+                                           database=DATABASE, region=REGION, fetch_mode=FETCH_MODE)
+    previous_first_orders_df = merge_customer_state(state_df=previous_first_orders_df, first_order_df=new_first_orders_df)
+
+if previous_first_orders_df is None:
+
+    first_orders_df = run_athena_query(query=build_first_orders_query(), database=DATABASE, region=REGION, fetch_mode=FETCH_MODE)
+    previous_first_orders_df = empty_customer_state()
+
+elif changed_dates:
+
+    # Partitions before the first changed one are as they were, and so are
+    # the first orders before it - only the partitions from it on are scanned
+    scanned_first_orders_df = run_athena_query(query=build_first_orders_query(start_date=changed_dates[0]),
+                                               database=DATABASE, region=REGION, fetch_mode=FETCH_MODE)
+
+    first_orders_df = merge_customer_state(
+        state_df=previous_first_orders_df.loc[previous_first_orders_df['first_order_date'] < changed_dates[0]],
+        first_order_df=scanned_first_orders_df
+    )
+
+else:
+    first_orders_df = previous_first_orders_df
+
+if not changed_dates:
+    logger.info(f'Only new days since the previous run, recording their {len(new_dates)} partitions')
+    first_orders_store.save(first_orders_df, state_through=max(current_manifest))
+    manifest_store.save(current_manifest)
+    sys.exit(0)
+
+first_order_dates = first_order_changes(previous_df=previous_first_orders_df, current_df=first_orders_df)
+
+
+# --------------------
+# RECOMPUTE THE AFFECTED DAYS
+# --------------------
+
+affected_df = run_athena_query(query=build_affected_order_dates_query(partition_dates=changed_dates),
+                               database=DATABASE,
+                               region=REGION,
+                               fetch_mode='paginate')
+
+# A removed partition leaves no rows behind, so its own day is always included
+affected_dates = sorted(set(affected_df['order_date']) | set(changed_dates) | set(first_order_dates))
+
+logger.info(f'Recomputing {len(affected_dates)} days between {affected_dates[0]} and {affected_dates[-1]} '
+            f'({len(first_order_dates)} for moved first orders)')
+
+# Only the affected days' line items are read, every customer's first order
+# comes from first_orders_df
+line_items_result = AthenaQueryResult(query=build_line_items_query(partition_dates=affected_dates),
+                                      database=DATABASE, region=REGION, fetch_mode=FETCH_MODE)
+
+if use_out_of_core(line_items_result.result_bytes(), result_format=line_items_result.result_format):
+
+    with OutOfCoreDailyStats() as out_of_core_stats:
+        daily_stats_df, _ = (out_of_core_stats
+                             .add_chunks(line_items_result.iter_chunks())
+                             .finalize(state_df=first_orders_df, days=affected_dates))
+
+else:
+
+    daily_stats_df, _ = get_engine(DAILY_STATS_ENGINE).compute(line_items_result.read(), state_df=first_orders_df, days=affected_dates)
+
+missing_dates = sorted(set(affected_dates) - set(daily_stats_df['order_date']))
+
+
+# --------------------
+# WRITE TO S3
+# --------------------
+
+written_dates = write_daily_stats_partitions(s3_client=s3_client, bucket=BUCKET, daily_stats_df=daily_stats_df)
+
+unregistered_dates = register_partitions(partition_dates=written_dates, table=daily_stats_table())
+
+failed_dates = sorted((set(daily_stats_df['order_date']) - set(written_dates)) | set(unregistered_dates))
+
+# Days that no longer have line items would keep their old stats otherwise
+deleted_dates = []
+
+if missing_dates:
+    logger.info(f'{len(missing_dates)} affected days no longer have line items, deleting their partitions: {missing_dates}')
+
+for missing_date in missing_dates:
+
+    try:
+        stale_keys = list_s3_keys(bucket=BUCKET, s3_prefix=daily_stats_partition_prefix(missing_date), s3_client=s3_client)
+        delete_s3_keys(bucket=BUCKET, keys=stale_keys, s3_client=s3_client)
+    except Exception as e:
+        logger.error(f'Unable to delete the daily_stats partition for {missing_date}: {e}')
+        failed_dates.append(missing_date)
+        continue
+
+    if stale_keys:
+        deleted_dates.append(missing_date)
+
+# Only once every affected day is written, so a failed run is detected again
+if failed_dates:
+    logger.error(f'{len(failed_dates)} daily_stats partitions were not restated: {sorted(failed_dates)}')
+    sys.exit(1)
+
+
+# --------------------
+# REFRESH CUSTOMER STATE
+# --------------------
+
+# The daily job's state keeps its watermark: first orders up to it are
+# replaced, later ones are scanned again by the next daily run
+state_through = customer_state_store.load_state_through() if customer_state_store.exists() else None
+
+if state_through is not None:
+    customer_state_store.save(first_orders_df.loc[first_orders_df['first_order_date'] <= state_through], state_through=state_through)
+
+
+# --------------------
+# RECOMPACT CHANGED MONTHS
+# --------------------
+
+# Closed months already in the monthly table are rolled up again from their
+# restated days, months not compacted yet are left to the compaction job
+restated_months = {d[:7] for d in written_dates + deleted_dates}
+
+compacted_months = list_partition_values(s3_client=s3_client, bucket=BUCKET, prefix=MONTHLY_PREFIX, partition_key='partition_month')
+
+daily_objects = list_partition_objects(s3_client=s3_client, bucket=BUCKET, prefix=DAILY_STATS_OUTPUTS[OUTPUT_FORMAT]['prefix'],
+                                       partition_key='partition_date')
+
+months_to_compact = sorted(restated_months & set(compacted_months) & set(closed_months(list(daily_objects))))
+
+_, failed_months = compact_months(s3_client=s3_client, bucket=BUCKET, months=months_to_compact,
+                                  fingerprints=month_fingerprints(daily_objects),
+                                  manifest_store=S3ManifestStore(bucket=BUCKET, key=COMPACTION_MANIFEST_KEY, s3_client=s3_client),
+                                  daily_table=daily_stats_table(), region=REGION)
+
+
+# --------------------
+# SAVE MANIFEST
+# --------------------
+
+first_orders_store.save(first_orders_df, state_through=max(current_manifest, default=None))
+
+manifest_store.save(current_manifest)
+
+# The compaction job picks up a month that failed here from its fingerprints
+if failed_months:
+    logger.error(f'{len(failed_months)} monthly files were not refreshed: {failed_months}')
+    sys.exit(1)
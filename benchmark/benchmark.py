@@ -0,0 +1,360 @@
+from loguru import logger
+import argparse
+import csv
+import io
+import json
+import os
+import platform
+import resource
+import subprocess
+import sys
+import time
+import numpy as np
+import pandas as pd
+
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+
+# ========================================================================
+# Arguments
+# ========================================================================
+
+# Times each stage of the daily stats on synthetic line items at several
+# sizes, reports peak RSS and compares both against stored baselines:
+#   parse             - read the Athena result CSV (the 's3_csv' fetch path)
+#   prepare           - order dates, revenue and key encoding
+#   first_order       - every customer's first order date
+#   daily_aggregation - customer features and the per-day stats
+#   serialization     - daily stats partitions and the customer state file
+#
+# Every size runs in a fresh process, so peak RSS is that size's alone. The
+# line items are generated once per size & seed and kept in --data-dir,
+# served through the local backend (PIPELINE_BACKEND=local).
+#
+# Each process first times a fixed reference workload. Stage times are
+# compared relative to it, so a faster or slower machine than the one the
+# baseline was recorded on doesn't read as a change. Memory depends on the
+# Python & pandas versions, so baselines are kept per environment and peak
+# RSS is only compared within one; --record-missing records the sizes the
+# running environment has no baseline for yet (as the CI job does).
+#
+# Exits 1 when a stage is slower or bigger than its baseline beyond the
+# tolerances; --update-baselines records the run as the new baseline instead.
+
+BENCHMARK_DIR = os.path.dirname(os.path.abspath(__file__))
+
+parser = argparse.ArgumentParser(description='Benchmark the shopify_daily_stats stages')
+parser.add_argument('--sizes', type=int, nargs='+', default=[1000000, 10000000, 50000000], help='Line item counts to run')
+parser.add_argument('--seed', type=int, default=0, help='Random seed of the synthetic line items')
+parser.add_argument('--data-dir', default=os.path.join(BENCHMARK_DIR, 'data'), help='Where generated line items are kept')
+parser.add_argument('--baselines', default=os.path.join(BENCHMARK_DIR, 'baselines.json'), help='Baseline file')
+parser.add_argument('--update-baselines', action='store_true', help='Store this run as the baseline for its sizes')
+parser.add_argument('--record-missing', action='store_true', help='Store sizes without a baseline in this environment')
+parser.add_argument('--generate', type=int, default=None, help=argparse.SUPPRESS)
+parser.add_argument('--measure', type=int, default=None, help=argparse.SUPPRESS)
+args = parser.parse_args()
+
+
+# ========================================================================
+# Settings
+# ========================================================================
+
+# A stage regresses when it is this much slower / bigger than its baseline,
+# and by more than the absolute slack (timer and allocator noise)
+TIME_TOLERANCE = float(os.environ.get('BENCHMARK_TIME_TOLERANCE', 0.25))
+RSS_TOLERANCE = float(os.environ.get('BENCHMARK_RSS_TOLERANCE', 0.15))
+TIME_SLACK_SECONDS = 0.1
+RSS_SLACK_MB = 50
+
+BENCHMARK_BUCKET = 'benchmark'
+
+# The line items query's result columns, as Athena reports them
+LINE_ITEM_COLUMN_INFO = [
+    {'Name': 'order_date', 'Type': 'timestamp'},
+    {'Name': 'email', 'Type': 'varchar'},
+    {'Name': 'order_id', 'Type': 'varchar'},
+    {'Name': 'quantity', 'Type': 'integer'},
+    {'Name': 'price', 'Type': 'double'},
+]
+
+STAGES = ['parse', 'prepare', 'first_order', 'daily_aggregation', 'serialization']
+
+# Rows of the fixed reference workload
+REFERENCE_ROWS = 2000000
+
+
+def dataset_key(rows: int, seed: int):
+
+    return f'line_items/rows={rows}_seed={seed}.csv'
+
+
+def peak_rss_mb():
+
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+
+    # kilobytes on Linux, bytes on macOS
+    return peak / 1024 ** 2 if sys.platform == 'darwin' else peak / 1024
+
+
+def environment():
+
+    return {
+        'python': platform.python_version(),
+        'pandas': pd.__version__,
+        'machine': platform.machine(),
+        'cpu_count': os.cpu_count(),
+    }
+
+
+# Baselines are recorded per Python & pandas minor version and architecture
+def environment_key(env: dict):
+
+    return f"python{'.'.join(env['python'].split('.')[:2])}-pandas{'.'.join(env['pandas'].split('.')[:2])}-{env['machine']}"
+
+
+# ========================================================================
+# Generate line items (subprocess)
+# ========================================================================
+
+# Written the way Athena writes a result CSV, one batch of customers at a time
+
+def generate_dataset(rows: int, seed: int):
+
+    from common.local_backend import _local_path
+    from common.queries import LINE_ITEM_COLUMNS
+    from common.synthetic import customers_for_rows, iter_line_items
+
+    path = _local_path(BENCHMARK_BUCKET, dataset_key(rows, seed))
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+
+    customer_count = customers_for_rows(rows)
+
+    logger.info(f'Generating ~{rows} line items for {customer_count} customers to {path}')
+
+    written = 0
+
+    with open(f'{path}.tmp', 'w', newline='') as f:
+
+        for batch, batch_df in enumerate(iter_line_items(customer_count=customer_count, seed=seed)):
+
+            batch_df[LINE_ITEM_COLUMNS].to_csv(f, index=False, header=batch == 0, quoting=csv.QUOTE_ALL,
+                                               date_format='%Y-%m-%d %H:%M:%S.000')
+            written += len(batch_df)
+
+    os.replace(f'{path}.tmp', path)
+
+    logger.info(f'Generated {written} line items')
+
+
+# ========================================================================
+# Measure the stages (subprocess)
+# ========================================================================
+
+def measure(rows: int, seed: int):
+
+    from common.athena import CATEGORY_COLUMNS, read_athena_csv_results
+    from common.aws import get_s3_client
+    from common.customer_state import empty_customer_state, merge_customer_state
+    from common.daily_stats import (apply_customer_features, compute_daily_stats, customer_first_order_dates, encode_keys,
+                                    prepare_line_items)
+    from common.sinks import serialize_daily_stats
+
+    # Only the benchmark's own progress, not every stage's logging
+    logger.disable('common')
+
+    results = {}
+
+    def timed(stage: str, fn):
+
+        start = time.perf_counter()
+        value = fn()
+        results[stage] = {'seconds': round(time.perf_counter() - start, 3), 'peak_rss_mb': round(peak_rss_mb(), 1)}
+
+        logger.info(f"{rows} rows - {stage}: {results[stage]['seconds']:.3f}s, peak RSS {results[stage]['peak_rss_mb']:.0f} MB")
+
+        return value
+
+    # The same work at every size, run first so its peak RSS is the libraries' own
+    def reference():
+
+        rng = np.random.default_rng(0)
+
+        df = pd.DataFrame({'key': rng.integers(0, REFERENCE_ROWS // 10, REFERENCE_ROWS),
+                           'value': rng.random(REFERENCE_ROWS)})
+
+        totals_df = df.groupby('key', as_index=False)['value'].sum().sort_values('value')
+
+        return totals_df.head(200000).to_csv(index=False)
+
+    timed('reference', reference)
+
+    line_items_df = timed('parse', lambda: read_athena_csv_results(s3_client=get_s3_client(),
+                                                                   output_location=f's3://{BENCHMARK_BUCKET}/{dataset_key(rows, seed)}',
+                                                                   column_info=LINE_ITEM_COLUMN_INFO,
+                                                                   category_columns=CATEGORY_COLUMNS))
+
+    line_item_count = len(line_items_df)
+
+    line_items_df, key_dictionaries = timed('prepare', lambda: encode_keys(prepare_line_items(line_items_df)))
+
+    first_dates, first_order_df = timed('first_order', lambda: customer_first_order_dates(line_items_df, customers=key_dictionaries['email']))
+
+    daily_stats_df = timed('daily_aggregation', lambda: compute_daily_stats(apply_customer_features(line_items_df, first_dates)))
+
+    def serialize():
+
+        # One file per day, as the backfill writes them, plus the customer state
+        partitions = [serialize_daily_stats(day_df) for _, day_df in daily_stats_df.groupby('order_date')]
+
+        with io.StringIO() as csv_buffer:
+            merge_customer_state(state_df=empty_customer_state(), first_order_df=first_order_df).to_csv(csv_buffer, index=False)
+            return partitions, csv_buffer.getvalue()
+
+    timed('serialization', serialize)
+
+    return {'rows': line_item_count, 'stages': results}
+
+
+# ========================================================================
+# Compare with the baselines
+# ========================================================================
+
+# Returns a description of every stage that regressed. The baseline's times
+# are scaled by how long the reference took here against there, and peak RSS
+# is compared above the reference's, only when both ran in one environment.
+
+def compare_to_baseline(size: int, result: dict, baseline: dict, compare_rss: bool = True):
+
+    regressions = []
+
+    speed = result['stages']['reference']['seconds'] / baseline['stages']['reference']['seconds']
+
+    def stage_rss(stages: dict, stage: str):
+        return stages[stage]['peak_rss_mb'] - stages['reference']['peak_rss_mb']
+
+    for stage in STAGES:
+
+        current, previous = result['stages'][stage], baseline['stages'].get(stage)
+
+        if previous is None:
+            continue
+
+        expected_seconds = previous['seconds'] * speed
+
+        if current['seconds'] > expected_seconds * (1 + TIME_TOLERANCE) + TIME_SLACK_SECONDS:
+            regressions.append(f"{size} rows - {stage}: {current['seconds']:.3f}s vs baseline {expected_seconds:.3f}s "
+                               f"({previous['seconds']:.3f}s at reference speed {speed:.2f}x)")
+
+        if not compare_rss:
+            continue
+
+        current_rss, previous_rss = stage_rss(result['stages'], stage), stage_rss(baseline['stages'], stage)
+
+        if current_rss > previous_rss * (1 + RSS_TOLERANCE) + RSS_SLACK_MB:
+            regressions.append(f"{size} rows - {stage}: peak RSS +{current_rss:.0f} MB vs baseline +{previous_rss:.0f} MB over the reference")
+
+    return regressions
+
+
+def report(size: int, result: dict, baseline: dict = None):
+
+    logger.info(f"{size} rows ({result['rows']} generated)")
+    logger.info(f"  {'stage':<20}{'seconds':>10}{'baseline':>10}{'peak MB':>10}{'baseline':>10}")
+
+    for stage in ['reference'] + STAGES:
+
+        current = result['stages'][stage]
+        previous = (baseline or {}).get('stages', {}).get(stage, {})
+
+        logger.info(f"  {stage:<20}{current['seconds']:>10.3f}{previous.get('seconds', float('nan')):>10.3f}"
+                    f"{current['peak_rss_mb']:>10.0f}{previous.get('peak_rss_mb', float('nan')):>10.0f}")
+
+
+# Baseline of a size: this environment's, else another's for times only
+def find_baseline(baselines: dict, size: int):
+
+    current_key = environment_key(environment())
+
+    recorded = baselines['environments'].get(current_key, {}).get('sizes', {})
+
+    if str(size) in recorded:
+        return recorded[str(size)], True
+
+    for key, entry in sorted(baselines['environments'].items()):
+        if str(size) in entry['sizes']:
+            logger.warning(f'No {size} rows baseline for {current_key}, comparing times with {key}')
+            return entry['sizes'][str(size)], False
+
+    return None, False
+
+
+# ========================================================================
+# Execute Code
+# ========================================================================
+
+if args.generate is not None:
+    generate_dataset(args.generate, seed=args.seed)
+    sys.exit(0)
+
+if args.measure is not None:
+    print(json.dumps(measure(args.measure, seed=args.seed)))
+    sys.exit(0)
+
+# Children read the generated files through the local backend
+child_env = dict(os.environ, PIPELINE_BACKEND='local', LOCAL_DATA_DIR=args.data_dir)
+
+baselines = {'environments': {}}
+
+if os.path.exists(args.baselines):
+    with open(args.baselines) as f:
+        baselines = json.load(f)
+
+current_key = environment_key(environment())
+
+regressions = []
+results = {}
+recorded = {}
+
+for size in args.sizes:
+
+    if not os.path.exists(os.path.join(args.data_dir, 's3', BENCHMARK_BUCKET, *dataset_key(size, args.seed).split('/'))):
+        subprocess.run([sys.executable, __file__, '--generate', str(size), '--seed', str(args.seed)], env=child_env, check=True)
+
+    try:
+        completed = subprocess.run([sys.executable, __file__, '--measure', str(size), '--seed', str(args.seed)],
+                                   env=child_env, check=True, stdout=subprocess.PIPE, text=True)
+    except subprocess.CalledProcessError as e:
+        logger.error(f'{size} rows failed (exit code {e.returncode})')
+        regressions.append(f'{size} rows failed')
+        continue
+
+    results[size] = json.loads(completed.stdout.strip().splitlines()[-1])
+
+    baseline, same_environment = find_baseline(baselines, size)
+
+    report(size, results[size], baseline)
+
+    if args.update_baselines or (args.record_missing and not same_environment):
+        recorded[size] = results[size]
+
+    if baseline is None:
+        logger.info(f'No baseline for {size} rows')
+    elif not args.update_baselines:
+        regressions += compare_to_baseline(size, results[size], baseline, compare_rss=same_environment)
+
+if recorded:
+
+    entry = baselines['environments'].setdefault(current_key, {'sizes': {}})
+    entry['environment'] = environment()
+    entry['sizes'].update({str(size): result for size, result in recorded.items()})
+
+    with open(args.baselines, 'w') as f:
+        json.dump(baselines, f, indent=2, sort_keys=True)
+        f.write('\n')
+
+    logger.info(f'Baselines for {", ".join(str(size) for size in recorded)} rows on {current_key} written to {args.baselines}')
+
+for regression in regressions:
+    logger.error(f'Regression: {regression}')
+
+sys.exit(1 if regressions else 0)
@@ -0,0 +1,68 @@
+from loguru import logger
+import argparse
+import os
+import shutil
+import sys
+import pyarrow as pa
+import pyarrow.parquet as pq
+
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from common.local_backend import LOCAL_LINE_ITEMS_DIR
+from common.synthetic import (DEFAULT_CUSTOMER_COUNT, DEFAULT_DAYS, DEFAULT_DAYS_BETWEEN_ORDERS, DEFAULT_GUEST_ORDER_SHARE,
+                              DEFAULT_LINE_ITEMS_PER_ORDER, DEFAULT_REPEAT_PROBABILITY, customers_for_rows, iter_line_items)
+
+
+# ========================================================================
+# Arguments
+# ========================================================================
+
+# Writes synthetic shopify_line_items as Parquet in partition_date=YYYY-MM-DD/
+# directories, the layout the local backend (PIPELINE_BACKEND=local) reads.
+
+parser = argparse.ArgumentParser(description='Generate synthetic shopify_line_items')
+parser.add_argument('--customers', type=int, default=DEFAULT_CUSTOMER_COUNT, help='Customer count')
+parser.add_argument('--rows', type=int, default=None, help='Approximate line item count, overrides --customers')
+parser.add_argument('--days', type=int, default=DEFAULT_DAYS, help='Days of order history')
+parser.add_argument('--end-date', default=None, help='Last order date (YYYY-MM-DD), defaults to yesterday')
+parser.add_argument('--repeat-probability', type=float, default=DEFAULT_REPEAT_PROBABILITY, help='Chance of another order after each order')
+parser.add_argument('--days-between-orders', type=float, default=DEFAULT_DAYS_BETWEEN_ORDERS, help='Mean days between a customer\'s orders')
+parser.add_argument('--line-items-per-order', type=float, default=DEFAULT_LINE_ITEMS_PER_ORDER, help='Mean line items per order')
+parser.add_argument('--guest-order-share', type=float, default=DEFAULT_GUEST_ORDER_SHARE, help='Share of orders without an email')
+parser.add_argument('--seed', type=int, default=0, help='Random seed, the same seed gives the same rows')
+parser.add_argument('--out', default=LOCAL_LINE_ITEMS_DIR, help='Output directory')
+parser.add_argument('--overwrite', action='store_true', help='Replace an existing output directory')
+args = parser.parse_args()
+
+
+# ========================================================================
+# Execute Code
+# ========================================================================
+
+if os.path.isdir(args.out) and os.listdir(args.out):
+
+    if not args.overwrite:
+        logger.error(f'{args.out} is not empty, pass --overwrite to replace it')
+        sys.exit(1)
+
+    shutil.rmtree(args.out)
+
+params = dict(days=args.days, end_date=args.end_date, repeat_probability=args.repeat_probability,
+              days_between_orders=args.days_between_orders, line_items_per_order=args.line_items_per_order,
+              guest_order_share=args.guest_order_share)
+
+customer_count = customers_for_rows(args.rows, **params) if args.rows is not None else args.customers
+
+logger.info(f'Generating line items for {customer_count} customers over {args.days} days into {args.out}')
+
+rows = 0
+
+for batch, batch_df in enumerate(iter_line_items(customer_count=customer_count, seed=args.seed, **params)):
+
+    pq.write_to_dataset(pa.Table.from_pandas(batch_df, preserve_index=False), root_path=args.out,
+                        partition_cols=['partition_date'], basename_template=f'part-{batch:05d}-{{i}}.parquet')
+
+    rows += len(batch_df)
+
+    logger.info(f'Batch {batch}: {rows} line items written')
+
+logger.info(f'Wrote {rows} line items for {customer_count} customers to {args.out}')
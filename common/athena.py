@@ -0,0 +1,657 @@
+from botocore.exceptions import ClientError
+from loguru import logger
+import time
+import numpy as np
+import pandas as pd
+from common.aws import get_athena_client, get_s3_client
+from common.throttle import (ATHENA_MAX_CONCURRENT, ATHENA_WORKGROUP, AdaptiveConcurrencyLimiter, backoff_delay,
+                             call_with_backoff, get_workgroup_limiter, is_throttled_query)
+from common.unload import build_unload_query, iter_s3_parquet_prefix_chunks, list_s3_parquet_objects, read_s3_parquet_prefix
+
+
+ATHENA_OUTPUT_LOCATION = 's3://prymal-ops/athena_query_results/'
+
+# States in which a query is still in progress
+ATHENA_ACTIVE_STATES = ['RUNNING', 'QUEUED']
+
+# batch_get_query_execution accepts at most 50 ids per call
+ATHENA_BATCH_SIZE = 50
+
+
+# ---------------------------------------
+# QUERY EXECUTOR
+# ---------------------------------------
+
+class AthenaQueryExecutor:
+
+    """Starts Athena queries and waits on them with exponential backoff.
+
+    Many queries can be in flight at once; all of them are polled together
+    with batch_get_query_execution instead of one tight loop per query.
+    Starting a query takes a slot from the workgroup's shared adaptive
+    limiter, which is handed back once the query finishes. Throttled starts
+    are retried with jitter, queries Athena failed for capacity are
+    resubmitted.
+    """
+
+    def __init__(self, athena_client, output_location: str = ATHENA_OUTPUT_LOCATION,
+                 initial_delay: float = 0.25, max_delay: float = 10.0, backoff_factor: float = 2.0,
+                 max_concurrent: int = ATHENA_MAX_CONCURRENT, workgroup: str = ATHENA_WORKGROUP,
+                 limiter: AdaptiveConcurrencyLimiter = None, max_query_attempts: int = 3):
+
+        self.athena_client = athena_client
+        self.output_location = output_location
+        self.initial_delay = initial_delay
+        self.max_delay = max_delay
+        self.backoff_factor = backoff_factor
+        self.max_concurrent = max_concurrent
+        self.workgroup = workgroup
+        self.limiter = limiter if limiter is not None else get_workgroup_limiter(workgroup)
+        self.max_query_attempts = max_query_attempts
+        self._holding = set()
+
+    # Start a query and return its execution id
+    # -----------
+
+    def start(self, query: str, database: str):
+
+        self.limiter.acquire()
+
+        try:
+            response = call_with_backoff(
+                self.athena_client.start_query_execution,
+                QueryString=query,
+                QueryExecutionContext={
+                    'Database': database
+                },
+                ResultConfiguration={
+                    'OutputLocation': self.output_location
+                },
+                WorkGroup=self.workgroup,
+                limiter=self.limiter
+            )
+
+        except Exception:
+            self.limiter.release()
+            raise
+
+        self._holding.add(response['QueryExecutionId'])
+
+        return response['QueryExecutionId']
+
+    # Poll a set of running queries once, return the ones that finished
+    # -----------
+
+    def _poll(self, query_execution_ids: list):
+
+        finished = {}
+
+        for i in range(0, len(query_execution_ids), ATHENA_BATCH_SIZE):
+
+            response = call_with_backoff(
+                self.athena_client.batch_get_query_execution,
+                QueryExecutionIds=query_execution_ids[i:i + ATHENA_BATCH_SIZE]
+            )
+
+            for query_execution in response.get('QueryExecutions', []):
+
+                state = query_execution['Status']['State']
+
+                if state not in ATHENA_ACTIVE_STATES:
+                    finished[query_execution['QueryExecutionId']] = query_execution
+                    _log_final_state(query_execution)
+
+        # Finished queries give their slot back
+        for query_execution_id in finished:
+            if query_execution_id in self._holding:
+                self._holding.discard(query_execution_id)
+                self.limiter.release()
+
+        return finished
+
+    # Wait for running queries to reach a final state
+    # -----------
+
+    def wait_all(self, query_execution_ids: list):
+
+        pending = list(query_execution_ids)
+        results = {}
+        delay = self.initial_delay
+
+        while pending:
+
+            logger.info(f'{len(pending)} queries RUNNING or QUEUED..')
+
+            time.sleep(delay)
+
+            finished = self._poll(pending)
+            results.update(finished)
+            pending = [q for q in pending if q not in finished]
+
+            delay = min(delay * self.backoff_factor, self.max_delay)
+
+        return results
+
+    def wait(self, query_execution_id: str):
+
+        return self.wait_all([query_execution_id])[query_execution_id]
+
+    # Run a single query to completion
+    # -----------
+
+    def run(self, query: str, database: str):
+
+        for attempt in range(self.max_query_attempts):
+
+            query_execution = self.wait(self.start(query=query, database=database))
+
+            if not is_throttled_query(query_execution) or attempt == self.max_query_attempts - 1:
+                return query_execution
+
+            self.limiter.on_throttle()
+            time.sleep(backoff_delay(attempt))
+
+    # Run many queries, keeping at most max_concurrent in flight
+    # -----------
+
+    # The workgroup limiter may hold the count lower, e.g. while another job
+    # shares the workgroup or Athena is throttling.
+
+    def run_many(self, queries: list, database: str):
+
+        queued = [(position, query, 0) for position, query in enumerate(queries)]
+        in_flight = {}
+        results = [None] * len(queries)
+        delay = self.initial_delay
+
+        while queued or in_flight:
+
+            # Top up the in-flight set (always keep one query going)
+            while queued and len(in_flight) < self.max_concurrent and (not in_flight or self.limiter.has_capacity()):
+                position, query, attempt = queued.pop(0)
+                in_flight[self.start(query=query, database=database)] = (position, query, attempt)
+
+            logger.info(f'{len(in_flight)} queries in flight, {len(queued)} waiting to start..')
+
+            time.sleep(delay)
+
+            finished = self._poll(list(in_flight))
+
+            for query_execution_id, query_execution in finished.items():
+
+                position, query, attempt = in_flight.pop(query_execution_id)
+
+                # Rejected for capacity - try again rather than dropping it
+                if is_throttled_query(query_execution) and attempt + 1 < self.max_query_attempts:
+                    self.limiter.on_throttle()
+                    queued.append((position, query, attempt + 1))
+                    continue
+
+                results[position] = query_execution
+
+            # Back off only while nothing is completing
+            delay = self.initial_delay if finished else min(delay * self.backoff_factor, self.max_delay)
+
+        return results
+
+
+def _log_final_state(query_execution: dict):
+
+    state = query_execution['Status']['State']
+
+    if state == 'SUCCEEDED':
+        data_scanned = query_execution.get('Statistics', {}).get('DataScannedInBytes', 0)
+        logger.info(f"Query Succeeded! ({query_execution['QueryExecutionId']}) - {data_scanned / 1024 ** 2:.2f} MB scanned")
+    else:
+        reason = query_execution['Status'].get('StateChangeReason', '')
+        logger.error(f"Query {state}! ({query_execution['QueryExecutionId']}) {reason}")
+
+
+def _log_athena_client_error(e: ClientError):
+
+    error_code = e.response['Error']['Code']
+    error_message = e.response['Error']['Message']
+
+    if error_code == 'InvalidRequestException':
+        logger.error(f"Invalid Request Exception: {error_message}")
+        # Handle issues with the Athena request, such as invalid SQL syntax
+
+    elif error_code == 'ResourceNotFoundException':
+        logger.error(f"Resource Not Found Exception: {error_message}")
+        # Handle cases where the database or query execution does not exist
+
+    elif error_code == 'AccessDeniedException':
+        logger.error(f"Access Denied Exception: {error_message}")
+        # Handle cases where the IAM role does not have sufficient permissions
+
+    else:
+        logger.error(f"Athena Error: {error_code} - {error_message}")
+        # Handle other Athena-related errors
+
+
+# ---------------------------------------
+# RESULT TYPES
+# ---------------------------------------
+
+# Athena ColumnInfo types -> pandas dtypes
+ATHENA_INT_TYPES = ['tinyint', 'smallint', 'integer', 'int', 'bigint']
+ATHENA_FLOAT_TYPES = ['float', 'real', 'double', 'decimal']
+ATHENA_DATE_TYPES = ['date', 'timestamp']
+
+
+def athena_type_to_dtype(athena_type: str):
+
+    athena_type = athena_type.lower()
+
+    if athena_type in ATHENA_INT_TYPES:
+        return 'Int64'
+    elif athena_type in ATHENA_FLOAT_TYPES:
+        return 'float64'
+    elif athena_type == 'boolean':
+        return 'boolean'
+    elif athena_type in ATHENA_DATE_TYPES:
+        return 'datetime64[ns]'
+    else:
+        return 'object'
+
+
+# Convert a column of Athena result strings to its pandas dtype
+# -----------
+
+def convert_athena_column(values: pd.Series, athena_type: str):
+
+    dtype = athena_type_to_dtype(athena_type)
+
+    if dtype == 'Int64':
+        return pd.to_numeric(values).astype('Int64')
+    elif dtype == 'float64':
+        return pd.to_numeric(values).astype('float64')
+    elif dtype == 'boolean':
+        return values.str.lower().map({'true': True, 'false': False}).astype('boolean')
+    elif dtype == 'datetime64[ns]':
+        return pd.to_datetime(values)
+    else:
+        return values
+
+
+# Low cardinality string columns returned as pandas categoricals
+CATEGORY_COLUMNS = ('email',)
+
+
+# Typed, column-oriented parser for get_query_results pages
+# -----------
+
+class ColumnarResultParser:
+
+    """Builds a DataFrame from get_query_results pages one column at a time.
+
+    Each page is transposed and converted to its Athena ColumnInfo type as it
+    arrives, so only one page of raw strings is alive at once. Category
+    columns are dictionary encoded into int32 codes while paging.
+    """
+
+    def __init__(self, column_info: list, category_columns: tuple = CATEGORY_COLUMNS):
+
+        self.column_info = column_info
+        self.chunks = [[] for _ in column_info]
+        self.categories = {col['Name']: {} for col in column_info if col['Name'] in category_columns}
+
+    def add_page(self, rows: list):
+
+        if not rows:
+            return
+
+        # Transpose the page into one tuple of raw values per column
+        columns = list(zip(*[[cell.get('VarCharValue') for cell in row['Data']] for row in rows]))
+
+        for i, col in enumerate(self.column_info):
+            self.chunks[i].append(self._convert(col, columns[i]))
+
+    def _convert(self, col: dict, values: tuple):
+
+        if col['Name'] in self.categories:
+
+            lookup = self.categories[col['Name']]
+
+            return np.fromiter((-1 if v is None else lookup.setdefault(v, len(lookup)) for v in values),
+                               dtype=np.int32, count=len(values))
+
+        return convert_athena_column(pd.Series(values, dtype='object'), col['Type'])
+
+    def to_frame(self):
+
+        data = {}
+
+        for col, chunks in zip(self.column_info, self.chunks):
+
+            if col['Name'] in self.categories:
+                codes = np.concatenate(chunks) if chunks else np.array([], dtype=np.int32)
+                data[col['Name']] = pd.Categorical.from_codes(codes, categories=list(self.categories[col['Name']]))
+
+            elif chunks:
+                data[col['Name']] = pd.concat(chunks, ignore_index=True)
+
+            else:
+                data[col['Name']] = convert_athena_column(pd.Series([], dtype='object'), col['Type'])
+
+        return pd.DataFrame(data)
+
+
+# ---------------------------------------
+# S3 RESULT FILE READER
+# ---------------------------------------
+
+# Rows per chunk when streaming a result CSV from S3
+CSV_CHUNKSIZE = 250000
+
+
+def split_s3_uri(uri: str):
+
+    bucket, _, key = uri.replace('s3://', '', 1).partition('/')
+
+    return bucket, key
+
+
+# Stream the result CSV of a finished query in typed chunks
+# -----------
+
+def iter_athena_csv_chunks(s3_client, output_location: str, column_info: list, chunksize: int = CSV_CHUNKSIZE):
+
+    bucket, key = split_s3_uri(output_location)
+
+    logger.info(f'Streaming query results from {output_location}')
+
+    # Numeric columns are parsed by read_csv directly, dates are converted per chunk
+    dtypes = {}
+    date_cols = []
+
+    for col in column_info:
+        dtype = athena_type_to_dtype(col['Type'])
+
+        if dtype == 'datetime64[ns]':
+            dtypes[col['Name']] = 'object'
+            date_cols.append(col['Name'])
+        else:
+            dtypes[col['Name']] = dtype
+
+    response = s3_client.get_object(Bucket=bucket, Key=key)
+
+    for chunk_df in pd.read_csv(response['Body'], dtype=dtypes, chunksize=chunksize):
+
+        for col in date_cols:
+            chunk_df[col] = pd.to_datetime(chunk_df[col])
+
+        yield chunk_df
+
+
+def read_athena_csv_results(s3_client, output_location: str, column_info: list, chunksize: int = CSV_CHUNKSIZE,
+                            category_columns: tuple = ()):
+
+    chunks = list(iter_athena_csv_chunks(s3_client=s3_client,
+                                         output_location=output_location,
+                                         column_info=column_info,
+                                         chunksize=chunksize))
+
+    if not chunks:
+        return pd.DataFrame(columns=[col['Name'] for col in column_info])
+
+    results_df = pd.concat(chunks, ignore_index=True)
+
+    for col in category_columns:
+        if col in results_df.columns:
+            results_df[col] = results_df[col].astype('category')
+
+    logger.info(f'Read {len(results_df)} rows from {output_location}')
+
+    return results_df
+
+
+# ---------------------------------------
+# FUNCTIONS
+# ---------------------------------------
+
+# FUNCTION TO EXECUTE ATHENA QUERY AND RETURN RESULTS
+# ----------
+
+# fetch_mode:
+#   'paginate' - page through get_query_results 1000 rows at a time
+#   's3_csv'   - stream the result CSV Athena wrote to the output location
+#   'auto'     - paginate if the result fits in one page, otherwise stream the CSV
+#   'unload'   - UNLOAD the query to Parquet and read the files in parallel
+
+#
+# A query that fails, or can't be started, raises - there is no result to
+# fall back on, so callers decide whether the job can go on without it.
+
+def run_athena_query(query:str, database: str, region:str, fetch_mode: str = 'auto', chunksize: int = CSV_CHUNKSIZE,
+                     category_columns: tuple = CATEGORY_COLUMNS):
+
+    # Initialize Athena client
+    athena_client = get_athena_client(region)
+
+    executor = AthenaQueryExecutor(athena_client)
+
+    # Execute the query
+    try:
+        if fetch_mode == 'unload':
+            return AthenaQueryResult(query=query, database=database, region=region, fetch_mode=fetch_mode, executor=executor).read()
+
+        query_execution = _raise_unless_succeeded(executor.run(query=query, database=database))
+
+        return fetch_athena_query_results(query_execution=query_execution,
+                                          region=region,
+                                          fetch_mode=fetch_mode,
+                                          chunksize=chunksize,
+                                          category_columns=category_columns)
+
+    except ClientError as e:
+        _log_athena_client_error(e)
+        raise
+
+
+# Fetch the results of a finished query
+# ----------
+
+# fetch_mode as for run_athena_query, except 'unload' which needs its own query
+
+def fetch_athena_query_results(query_execution: dict, region: str, fetch_mode: str = 'auto', chunksize: int = CSV_CHUNKSIZE,
+                               category_columns: tuple = CATEGORY_COLUMNS):
+
+    athena_client = get_athena_client(region)
+
+    query_execution_id = query_execution['QueryExecutionId']
+
+    # OBTAIN DATA
+    # --------------
+
+    query_results = call_with_backoff(athena_client.get_query_results, QueryExecutionId=query_execution_id,
+                                      MaxResults= 1 if fetch_mode == 's3_csv' else 1000)
+
+    # Extract qury result column names into a list
+    cols = query_results['ResultSet']['ResultSetMetadata']['ColumnInfo']
+
+    # Large results - read the CSV Athena already wrote instead of paginating
+    if fetch_mode == 's3_csv' or (fetch_mode == 'auto' and 'NextToken' in query_results):
+
+        output_location = query_execution['ResultConfiguration']['OutputLocation']
+
+        return read_athena_csv_results(s3_client=get_s3_client(region),
+                                       output_location=output_location,
+                                       column_info=cols,
+                                       chunksize=chunksize,
+                                       category_columns=category_columns)
+
+    # Parse the pages column by column into typed buffers
+    parser = ColumnarResultParser(column_info=cols, category_columns=category_columns)
+
+    # Skip the header row on the first page
+    parser.add_page(query_results['ResultSet']['Rows'][1:])
+
+    # Paginate Results if necessary
+    while 'NextToken' in query_results:
+            query_results = call_with_backoff(athena_client.get_query_results, QueryExecutionId=query_execution_id,
+                                              NextToken=query_results['NextToken'],
+                                              MaxResults= 1000)
+
+            parser.add_page(query_results['ResultSet']['Rows'])
+
+    return parser.to_frame()
+
+
+# Run a query, leaving its results in S3
+# ----------
+
+# For callers that look at the result before deciding how to read it.
+# Errors are raised rather than logged, there is no result to fall back on.
+
+def _raise_unless_succeeded(query_execution: dict):
+
+    if query_execution['Status']['State'] != 'SUCCEEDED':
+        raise RuntimeError(f"Query {query_execution['Status']['State']}: {query_execution['Status'].get('StateChangeReason', '')}")
+
+    return query_execution
+
+
+def execute_athena_query(query: str, database: str, region: str):
+
+    return _raise_unless_succeeded(AthenaQueryExecutor(get_athena_client(region)).run(query=query, database=database))
+
+
+# Size of the result CSV a finished query wrote
+def get_athena_result_bytes(query_execution: dict, region: str):
+
+    bucket, key = split_s3_uri(query_execution['ResultConfiguration']['OutputLocation'])
+
+    return get_s3_client(region).head_object(Bucket=bucket, Key=key)['ContentLength']
+
+
+# Stream the result CSV of a finished query back in chunks
+# ----------
+
+# For consumers that reduce the rows as they arrive (common/streaming.py,
+# common/out_of_core.py) instead of building one DataFrame.
+
+def iter_athena_result_chunks(query_execution: dict, region: str, chunksize: int = CSV_CHUNKSIZE):
+
+    # Column types come from the first page of the results
+    query_results = call_with_backoff(get_athena_client(region).get_query_results, QueryExecutionId=query_execution['QueryExecutionId'],
+                                      MaxResults=1)
+
+    yield from iter_athena_csv_chunks(s3_client=get_s3_client(region),
+                                      output_location=query_execution['ResultConfiguration']['OutputLocation'],
+                                      column_info=query_results['ResultSet']['ResultSetMetadata']['ColumnInfo'],
+                                      chunksize=chunksize)
+
+
+def iter_athena_query_chunks(query: str, database: str, region: str, chunksize: int = CSV_CHUNKSIZE):
+
+    query_execution = execute_athena_query(query=query, database=database, region=region)
+
+    yield from iter_athena_result_chunks(query_execution=query_execution, region=region, chunksize=chunksize)
+
+
+# ---------------------------------------
+# QUERY RESULTS LEFT IN S3
+# ---------------------------------------
+
+# Runs a query up front and leaves its result in S3, so the caller can size
+# it before choosing how to read it: whole, or chunk by chunk. fetch_mode
+# 'unload' runs the query as an UNLOAD and the result is its Parquet output,
+# any other mode runs the query as is and the result is the CSV Athena wrote.
+# An UNLOAD without rows writes no files, its empty result still has the
+# query's columns and types.
+
+class AthenaQueryResult:
+
+    def __init__(self, query: str, database: str, region: str, fetch_mode: str = 'auto', executor: AthenaQueryExecutor = None):
+
+        self.query = query
+        self.database = database
+        self.region = region
+        self.fetch_mode = fetch_mode
+        self.result_format = 'parquet' if fetch_mode == 'unload' else 'csv'
+
+        executor = executor if executor is not None else AthenaQueryExecutor(get_athena_client(region))
+
+        self.executor = executor
+
+        if self.result_format == 'parquet':
+            unload_query, unload_location = build_unload_query(query=query, output_location=executor.output_location)
+            self.query_execution = _raise_unless_succeeded(executor.run(query=unload_query, database=database))
+            self.bucket, self.prefix = split_s3_uri(unload_location)
+        else:
+            self.query_execution = _raise_unless_succeeded(executor.run(query=query, database=database))
+
+    def result_bytes(self):
+
+        if self.result_format == 'parquet':
+            return sum(obj['Size'] for obj in list_s3_parquet_objects(s3_client=get_s3_client(self.region),
+                                                                      bucket=self.bucket, prefix=self.prefix))
+
+        return get_athena_result_bytes(self.query_execution, region=self.region)
+
+    def read(self, chunksize: int = CSV_CHUNKSIZE, category_columns: tuple = CATEGORY_COLUMNS):
+
+        if self.result_format == 'parquet':
+
+            if not list_s3_parquet_objects(s3_client=get_s3_client(self.region), bucket=self.bucket, prefix=self.prefix):
+                return self.empty_frame()
+
+            return read_s3_parquet_prefix(s3_client=get_s3_client(self.region), bucket=self.bucket, prefix=self.prefix)
+
+        return fetch_athena_query_results(query_execution=self.query_execution, region=self.region, fetch_mode=self.fetch_mode,
+                                          chunksize=chunksize, category_columns=category_columns)
+
+    # The query's columns without any rows, typed as the CSV path types them
+    # (Athena answers a LIMIT 0 without scanning)
+    def empty_frame(self):
+
+        query_execution = _raise_unless_succeeded(self.executor.run(query=f"SELECT * FROM ({self.query.strip().rstrip(';')}) LIMIT 0",
+                                                                    database=self.database))
+
+        return fetch_athena_query_results(query_execution=query_execution, region=self.region, fetch_mode='paginate',
+                                          category_columns=())
+
+    def iter_chunks(self, chunksize: int = CSV_CHUNKSIZE):
+
+        if self.result_format == 'parquet':
+            return iter_s3_parquet_prefix_chunks(s3_client=get_s3_client(self.region), bucket=self.bucket, prefix=self.prefix,
+                                                 chunksize=chunksize)
+
+        return iter_athena_result_chunks(self.query_execution, region=self.region, chunksize=chunksize)
+
+
+# --------------
+# Function to run Athena query , not return results
+# --------------
+
+# Raises unless the query succeeded
+
+def run_athena_query_no_results(query:str, database: str, region: str = 'us-east-1'):
+
+    return _raise_unless_succeeded(run_athena_queries_no_results(queries=[query], database=database, region=region)[0])
+
+
+# --------------
+# Function to run many Athena queries concurrently, not return results
+# --------------
+
+# Returns each query's final execution, in order - callers check every
+# State, as one query failing doesn't stop the others. A query that can't be
+# started raises.
+
+def run_athena_queries_no_results(queries: list, database: str, region: str = 'us-east-1',
+                                  max_concurrent: int = ATHENA_MAX_CONCURRENT):
+
+    # Initialize Athena client
+    athena_client = get_athena_client(region)
+
+    executor = AthenaQueryExecutor(athena_client, max_concurrent=max_concurrent)
+
+    # Execute the queries
+    try:
+        return executor.run_many(queries=queries, database=database)
+
+    except ClientError as e:
+        _log_athena_client_error(e)
+        raise
@@ -0,0 +1,93 @@
+import os
+import threading
+import boto3
+from botocore.config import Config
+
+
+# ---------------------------------------
+# SHARED AWS SESSION & CLIENTS
+# ---------------------------------------
+
+# One boto3 session per region and one client per (service, region) for the
+# whole process. Credential and endpoint resolution happen once, and every
+# caller reuses the client's connection pool instead of opening new TLS
+# connections. boto3 clients are thread-safe once built; the lock only
+# guards creating them.
+
+REGION = 'us-east-1'
+
+# 'aws', or 'local' to run against files on disk (common/local_backend.py)
+PIPELINE_BACKEND = os.environ.get('PIPELINE_BACKEND', 'aws')
+
+# Sized for the concurrent partition writes and Athena polling of a backfill
+MAX_POOL_CONNECTIONS = int(os.environ.get('AWS_MAX_POOL_CONNECTIONS', 50))
+
+CLIENT_CONFIG = Config(
+    max_pool_connections=MAX_POOL_CONNECTIONS,
+    retries={'max_attempts': 10, 'mode': 'standard'},
+    connect_timeout=10,
+    read_timeout=60,
+)
+
+# Athena throttling is retried by common/throttle.py, which also lowers the
+# query concurrency, so botocore only makes a couple of quick attempts. S3
+# uses botocore's adaptive mode, which rate limits the client on SlowDown.
+SERVICE_CONFIGS = {
+    'athena': CLIENT_CONFIG.merge(Config(retries={'max_attempts': 2, 'mode': 'standard'})),
+    's3': CLIENT_CONFIG.merge(Config(retries={'max_attempts': 10, 'mode': 'adaptive'})),
+}
+
+_lock = threading.Lock()
+_sessions = {}
+_clients = {}
+
+
+def get_session(region: str = REGION):
+
+    with _lock:
+        if region not in _sessions:
+            _sessions[region] = boto3.Session(region_name=region,
+                                              aws_access_key_id=os.environ.get('AWS_ACCESS_KEY'),
+                                              aws_secret_access_key=os.environ.get('AWS_ACCESS_SECRET'))
+
+        return _sessions[region]
+
+
+def get_client(service: str, region: str = REGION):
+
+    key = (service, region)
+
+    if key not in _clients:
+
+        if PIPELINE_BACKEND == 'local':
+
+            from common.local_backend import get_local_client
+
+            with _lock:
+                if key not in _clients:
+                    _clients[key] = get_local_client(service)
+
+            return _clients[key]
+
+        session = get_session(region)
+
+        with _lock:
+            if key not in _clients:
+                _clients[key] = session.client(service, config=SERVICE_CONFIGS.get(service, CLIENT_CONFIG))
+
+    return _clients[key]
+
+
+def get_athena_client(region: str = REGION):
+
+    return get_client('athena', region)
+
+
+def get_s3_client(region: str = REGION):
+
+    return get_client('s3', region)
+
+
+def get_glue_client(region: str = REGION):
+
+    return get_client('glue', region)
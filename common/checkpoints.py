@@ -0,0 +1,95 @@
+import numpy as np
+import pandas as pd
+from loguru import logger
+
+
+# ---------------------------------------
+# BACKFILL SHARDING & CHECKPOINTS
+# ---------------------------------------
+
+BACKFILL_CHECKPOINT_PREFIX = 'shopify/daily_stats_manifests/backfill'
+
+# Days computed and written per step, a checkpoint is saved after each
+CHUNK_DAYS = 31
+
+
+# '--shard 2/4' -> (2, 4), shards are numbered from 0
+# -----------
+
+def parse_shard(shard: str):
+
+    index, count = (int(part) for part in shard.split('/'))
+
+    if count < 1 or not 0 <= index < count:
+        raise ValueError(f'Invalid shard {shard}, expected i/n with 0 <= i < n')
+
+    return index, count
+
+
+# Split a date range between shards, then into chunks
+# -----------
+
+# Each shard gets one contiguous block of days so its chunks can carry the
+# customer first-order state forward from one chunk to the next.
+
+def shard_dates(start_date: str, end_date: str, shard_index: int = 0, shard_count: int = 1):
+
+    dates = pd.date_range(start_date, end_date, freq='D').strftime('%Y-%m-%d').tolist()
+
+    blocks = np.array_split(np.array(dates, dtype=object), shard_count)
+
+    return list(blocks[shard_index])
+
+
+def chunk_dates(dates: list, chunk_days: int = CHUNK_DAYS):
+
+    return [dates[i:i + chunk_days] for i in range(0, len(dates), chunk_days)]
+
+
+def checkpoint_key(run_id: str, shard_index: int, shard_count: int):
+
+    return f'{BACKFILL_CHECKPOINT_PREFIX}/{run_id}/shard_{shard_index}_of_{shard_count}.json'
+
+
+# ---------------------------------------
+# CHECKPOINT
+# ---------------------------------------
+
+class BackfillCheckpoint:
+
+    """Completed dates of one backfill shard, persisted after every chunk.
+
+    A re-run of the same run id and shard loads it and only processes the
+    dates still missing.
+    """
+
+    def __init__(self, store, run_id: str, shard_index: int = 0, shard_count: int = 1):
+
+        self.store = store
+        self.run_id = run_id
+        self.shard = f'{shard_index}/{shard_count}'
+        self.completed = set()
+
+    def load(self, restart: bool = False):
+
+        if not restart and self.store.exists():
+            self.completed = set(self.store.load().get('completed_dates', []))
+            logger.info(f'Resuming backfill {self.run_id} shard {self.shard}: {len(self.completed)} dates already done')
+        else:
+            self.completed = set()
+
+        return self
+
+    def pending(self, dates: list):
+
+        return [d for d in dates if d not in self.completed]
+
+    def mark_completed(self, dates: list):
+
+        self.completed.update(dates)
+
+        self.store.save({
+            'run_id': self.run_id,
+            'shard': self.shard,
+            'completed_dates': sorted(self.completed),
+        })
@@ -0,0 +1,227 @@
+import hashlib
+import re
+from loguru import logger
+import pandas as pd
+from common.athena import run_athena_query
+from common.daily_stats import DAILY_STATS_COLUMNS
+from common.manifests import S3ManifestStore
+from common.partitions import register_partitions
+from common.s3 import _log_s3_error, put_object_if_changed
+from common.sinks import serialize_daily_stats
+
+
+# ---------------------------------------
+# MONTHLY COMPACTION
+# ---------------------------------------
+
+# Closed months of daily partitions are rolled into one Parquet file per month
+# in a companion table. Readers go through a view that takes months before the
+# watermark from the monthly table and everything from the watermark on from
+# the daily table. Replacing the view is a single DDL statement, so a month
+# moves from one table to the other without ever being read twice.
+
+MONTHLY_TABLE = 'shopify_daily_stats_monthly'
+MONTHLY_PREFIX = 'shopify/daily_stats_monthly'
+COMPACTED_VIEW = 'shopify_daily_stats_compacted'
+
+# Fingerprint of the daily files each month was compacted from, outside any
+# partition directory so neither table reads it
+COMPACTION_MANIFEST_KEY = f'{MONTHLY_PREFIX}/_compaction_manifest.json'
+
+PARTITION_VALUE_PATTERN = r'/{key}=([0-9-]+)/'
+
+
+def monthly_stats_key(month: str):
+
+    return f"{MONTHLY_PREFIX}/partition_month={month}/shopify_daily_stats_{month}.parquet"
+
+
+def next_month(month: str):
+
+    return (pd.Period(month, freq='M') + 1).strftime('%Y-%m')
+
+
+# List the objects written under a prefix, by partition value
+# -----------
+
+# Read from the object keys rather than the catalog, so tables using
+# partition projection are covered too.
+
+def list_partition_objects(s3_client, bucket: str, prefix: str, partition_key: str):
+
+    pattern = re.compile(PARTITION_VALUE_PATTERN.format(key=partition_key))
+
+    objects = {}
+
+    paginator = s3_client.get_paginator('list_objects_v2')
+
+    for page in paginator.paginate(Bucket=bucket, Prefix=f'{prefix}/'):
+        for obj in page.get('Contents', []):
+            match = pattern.search(obj['Key'])
+            if match:
+                objects.setdefault(match.group(1), []).append(obj)
+
+    return objects
+
+
+def list_partition_values(s3_client, bucket: str, prefix: str, partition_key: str):
+
+    return sorted(list_partition_objects(s3_client=s3_client, bucket=bucket, prefix=prefix, partition_key=partition_key))
+
+
+# Fingerprint of each month's daily files
+# -----------
+
+# Hashes the keys and ETags (content hashes) of every daily file in the
+# month, so a restated, added or removed day changes it while rewriting a
+# day with identical content does not.
+
+def month_fingerprints(daily_objects: dict):
+
+    files_by_month = {}
+
+    for partition_date, objects in daily_objects.items():
+        files_by_month.setdefault(partition_date[:7], []).extend(f"{obj['Key']} {obj['ETag']}" for obj in objects)
+
+    return {month: hashlib.md5('\n'.join(sorted(files)).encode('utf-8')).hexdigest()
+            for month, files in files_by_month.items()}
+
+
+# Months that can no longer receive new days
+# -----------
+
+def closed_months(partition_dates: list, today: str = None):
+
+    current_month = pd.Period(pd.to_datetime(today if today is not None else 'today'), freq='M').strftime('%Y-%m')
+
+    return sorted({d[:7] for d in partition_dates if d[:7] < current_month})
+
+
+# First month the view still reads from the daily table
+# -----------
+
+# Months are only served from the monthly table while they form an unbroken
+# run from the first daily month, so a month that failed to compact is never
+# skipped by the view.
+
+def compaction_watermark(daily_months: list, compacted_months: list):
+
+    compacted = set(compacted_months)
+
+    for month in sorted(daily_months):
+        if month not in compacted:
+            return month
+
+    return next_month(max(daily_months)) if daily_months else None
+
+
+# Build the queries
+# -----------
+
+def build_month_stats_query(month: str, table: str):
+
+    start_date = f'{month}-01'
+    end_date = (pd.Period(month, freq='M').end_time).strftime('%Y-%m-%d')
+
+    return f"""SELECT {', '.join(DAILY_STATS_COLUMNS)}
+                FROM {table}
+                WHERE partition_date >= DATE '{start_date}' AND partition_date <= DATE '{end_date}'"""
+
+
+def build_compacted_view_query(watermark: str, daily_table: str, monthly_table: str = MONTHLY_TABLE,
+                               view: str = COMPACTED_VIEW):
+
+    # The CSV table stores FLOAT amounts, the monthly Parquet table DOUBLE
+    def select_columns(table_alias: str):
+        return '\n    , '.join(
+            f"CAST({table_alias}.{column} AS DOUBLE) AS {column}"
+            if column in ('total_product_revenue', 'daily_aov', 'new_customer_spend', 'repeat_customer_spend')
+            else f"{table_alias}.{column}"
+            for column in DAILY_STATS_COLUMNS
+        )
+
+    return f"""CREATE OR REPLACE VIEW {view} AS
+SELECT {select_columns('m')}
+    , m.order_date AS partition_date
+FROM {monthly_table} m
+WHERE m.partition_month < '{watermark}'
+UNION ALL
+SELECT {select_columns('d')}
+    , d.partition_date
+FROM {daily_table} d
+WHERE d.partition_date >= DATE '{watermark}-01'
+"""
+
+
+# Write one month of daily stats as a single Parquet file
+# -----------
+
+# A single PUT replaces the month in one step, re-running an unchanged month
+# writes nothing.
+
+def write_monthly_stats(s3_client, bucket: str, month: str, df: pd.DataFrame):
+
+    key = monthly_stats_key(month)
+
+    logger.info(f'Writing {len(df)} days of {month} to {key}')
+
+    try:
+        put_object_if_changed(bucket=bucket, key=key,
+                              body=serialize_daily_stats(df.sort_values('order_date'), output_format='parquet'),
+                              s3_client=s3_client)
+        return True
+
+    except Exception as e:
+        _log_s3_error(e)
+        return False
+
+
+# Compact months into their monthly files
+# -----------
+
+# Used by the compaction job and by restate for months it changed. Each month
+# written & registered records its daily files' fingerprint in the manifest.
+# Returns the months compacted and the months that failed, which stay in the
+# daily table.
+
+def compact_months(s3_client, bucket: str, months: list, fingerprints: dict, manifest_store: S3ManifestStore,
+                   daily_table: str, database: str = 'prymal-analytics', region: str = 'us-east-1'):
+
+    written_months = []
+    failed_months = []
+
+    for month in months:
+
+        try:
+            month_df = run_athena_query(query=build_month_stats_query(month=month, table=daily_table),
+                                        database=database,
+                                        region=region,
+                                        fetch_mode='paginate')
+        except Exception as e:
+            logger.error(f'Unable to read {month} from {daily_table}, leaving it there: {e}')
+            failed_months.append(month)
+            continue
+
+        if len(month_df) == 0:
+            logger.error(f'No daily stats returned for {month}, leaving it in {daily_table}')
+            failed_months.append(month)
+            continue
+
+        if write_monthly_stats(s3_client=s3_client, bucket=bucket, month=month, df=month_df):
+            written_months.append(month)
+        else:
+            failed_months.append(month)
+
+    # A month the view can't find in the monthly table stays in the daily table
+    unregistered_months = register_partitions(partition_dates=written_months, table=MONTHLY_TABLE, database=database,
+                                              partition_key='partition_month')
+
+    written_months = [month for month in written_months if month not in unregistered_months]
+    failed_months += unregistered_months
+
+    if written_months:
+        compacted_fingerprints = manifest_store.load() if manifest_store.exists() else {}
+        compacted_fingerprints.update({month: fingerprints.get(month) for month in written_months})
+        manifest_store.save(compacted_fingerprints)
+
+    return written_months, sorted(failed_months)
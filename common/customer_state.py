@@ -0,0 +1,175 @@
+import io
+import os
+from botocore.exceptions import ClientError
+from loguru import logger
+import pandas as pd
+from common.manifests import LocalManifestStore, S3ManifestStore
+
+
+# -------------------------------------
+# Customer first-order state store
+# -------------------------------------
+
+# The store persists email -> first_order_date so the daily job only needs
+# yesterday's line items, instead of re-scanning shopify_line_items to find
+# each customer's first order.
+
+STATE_COLUMNS = ['email', 'first_order_date']
+
+CUSTOMER_STATE_KEY = 'shopify/customer_state/shopify_customer_first_orders.csv'
+
+# The state is saved with a 'state_through' watermark (YYYY-MM-DD) in a JSON
+# manifest next to it: every day up to it has been folded into the state and
+# has its daily_stats partition written. The state is written before the
+# watermark, so a failure in between only leaves the watermark behind, and
+# re-scanning days already in the state is a no-op (earliest date wins).
+
+
+def state_manifest_key(key: str):
+
+    return f'{os.path.splitext(key)[0]}.json'
+
+
+def empty_customer_state():
+
+    return pd.DataFrame(columns=STATE_COLUMNS)
+
+
+# Merge newly computed first order dates into the stored customer state
+# -----------
+
+def merge_customer_state(state_df: pd.DataFrame, first_order_df: pd.DataFrame):
+
+    merged_df = pd.concat([state_df[STATE_COLUMNS], first_order_df[STATE_COLUMNS]], ignore_index=True)
+
+    merged_df['email'] = merged_df['email'].astype('object')
+    merged_df['first_order_date'] = pd.to_datetime(merged_df['first_order_date'])
+
+    # Keep the earliest date per customer (re-running a day is a no-op),
+    # compared as dates and formatted once per customer afterwards
+    merged_df = merged_df.groupby('email', as_index=False).agg({
+                                        'first_order_date':'min'
+    })
+
+    merged_df['first_order_date'] = merged_df['first_order_date'].dt.strftime('%Y-%m-%d')
+
+    logger.info(f'{len(merged_df) - len(state_df)} new customers merged into customer state')
+
+    return merged_df
+
+
+# Days whose new vs repeat split moved between two sets of first order dates
+# -----------
+
+# A customer whose first order date changed was new on the old date and is
+# new on the new one instead, so both days change. Customers only in one of
+# the two count too.
+
+def first_order_changes(previous_df: pd.DataFrame, current_df: pd.DataFrame):
+
+    compared_df = pd.merge(previous_df[STATE_COLUMNS].astype(str), current_df[STATE_COLUMNS].astype(str), on='email', how='outer',
+                           suffixes=('_previous', '_current'))
+
+    changed_df = compared_df[compared_df['first_order_date_previous'].ne(compared_df['first_order_date_current'])]
+
+    logger.info(f'{len(changed_df)} customers have a different first order date')
+
+    return sorted(set(changed_df['first_order_date_previous'].dropna()) | set(changed_df['first_order_date_current'].dropna()))
+
+
+# S3 backed store (used by the scheduled jobs)
+# -----------
+
+class S3CustomerStateStore:
+
+    def __init__(self, bucket: str, key: str, s3_client):
+
+        self.bucket = bucket
+        self.key = key
+        self.s3_client = s3_client
+        self.manifest = S3ManifestStore(bucket=bucket, key=state_manifest_key(key), s3_client=s3_client)
+
+    def exists(self):
+
+        try:
+            self.s3_client.head_object(Bucket=self.bucket, Key=self.key)
+            return True
+
+        except ClientError as e:
+            if e.response['Error']['Code'] in ['404', 'NoSuchKey', 'NotFound']:
+                return False
+            raise
+
+    def load(self):
+
+        logger.info(f'Loading customer state from {self.bucket}/{self.key}')
+
+        response = self.s3_client.get_object(Bucket=self.bucket, Key=self.key)
+
+        state_df = pd.read_csv(response['Body'], dtype=str)
+
+        logger.info(f'{len(state_df)} customers in customer state')
+
+        return state_df
+
+    # None for a state saved without a watermark
+    def load_state_through(self):
+
+        return self.manifest.load().get('state_through') if self.manifest.exists() else None
+
+    def save(self, state_df: pd.DataFrame, state_through: str):
+
+        logger.info(f'Writing {len(state_df)} customers through {state_through} to {self.bucket}/{self.key}')
+
+        with io.StringIO() as csv_buffer:
+            state_df[STATE_COLUMNS].to_csv(csv_buffer, index=False)
+
+            response = self.s3_client.put_object(
+                Bucket=self.bucket,
+                Key=self.key,
+                Body=csv_buffer.getvalue()
+            )
+
+        status = response['ResponseMetadata']['HTTPStatusCode']
+
+        if status != 200:
+            raise RuntimeError(f"Unsuccessful S3 put_object response for PUT ({self.key}). Status - {status}")
+
+        logger.info(f"Successful S3 put_object response for PUT ({self.key}). Status - {status}")
+
+        self.manifest.save({'state_through': state_through, 'customers': len(state_df)})
+
+
+# Local file stand-in (used for tests and local runs)
+# -----------
+
+class LocalCustomerStateStore:
+
+    def __init__(self, path: str):
+
+        self.path = path
+        self.manifest = LocalManifestStore(path=state_manifest_key(path))
+
+    def exists(self):
+
+        return os.path.exists(self.path)
+
+    def load(self):
+
+        logger.info(f'Loading customer state from {self.path}')
+
+        return pd.read_csv(self.path, dtype=str)
+
+    def load_state_through(self):
+
+        return self.manifest.load().get('state_through') if self.manifest.exists() else None
+
+    def save(self, state_df: pd.DataFrame, state_through: str):
+
+        logger.info(f'Writing {len(state_df)} customers through {state_through} to {self.path}')
+
+        os.makedirs(os.path.dirname(os.path.abspath(self.path)), exist_ok=True)
+
+        state_df[STATE_COLUMNS].to_csv(self.path, index=False)
+
+        self.manifest.save({'state_through': state_through, 'customers': len(state_df)})
@@ -0,0 +1,182 @@
+from datetime import timedelta
+from loguru import logger
+import numpy as np
+import pandas as pd
+
+
+# ---------------------------------------
+# DAILY STATS (PANDAS REFERENCE IMPLEMENTATION)
+# ---------------------------------------
+
+DAILY_STATS_COLUMNS = ['order_date', 'total_product_revenue', 'total_order_count', 'total_customer_count', 'daily_aov',
+                       'new_customer_count', 'new_customer_spend', 'repeat_customer_count', 'repeat_customer_spend']
+
+
+# Format datatypes & new columns
+# -----------
+
+# order_date stays a day-resolution datetime64 column from here on, later
+# stages compare and subtract dates without formatting them as strings.
+
+def prepare_line_items(result_df: pd.DataFrame):
+
+    logger.info(f"Count of NULL RECORDS: {len(result_df.loc[result_df['order_date'].isna()])}")
+
+    order_date = pd.to_datetime(result_df['order_date'])
+
+    if order_date.dt.tz is not None:
+        order_date = order_date.dt.tz_localize(None)
+
+    result_df['order_date'] = order_date.dt.normalize()
+    result_df['product_rev'] = result_df['quantity'].astype(float) * result_df['price'].astype(float)
+
+    logger.info(f"MIN DATE: {result_df['order_date'].min()}")
+    logger.info(f"MAX DATE: {result_df['order_date'].max()}")
+
+    return result_df
+
+
+# Dictionary encode customer & order keys
+# -----------
+
+# email and order_id are replaced by int32 codes (missing values stay NA) so
+# every distinct count and the first-order sort hash small integers instead of
+# strings. The dictionaries map a code back to its original value.
+
+KEY_COLUMNS = {'email': 'customer_key', 'order_id': 'order_key'}
+
+
+def encode_keys(result_df: pd.DataFrame):
+
+    key_dictionaries = {}
+
+    for column, key_column in KEY_COLUMNS.items():
+
+        codes, uniques = pd.factorize(result_df[column])
+
+        result_df[key_column] = pd.arrays.IntegerArray(codes.astype('int32'), mask=codes < 0)
+        key_dictionaries[column] = np.asarray(uniques, dtype='object')
+
+    result_df = result_df.drop(columns=list(KEY_COLUMNS))
+
+    logger.info(f"Encoded {len(key_dictionaries['email'])} customers and {len(key_dictionaries['order_id'])} orders")
+
+    return result_df, key_dictionaries
+
+
+# Calculate first order date & age at time of purchase
+# -----------
+
+# Sorts once by (customer, order_date) and reads each customer's first order
+# off the start of their run of rows, instead of a groupby plus a merge back
+# onto every line item. Stored first orders from the customer state (if any)
+# are looked up per customer and take precedence when earlier.
+#
+# Expects encode_keys to have run; customers is its email dictionary.
+# Returns the first order date of every customer code (NaT for customers
+# without orders here or in the state) and the same as an email table.
+
+def customer_first_order_dates(shopify_line_item_df: pd.DataFrame, customers: np.ndarray, state_df: pd.DataFrame = None):
+
+    codes = shopify_line_item_df['customer_key'].to_numpy(dtype='int32', na_value=-1)
+    order_date = shopify_line_item_df['order_date'].to_numpy(dtype='datetime64[ns]')
+
+    # Missing dates sort last, so a run only starts on NaT if every date is NaT
+    date_key = order_date.view('int64').copy()
+    date_key[np.isnat(order_date)] = np.iinfo(np.int64).max
+
+    order = np.lexsort((date_key, codes))
+    sorted_codes = codes[order]
+
+    # Each customer's rows form one run in sorted order
+    is_run_start = np.ones(len(order), dtype=bool)
+    is_run_start[1:] = sorted_codes[1:] != sorted_codes[:-1]
+
+    run_codes = sorted_codes[is_run_start]
+    run_first_dates = order_date[order][is_run_start]
+
+    # Rows without a customer have no first order
+    run_first_dates = run_first_dates[run_codes >= 0]
+    run_codes = run_codes[run_codes >= 0]
+
+    # Fold in first orders already recorded in the customer state
+    if state_df is not None and len(state_df) and len(run_codes):
+        stored_first_dates = pd.to_datetime(state_df.set_index('email')['first_order_date'])
+        run_customers = pd.Series(customers[run_codes])
+        run_first_dates = np.fmin(run_first_dates, run_customers.map(stored_first_dates).to_numpy(dtype='datetime64[ns]'))
+
+    first_dates = np.full(len(customers), np.datetime64('NaT'), dtype='datetime64[ns]')
+    first_dates[run_codes] = run_first_dates
+
+    first_order_df = pd.DataFrame({
+        'email': customers[run_codes],
+        'first_order_date': run_first_dates
+    })
+
+    return first_dates, first_order_df
+
+
+# Look each row's first order date up by customer code
+# -----------
+
+def apply_customer_features(shopify_line_item_df: pd.DataFrame, first_dates: np.ndarray):
+
+    codes = shopify_line_item_df['customer_key'].to_numpy(dtype='int32', na_value=-1)
+
+    first_order_date = np.full(len(codes), np.datetime64('NaT'), dtype='datetime64[ns]')
+    first_order_date[codes >= 0] = first_dates[codes[codes >= 0]]
+
+    shopify_line_item_df['first_order_date'] = first_order_date
+    shopify_line_item_df['age'] = (shopify_line_item_df['order_date'] - shopify_line_item_df['first_order_date']).dt.days
+    shopify_line_item_df['cuttoff_60_days'] = shopify_line_item_df['first_order_date'] + timedelta(60)
+    shopify_line_item_df['first_order_month'] = shopify_line_item_df['first_order_date'].dt.to_period('M')
+    shopify_line_item_df['first_order_fl'] = (shopify_line_item_df['order_date'] == shopify_line_item_df['first_order_date']).astype('int8')
+
+    return shopify_line_item_df
+
+
+# Returns the line items with the customer features added, and the first
+# order date of every customer seen in them.
+
+def add_customer_features(shopify_line_item_df: pd.DataFrame, customers: np.ndarray, state_df: pd.DataFrame = None):
+
+    first_dates, first_order_df = customer_first_order_dates(shopify_line_item_df, customers=customers, state_df=state_df)
+
+    return apply_customer_features(shopify_line_item_df, first_dates), first_order_df
+
+
+# Calculate summary statistics for each day
+# -----------
+
+def compute_daily_stats(df: pd.DataFrame):
+
+    # Group by order date and agg
+    daily_stats_df = df.groupby('order_date',as_index=False).agg(
+                                    total_product_revenue=('product_rev', 'sum'),
+                                    total_order_count=('order_key', 'nunique'),
+                                    total_customer_count=('customer_key', 'nunique')
+    )
+
+    #Calulate lifetime AOV
+    daily_stats_df['daily_aov'] = daily_stats_df['total_product_revenue'] / daily_stats_df['total_order_count']
+
+    # --- new vs returning cust count
+    new_custs = df.loc[df['first_order_fl']==1].groupby('order_date',as_index=False).agg(
+                                                    new_customer_count=('customer_key','nunique'),
+                                                    new_customer_spend=('product_rev','sum')
+    )
+
+    repeat_custs = df.loc[df['first_order_fl']==0].groupby('order_date',as_index=False).agg(
+                                                    repeat_customer_count=('customer_key','nunique'),
+                                                    repeat_customer_spend=('product_rev','sum')
+    )
+
+    # Merge additinal stats
+    daily_stats_df = daily_stats_df.merge(new_custs,how='left',on='order_date').merge(repeat_custs,how='left',on='order_date')
+
+    daily_stats_df['order_date'] = pd.to_datetime(daily_stats_df['order_date']).dt.strftime('%Y-%m-%d')
+
+    logger.info(daily_stats_df.columns)
+    logger.info(daily_stats_df.head())
+
+    return daily_stats_df
@@ -0,0 +1,328 @@
+from abc import ABC, abstractmethod
+import os
+from loguru import logger
+import pandas as pd
+from common.daily_stats import (DAILY_STATS_COLUMNS, prepare_line_items, encode_keys, add_customer_features,
+                                compute_daily_stats)
+from common.parallel import AGGREGATION_WORKERS, aggregate_daily_stats_parallel
+
+
+# ---------------------------------------
+# DAILY STATS ENGINES
+# ---------------------------------------
+
+# Every engine takes the line items as the line items query returns them
+# (order_date, email, order_id, quantity, price) plus the stored customer
+# state, and returns the daily stats and the first order date of every
+# customer seen, exactly as the pandas reference does:
+#   - a customer's first order is their earliest order date, or the stored
+#     one if that is earlier
+#   - line items on that day are new customer spend, all others (including
+#     line items without a customer) are repeat spend
+#   - new / repeat stats stay empty on days without such line items
+#
+# Line items can be a DataFrame, a pyarrow Table or the path of Parquet files.
+# duckdb and polars are optional, each is imported when its engine is created.
+
+# Engine used by the pandas mode of the daily job and the backfill
+DAILY_STATS_ENGINE = os.environ.get('DAILY_STATS_ENGINE', 'pandas')
+
+# Threads for the DuckDB & Polars engines, all cores by default
+ENGINE_THREADS = int(os.environ.get('ENGINE_THREADS', 0)) or None
+
+STATE_COLUMNS = ['email', 'first_order_date']
+
+
+# Timezone-aware order dates keep their local wall time, as in prepare_line_items
+def _naive_order_dates(line_items):
+
+    if isinstance(line_items, pd.DataFrame) and getattr(line_items['order_date'].dtype, 'tz', None) is not None:
+        line_items = line_items.assign(order_date=line_items['order_date'].dt.tz_localize(None))
+
+    return line_items
+
+
+def _finish_daily_stats(daily_stats_df: pd.DataFrame):
+
+    daily_stats_df['daily_aov'] = daily_stats_df['total_product_revenue'] / daily_stats_df['total_order_count']
+
+    return daily_stats_df[DAILY_STATS_COLUMNS].reset_index(drop=True)
+
+
+class DailyStatsEngine(ABC):
+
+    """Computes daily stats from line items, see the module comment."""
+
+    name = None
+
+    # days restricts the output to those order dates ('YYYY-MM-DD'), first
+    # orders are always found over every line item given
+    @abstractmethod
+    def compute(self, line_items, state_df: pd.DataFrame = None, days: list = None):
+        pass
+
+
+# ---------------------------------------
+# PANDAS (REFERENCE)
+# ---------------------------------------
+
+class PandasEngine(DailyStatsEngine):
+
+    name = 'pandas'
+
+    def __init__(self, max_workers: int = AGGREGATION_WORKERS):
+
+        self.max_workers = max_workers
+
+    def compute(self, line_items, state_df: pd.DataFrame = None, days: list = None):
+
+        if isinstance(line_items, str):
+            line_items = pd.read_parquet(line_items)
+        elif not isinstance(line_items, pd.DataFrame):
+            line_items = line_items.to_pandas()
+
+        # Format datatypes & new columns
+        shopify_line_item_df = prepare_line_items(line_items)
+
+        # Integer customer & order keys
+        shopify_line_item_df, key_dictionaries = encode_keys(shopify_line_item_df)
+
+        if self.max_workers > 1:
+
+            # First order dates once, then the days aggregated across worker processes
+            daily_stats_df, first_order_df = aggregate_daily_stats_parallel(shopify_line_item_df, customers=key_dictionaries['email'],
+                                                                            state_df=state_df, max_workers=self.max_workers)
+
+            if days is not None:
+                daily_stats_df = daily_stats_df.loc[daily_stats_df['order_date'].isin(days)].reset_index(drop=True)
+
+            return daily_stats_df, first_order_df
+
+        # First order date & age at time of purchase
+        shopify_line_item_df, first_order_df = add_customer_features(shopify_line_item_df, customers=key_dictionaries['email'],
+                                                                     state_df=state_df)
+
+        if days is not None:
+            shopify_line_item_df = shopify_line_item_df.loc[shopify_line_item_df['order_date'].isin(pd.to_datetime(days))]
+
+        # Summary statistics for each day
+        return compute_daily_stats(shopify_line_item_df), first_order_df
+
+
+# ---------------------------------------
+# DUCKDB
+# ---------------------------------------
+
+DUCKDB_FIRST_ORDERS_SQL = """
+CREATE TEMP TABLE first_orders AS
+WITH line_item_firsts AS (
+    SELECT email, min(order_day) AS first_order_date
+    FROM items
+    WHERE email IS NOT NULL
+    GROUP BY email
+)
+SELECT f.email,
+       least(f.first_order_date, CAST(s.first_order_date AS TIMESTAMP)) AS first_order_date
+FROM line_item_firsts f
+LEFT JOIN customer_state s ON f.email = s.email
+"""
+
+DUCKDB_DAILY_STATS_SQL = """
+WITH flagged AS (
+    SELECT i.order_day, i.email, i.order_id, i.product_rev,
+           coalesce(i.order_day = f.first_order_date, false) AS first_order_fl
+    FROM items i
+    LEFT JOIN first_orders f ON i.email = f.email
+    WHERE i.order_day IS NOT NULL
+      AND ($days IS NULL OR list_contains($days, strftime(i.order_day, '%Y-%m-%d')))
+)
+SELECT strftime(order_day, '%Y-%m-%d') AS order_date,
+       coalesce(sum(product_rev), 0) AS total_product_revenue,
+       count(DISTINCT order_id) AS total_order_count,
+       count(DISTINCT email) AS total_customer_count,
+       CASE WHEN count(*) FILTER (WHERE first_order_fl) > 0
+            THEN count(DISTINCT email) FILTER (WHERE first_order_fl) END AS new_customer_count,
+       CASE WHEN count(*) FILTER (WHERE first_order_fl) > 0
+            THEN coalesce(sum(product_rev) FILTER (WHERE first_order_fl), 0) END AS new_customer_spend,
+       CASE WHEN count(*) FILTER (WHERE NOT first_order_fl) > 0
+            THEN count(DISTINCT email) FILTER (WHERE NOT first_order_fl) END AS repeat_customer_count,
+       CASE WHEN count(*) FILTER (WHERE NOT first_order_fl) > 0
+            THEN coalesce(sum(product_rev) FILTER (WHERE NOT first_order_fl), 0) END AS repeat_customer_spend
+FROM flagged
+GROUP BY order_day
+ORDER BY order_day
+"""
+
+
+class DuckDBEngine(DailyStatsEngine):
+
+    name = 'duckdb'
+
+    def __init__(self, threads: int = ENGINE_THREADS):
+
+        import duckdb
+
+        self.duckdb = duckdb
+        self.threads = threads
+
+    def compute(self, line_items, state_df: pd.DataFrame = None, days: list = None):
+
+        con = self.duckdb.connect()
+
+        if self.threads:
+            con.execute(f'SET threads = {int(self.threads)}')
+
+        if isinstance(line_items, str):
+            source = f"read_parquet('{line_items}')"
+        else:
+            con.register('line_items', _naive_order_dates(line_items))
+            source = 'line_items'
+
+        if state_df is None or not len(state_df):
+            state_df = pd.DataFrame({'email': pd.Series(dtype='object'), 'first_order_date': pd.Series(dtype='datetime64[ns]')})
+
+        con.register('customer_state', state_df[STATE_COLUMNS])
+
+        con.execute(f"""
+            CREATE TEMP TABLE items AS
+            SELECT date_trunc('day', CAST(order_date AS TIMESTAMP)) AS order_day,
+                   CAST(email AS VARCHAR) AS email,
+                   CAST(order_id AS VARCHAR) AS order_id,
+                   CAST(quantity AS DOUBLE) * CAST(price AS DOUBLE) AS product_rev
+            FROM {source}
+        """)
+
+        con.execute(DUCKDB_FIRST_ORDERS_SQL)
+
+        daily_stats_df = con.execute(DUCKDB_DAILY_STATS_SQL, {'days': days}).df()
+        first_order_df = con.execute('SELECT email, first_order_date FROM first_orders').df()
+
+        con.close()
+
+        first_order_df['first_order_date'] = first_order_df['first_order_date'].astype('datetime64[ns]')
+
+        logger.info(f'DuckDB engine: {len(daily_stats_df)} days, {len(first_order_df)} customers')
+
+        return _finish_daily_stats(daily_stats_df), first_order_df
+
+
+# ---------------------------------------
+# POLARS
+# ---------------------------------------
+
+class PolarsEngine(DailyStatsEngine):
+
+    name = 'polars'
+
+    def __init__(self, threads: int = ENGINE_THREADS):
+
+        # Polars sizes its thread pool once, from the environment, on import
+        if threads:
+            os.environ.setdefault('POLARS_MAX_THREADS', str(threads))
+
+        import polars
+
+        self.pl = polars
+
+    def _scan(self, line_items):
+
+        pl = self.pl
+
+        if isinstance(line_items, str):
+            return pl.scan_parquet(line_items)
+
+        if isinstance(line_items, pd.DataFrame):
+            return pl.from_pandas(_naive_order_dates(line_items)).lazy()
+
+        return pl.from_arrow(line_items).lazy()
+
+    def compute(self, line_items, state_df: pd.DataFrame = None, days: list = None):
+
+        pl = self.pl
+
+        items = self._scan(line_items)
+
+        order_date_type = items.collect_schema()['order_date']
+
+        # order_date may come back as a string, like pd.to_datetime in prepare_line_items
+        if order_date_type == pl.Utf8:
+            items = items.with_columns(pl.col('order_date').str.to_datetime(time_unit='ns'))
+        elif isinstance(order_date_type, pl.Datetime) and order_date_type.time_zone:
+            items = items.with_columns(pl.col('order_date').dt.replace_time_zone(None))
+
+        items = items.select(
+            pl.col('order_date').cast(pl.Datetime('ns')).dt.truncate('1d').alias('order_day'),
+            pl.col('email').cast(pl.Utf8),
+            pl.col('order_id').cast(pl.Utf8),
+            (pl.col('quantity').cast(pl.Float64) * pl.col('price').cast(pl.Float64)).alias('product_rev'),
+        ).collect()
+
+        first_orders = (items.lazy()
+                        .filter(pl.col('email').is_not_null())
+                        .group_by('email')
+                        .agg(pl.col('order_day').min().alias('first_order_date')))
+
+        if state_df is not None and len(state_df):
+            stored = pl.from_pandas(state_df[STATE_COLUMNS].astype({'email': 'object', 'first_order_date': 'datetime64[ns]'})).lazy()
+            first_orders = (first_orders
+                            .join(stored, on='email', how='left', suffix='_stored')
+                            .select('email', pl.min_horizontal('first_order_date', 'first_order_date_stored').alias('first_order_date')))
+
+        first_orders = first_orders.collect()
+
+        flagged = (items.lazy()
+                   .filter(pl.col('order_day').is_not_null())
+                   .join(first_orders.lazy(), on='email', how='left')
+                   .with_columns((pl.col('order_day') == pl.col('first_order_date')).fill_null(False).alias('first_order_fl'))
+                   .with_columns(pl.col('order_day').dt.strftime('%Y-%m-%d').alias('order_date')))
+
+        if days is not None:
+            flagged = flagged.filter(pl.col('order_date').is_in(days))
+
+        new, repeat = pl.col('first_order_fl'), ~pl.col('first_order_fl')
+
+        daily_stats = (flagged
+                       .group_by('order_date')
+                       .agg(pl.col('product_rev').sum().alias('total_product_revenue'),
+                            pl.col('order_id').drop_nulls().n_unique().alias('total_order_count'),
+                            pl.col('email').drop_nulls().n_unique().alias('total_customer_count'),
+                            new.sum().alias('new_rows'),
+                            pl.col('email').filter(new).drop_nulls().n_unique().alias('new_customer_count'),
+                            pl.col('product_rev').filter(new).sum().alias('new_customer_spend'),
+                            repeat.sum().alias('repeat_rows'),
+                            pl.col('email').filter(repeat).drop_nulls().n_unique().alias('repeat_customer_count'),
+                            pl.col('product_rev').filter(repeat).sum().alias('repeat_customer_spend'))
+                       .with_columns(pl.when(pl.col('new_rows') > 0).then(pl.col(c)).alias(c)
+                                     for c in ['new_customer_count', 'new_customer_spend'])
+                       .with_columns(pl.when(pl.col('repeat_rows') > 0).then(pl.col(c)).alias(c)
+                                     for c in ['repeat_customer_count', 'repeat_customer_spend'])
+                       .sort('order_date')
+                       .collect())
+
+        daily_stats_df = daily_stats.drop(['new_rows', 'repeat_rows']).to_pandas()
+        first_order_df = first_orders.to_pandas()
+
+        logger.info(f'Polars engine: {len(daily_stats_df)} days, {len(first_order_df)} customers')
+
+        return _finish_daily_stats(daily_stats_df), first_order_df
+
+
+# ---------------------------------------
+# REGISTRY
+# ---------------------------------------
+
+ENGINES = {
+    'pandas': PandasEngine,
+    'duckdb': DuckDBEngine,
+    'polars': PolarsEngine,
+}
+
+
+def get_engine(name: str = DAILY_STATS_ENGINE, **kwargs):
+
+    if name not in ENGINES:
+        raise ValueError(f"Unknown daily stats engine {name}, expected one of {', '.join(ENGINES)}")
+
+    logger.info(f'Computing daily stats with the {name} engine')
+
+    return ENGINES[name](**kwargs)
@@ -0,0 +1,776 @@
+import glob
+import hashlib
+import io
+import json
+import os
+import re
+import threading
+import time
+import uuid
+from datetime import datetime, timezone
+from botocore.exceptions import ClientError
+import duckdb
+from loguru import logger
+import pandas as pd
+
+
+# ---------------------------------------
+# LOCAL BACKEND
+# ---------------------------------------
+
+# Offline stand-ins for the S3, Athena and Glue clients, handed out by
+# common/aws.py when PIPELINE_BACKEND=local. Every script then runs unchanged
+# against local files:
+#   - S3: each bucket is a directory under LOCAL_DATA_DIR/s3
+#   - Athena: the same SQL runs in DuckDB over the tables' local files, and
+#     results are written as CSV to the query's output location like Athena
+#   - Glue: a JSON catalog of table properties, registered partitions & views
+#
+# shopify_line_items is read from a directory of Parquet files
+# (LOCAL_LINE_ITEMS_DIR), either in partition_date=YYYY-MM-DD/ directories or
+# with a partition_date column. Only the APIs and statements the pipeline uses
+# are implemented, anything else fails loudly.
+
+LOCAL_DATA_DIR = os.environ.get('LOCAL_DATA_DIR', 'local_data')
+
+LOCAL_LINE_ITEMS_DIR = os.environ.get('LOCAL_LINE_ITEMS_DIR', os.path.join(LOCAL_DATA_DIR, 'shopify_line_items'))
+
+# Bucket served from LOCAL_LINE_ITEMS_DIR instead of LOCAL_DATA_DIR/s3
+LINE_ITEMS_BUCKET = 'local-shopify-line-items'
+
+CATALOG_PATH = os.path.join(LOCAL_DATA_DIR, 'catalog.json')
+
+# Databases the queries run in, tables are visible under each of them
+LOCAL_DATABASES = ['prymal', 'prymal-analytics']
+
+
+def _daily_stats_columns(float_type: str):
+
+    return [['order_date', 'DATE'], ['total_product_revenue', float_type], ['total_order_count', 'INTEGER'],
+            ['total_customer_count', 'INTEGER'], ['daily_aov', float_type], ['new_customer_count', 'INTEGER'],
+            ['new_customer_spend', float_type], ['repeat_customer_count', 'INTEGER'], ['repeat_customer_spend', float_type]]
+
+
+# Same tables as create_table/shopify_daily_stats/*.sql. Source tables are
+# managed outside the pipeline, all their partitions are visible.
+LOCAL_TABLES = {
+    'shopify_line_items': {
+        'location': f's3://{LINE_ITEMS_BUCKET}/', 'format': 'parquet', 'columns': None,
+        'partition_key': 'partition_date', 'partition_type': 'DATE', 'source': True,
+    },
+    'shopify_daily_stats': {
+        'location': 's3://prymal-analytics/shopify/daily_stats/', 'format': 'csv', 'columns': _daily_stats_columns('FLOAT'),
+        'partition_key': 'partition_date', 'partition_type': 'DATE',
+    },
+    'shopify_daily_stats_parquet': {
+        'location': 's3://prymal-analytics/shopify/daily_stats_parquet/', 'format': 'parquet', 'columns': _daily_stats_columns('DOUBLE'),
+        'partition_key': 'partition_date', 'partition_type': 'DATE',
+    },
+    'shopify_daily_stats_monthly': {
+        'location': 's3://prymal-analytics/shopify/daily_stats_monthly/', 'format': 'parquet', 'columns': _daily_stats_columns('DOUBLE'),
+        'partition_key': 'partition_month', 'partition_type': 'VARCHAR',
+    },
+}
+
+
+def _client_error(code: str, message: str, operation: str):
+
+    return ClientError({'Error': {'Code': code, 'Message': message}}, operation)
+
+
+def _split_location(location: str):
+
+    bucket, _, prefix = location.replace('s3://', '', 1).partition('/')
+
+    return bucket, prefix
+
+
+def _local_path(bucket: str, key: str = ''):
+
+    root = LOCAL_LINE_ITEMS_DIR if bucket == LINE_ITEMS_BUCKET else os.path.join(LOCAL_DATA_DIR, 's3', bucket)
+
+    return os.path.join(root, *key.split('/')) if key else root
+
+
+def _sql_string(value: str):
+
+    return "'" + value.replace("'", "''") + "'"
+
+
+class _Paginator:
+
+    """Follows a continuation token the way boto3 paginators do."""
+
+    def __init__(self, method, input_token: str, output_token: str):
+
+        self.method = method
+        self.input_token = input_token
+        self.output_token = output_token
+
+    def paginate(self, **kwargs):
+
+        while True:
+
+            page = self.method(**kwargs)
+            yield page
+
+            token = page.get(self.output_token)
+
+            if not token:
+                break
+
+            kwargs[self.input_token] = token
+
+
+# ---------------------------------------
+# S3
+# ---------------------------------------
+
+class LocalS3Client:
+
+    """Buckets as directories, keys as file paths below them."""
+
+    _etags = {}
+
+    def _etag(self, path: str):
+
+        stat = os.stat(path)
+        cache_key = (path, stat.st_size, stat.st_mtime_ns)
+
+        if cache_key not in self._etags:
+            with open(path, 'rb') as f:
+                self._etags[cache_key] = hashlib.md5(f.read()).hexdigest()
+
+        return f'"{self._etags[cache_key]}"'
+
+    def _object_info(self, path: str):
+
+        stat = os.stat(path)
+
+        return {
+            'ETag': self._etag(path),
+            'ContentLength': stat.st_size,
+            'LastModified': datetime.fromtimestamp(stat.st_mtime, tz=timezone.utc),
+            'Metadata': {},
+        }
+
+    def put_object(self, Bucket: str, Key: str, Body, **kwargs):
+
+        if isinstance(Body, str):
+            Body = Body.encode('utf-8')
+        elif hasattr(Body, 'read'):
+            Body = Body.read()
+
+        path = _local_path(Bucket, Key)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+
+        # Written aside and swapped in, readers never see a partial object
+        tmp_path = f'{path}.{uuid.uuid4().hex}.tmp'
+        with open(tmp_path, 'wb') as f:
+            f.write(Body)
+        os.replace(tmp_path, path)
+
+        return {'ResponseMetadata': {'HTTPStatusCode': 200}, 'ETag': self._etag(path)}
+
+    def get_object(self, Bucket: str, Key: str, **kwargs):
+
+        path = _local_path(Bucket, Key)
+
+        if not os.path.isfile(path):
+            raise _client_error('NoSuchKey', f'{Bucket}/{Key} does not exist', 'GetObject')
+
+        return {**self._object_info(path), 'Body': open(path, 'rb'), 'ResponseMetadata': {'HTTPStatusCode': 200}}
+
+    def head_object(self, Bucket: str, Key: str, **kwargs):
+
+        path = _local_path(Bucket, Key)
+
+        if not os.path.isfile(path):
+            raise _client_error('404', 'Not Found', 'HeadObject')
+
+        return {**self._object_info(path), 'ResponseMetadata': {'HTTPStatusCode': 200}}
+
+    def list_objects_v2(self, Bucket: str, Prefix: str = '', ContinuationToken: str = None, MaxKeys: int = 1000, **kwargs):
+
+        root = _local_path(Bucket)
+
+        # Only walk the deepest directory the prefix names
+        prefix_dir = os.path.join(root, *Prefix.split('/')[:-1]) if '/' in Prefix else root
+
+        keys = sorted(
+            os.path.relpath(p, root).replace(os.sep, '/')
+            for p in glob.glob(os.path.join(prefix_dir, '**', '*'), recursive=True)
+            if os.path.isfile(p) and not p.endswith('.tmp')
+        )
+        keys = [k for k in keys if k.startswith(Prefix)]
+
+        start = int(ContinuationToken or 0)
+        page_keys = keys[start:start + MaxKeys]
+
+        response = {'KeyCount': len(page_keys), 'IsTruncated': start + MaxKeys < len(keys)}
+
+        if page_keys:
+            response['Contents'] = [{'Key': k, 'Size': info['ContentLength'], 'ETag': info['ETag'], 'LastModified': info['LastModified']}
+                                    for k, info in ((k, self._object_info(_local_path(Bucket, k))) for k in page_keys)]
+
+        if response['IsTruncated']:
+            response['NextContinuationToken'] = str(start + MaxKeys)
+
+        return response
+
+    def delete_object(self, Bucket: str, Key: str, **kwargs):
+
+        path = _local_path(Bucket, Key)
+
+        if os.path.isfile(path):
+            os.remove(path)
+
+        return {'ResponseMetadata': {'HTTPStatusCode': 204}}
+
+    def delete_objects(self, Bucket: str, Delete: dict, **kwargs):
+
+        for obj in Delete['Objects']:
+            self.delete_object(Bucket=Bucket, Key=obj['Key'])
+
+        return {'Deleted': [{'Key': obj['Key']} for obj in Delete['Objects']], 'ResponseMetadata': {'HTTPStatusCode': 200}}
+
+    def copy_object(self, Bucket: str, Key: str, CopySource: dict, **kwargs):
+
+        with open(_local_path(CopySource['Bucket'], CopySource['Key']), 'rb') as f:
+            return self.put_object(Bucket=Bucket, Key=Key, Body=f.read())
+
+    def get_paginator(self, operation_name: str):
+
+        if operation_name != 'list_objects_v2':
+            raise NotImplementedError(f'{operation_name} paginator is not available locally')
+
+        return _Paginator(self.list_objects_v2, 'ContinuationToken', 'NextContinuationToken')
+
+
+# ---------------------------------------
+# CATALOG (GLUE)
+# ---------------------------------------
+
+class LocalCatalog:
+
+    """Tables, registered partitions and views, persisted as JSON."""
+
+    def __init__(self, path: str = CATALOG_PATH):
+
+        self.path = path
+        self.lock = threading.Lock()
+
+    def _load(self):
+
+        catalog = {'parameters': {}, 'partitions': {}, 'views': {}}
+
+        if os.path.isfile(self.path):
+            with open(self.path) as f:
+                catalog.update(json.load(f))
+
+        return catalog
+
+    def _save(self, catalog: dict):
+
+        os.makedirs(os.path.dirname(self.path) or '.', exist_ok=True)
+
+        tmp_path = f'{self.path}.tmp'
+        with open(tmp_path, 'w') as f:
+            json.dump(catalog, f, indent=2, sort_keys=True)
+        os.replace(tmp_path, self.path)
+
+    def tables(self):
+
+        parameters = self._load()['parameters']
+
+        return {name: {**table, 'parameters': parameters.get(name, {})} for name, table in LOCAL_TABLES.items()}
+
+    def table(self, name: str):
+
+        name = name.split('.')[-1].strip('"')
+
+        if name not in LOCAL_TABLES:
+            raise _client_error('EntityNotFoundException', f'Table {name} not found', 'GetTable')
+
+        return self.tables()[name]
+
+    def partitions(self, table: str):
+
+        return set(self._load()['partitions'].get(table, []))
+
+    # Returns the values that were already registered
+    def add_partitions(self, table: str, values: list):
+
+        with self.lock:
+            catalog = self._load()
+            registered = set(catalog['partitions'].get(table, []))
+            existing = registered & set(values)
+            catalog['partitions'][table] = sorted(registered | set(values))
+            self._save(catalog)
+
+        return existing
+
+    def delete_partitions(self, table: str, values: list):
+
+        with self.lock:
+            catalog = self._load()
+            catalog['partitions'][table] = sorted(set(catalog['partitions'].get(table, [])) - set(values))
+            self._save(catalog)
+
+    def set_parameters(self, table: str, parameters: dict):
+
+        with self.lock:
+            catalog = self._load()
+            catalog['parameters'].setdefault(table, {}).update(parameters)
+            self._save(catalog)
+
+    def views(self):
+
+        return self._load()['views']
+
+    def set_view(self, name: str, query: str):
+
+        with self.lock:
+            catalog = self._load()
+            catalog['views'][name] = query
+            self._save(catalog)
+
+
+_catalog = LocalCatalog()
+
+
+class LocalGlueClient:
+
+    """The Glue catalog calls the pipeline makes, backed by LocalCatalog."""
+
+    def get_table(self, DatabaseName: str, Name: str, **kwargs):
+
+        table = _catalog.table(Name)
+
+        return {'Table': {
+            'Name': Name,
+            'DatabaseName': DatabaseName,
+            'StorageDescriptor': {'Location': table['location'],
+                                  'Columns': [{'Name': n, 'Type': t.lower()} for n, t in table['columns'] or []]},
+            'PartitionKeys': [{'Name': table['partition_key'], 'Type': table['partition_type'].lower()}],
+            'Parameters': table['parameters'],
+        }}
+
+    def batch_get_partition(self, DatabaseName: str, TableName: str, PartitionsToGet: list, **kwargs):
+
+        registered = _catalog.partitions(TableName)
+
+        return {'Partitions': [{'Values': p['Values']} for p in PartitionsToGet if p['Values'][0] in registered]}
+
+    def batch_create_partition(self, DatabaseName: str, TableName: str, PartitionInputList: list, **kwargs):
+
+        values = [p['Values'][0] for p in PartitionInputList]
+
+        existing = _catalog.add_partitions(TableName, values)
+
+        return {'Errors': [{'PartitionValues': [v], 'ErrorDetail': {'ErrorCode': 'AlreadyExistsException', 'ErrorMessage': 'exists'}}
+                           for v in sorted(existing)]}
+
+    def batch_delete_partition(self, DatabaseName: str, TableName: str, PartitionsToDelete: list, **kwargs):
+
+        _catalog.delete_partitions(TableName, [p['Values'][0] for p in PartitionsToDelete])
+
+        return {'Errors': []}
+
+    def get_partitions(self, DatabaseName: str, TableName: str, **kwargs):
+
+        return {'Partitions': [{'Values': [v]} for v in sorted(_catalog.partitions(TableName))]}
+
+    def get_paginator(self, operation_name: str):
+
+        if operation_name != 'get_partitions':
+            raise NotImplementedError(f'{operation_name} paginator is not available locally')
+
+        return _Paginator(self.get_partitions, 'NextToken', 'NextToken')
+
+    def start_crawler(self, Name: str, **kwargs):
+
+        logger.info(f'Local backend has no crawlers, {Name} not started')
+
+        return {}
+
+
+# ---------------------------------------
+# ATHENA (DUCKDB)
+# ---------------------------------------
+
+# Athena type names of the DuckDB result columns, for the result metadata
+ATHENA_TYPES = {
+    'TINYINT': 'tinyint', 'SMALLINT': 'smallint', 'INTEGER': 'integer', 'BIGINT': 'bigint', 'HUGEINT': 'bigint',
+    'FLOAT': 'float', 'DOUBLE': 'double', 'BOOLEAN': 'boolean', 'DATE': 'date', 'VARCHAR': 'varchar',
+}
+
+
+def _athena_type(duckdb_type):
+
+    type_name = str(duckdb_type).upper()
+
+    if type_name.startswith('DECIMAL'):
+        return 'decimal'
+    if type_name.startswith('TIMESTAMP'):
+        return 'timestamp'
+
+    return ATHENA_TYPES.get(type_name, 'varchar')
+
+
+PARTITION_SPEC = re.compile(r"PARTITION\s*\(\s*(\w+)\s*=\s*'([^']*)'\s*\)", re.IGNORECASE)
+TABLE_PROPERTY = re.compile(r'"([^"]+)"\s*=\s*"([^"]*)"')
+
+ADD_PARTITIONS = re.compile(r'^ALTER\s+TABLE\s+([\w."-]+)\s+ADD\b', re.IGNORECASE)
+SET_PROPERTIES = re.compile(r'^ALTER\s+TABLE\s+([\w."-]+)\s+SET\s+TBLPROPERTIES\b', re.IGNORECASE)
+CREATE_TABLE = re.compile(r'^CREATE\s+EXTERNAL\s+TABLE\s+IF\s+NOT\s+EXISTS\s+([\w."-]+)', re.IGNORECASE)
+CREATE_VIEW = re.compile(r'^CREATE\s+OR\s+REPLACE\s+VIEW\s+([\w."-]+)\s+AS\s+(.*)$', re.IGNORECASE | re.DOTALL)
+INSERT_INTO = re.compile(r'^INSERT\s+INTO\s+([\w."-]+)\s+(.*)$', re.IGNORECASE | re.DOTALL)
+UNLOAD = re.compile(r"^UNLOAD\s*\((.*)\)\s*TO\s*'([^']+)'\s*WITH\s*\(.*\)$", re.IGNORECASE | re.DOTALL)
+SELECT = re.compile(r'^(SELECT|WITH)\b', re.IGNORECASE)
+
+
+def _take_rows(cursor: dict, count: int):
+
+    rows_df = cursor['buffer']
+
+    while len(rows_df) < count:
+        try:
+            rows_df = pd.concat([rows_df, cursor['reader'].get_chunk(count - len(rows_df))]) if len(rows_df) else cursor['reader'].get_chunk(count)
+        except StopIteration:
+            break
+
+    cursor['buffer'] = rows_df.iloc[count:]
+    cursor['position'] += min(count, len(rows_df))
+
+    return rows_df.iloc[:count]
+
+
+class LocalAthenaClient:
+
+    """Runs each query synchronously in a fresh DuckDB connection.
+
+    Every catalog table is a view over its local files (only registered
+    partitions, unless the table is a source or uses partition projection),
+    under each database name as well as unqualified.
+    """
+
+    _executions = {}
+    _lock = threading.Lock()
+
+    # Views over the local table files
+    # -----------
+
+    def _table_files(self, name: str, table: dict):
+
+        bucket, prefix = _split_location(table['location'])
+        root = _local_path(bucket, prefix.rstrip('/'))
+
+        files = sorted(p for p in glob.glob(os.path.join(root, '**', '*'), recursive=True)
+                       if os.path.isfile(p) and not os.path.basename(p).startswith(('.', '_')) and not p.endswith('.tmp'))
+
+        if table.get('source') or table['parameters'].get('projection.enabled', 'false').lower() == 'true':
+            return files
+
+        registered = _catalog.partitions(name)
+        partition_value = re.compile(rf"{table['partition_key']}=([^/\\]+)")
+
+        return [p for p in files if partition_value.search(p) and partition_value.search(p).group(1) in registered]
+
+    def _table_view_sql(self, name: str, table: dict, files: list):
+
+        key, key_type = table['partition_key'], table['partition_type']
+
+        if not files:
+
+            if table['columns'] is None:
+                raise FileNotFoundError(f'No files for {name} under {table["location"]}')
+
+            columns = ', '.join(f'CAST(NULL AS {t}) AS {n}' for n, t in table['columns'] + [[key, key_type]])
+
+            return f'SELECT {columns} WHERE false'
+
+        file_list = '[' + ', '.join(_sql_string(p) for p in files) + ']'
+        hive = 'true' if any(f'{key}=' in p for p in files) else 'false'
+
+        if table['format'] == 'csv':
+            columns = '{' + ', '.join(f'{_sql_string(n)}: {_sql_string(t)}' for n, t in table['columns']) + '}'
+            source = f'read_csv({file_list}, header = true, columns = {columns}, hive_partitioning = {hive})'
+        else:
+            source = f'read_parquet({file_list}, hive_partitioning = {hive}, union_by_name = true)'
+
+        return f'SELECT * REPLACE (CAST({key} AS {key_type}) AS {key}) FROM {source}'
+
+    def _connect(self):
+
+        con = duckdb.connect()
+
+        scanned_bytes = {}
+
+        for name, table in _catalog.tables().items():
+
+            try:
+                files = self._table_files(name, table)
+                con.execute(f'CREATE VIEW {name} AS {self._table_view_sql(name, table, files)}')
+            except FileNotFoundError as e:
+                logger.warning(f'Local table {name} is unavailable: {e}')
+                continue
+
+            scanned_bytes[name] = sum(os.path.getsize(p) for p in files)
+
+        for database in LOCAL_DATABASES:
+            con.execute(f'CREATE SCHEMA "{database}"')
+            for name in scanned_bytes:
+                con.execute(f'CREATE VIEW "{database}".{name} AS SELECT * FROM main.{name}')
+
+        for name, query in _catalog.views().items():
+            try:
+                con.execute(f'CREATE VIEW {name} AS {query}')
+            except duckdb.Error as e:
+                logger.warning(f'Local view {name} is unavailable: {e}')
+
+        return con, scanned_bytes
+
+    # Statements
+    # -----------
+
+    def _select(self, con, query: str, output_location: str):
+
+        relation = con.sql(query)
+
+        bucket, key = _split_location(output_location)
+        path = _local_path(bucket, key)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+
+        relation.write_csv(path, header=True, quoting='ALL')
+
+        return [{'Name': n, 'Type': _athena_type(t)} for n, t in zip(relation.columns, relation.types)]
+
+    def _insert(self, con, table_name: str, query: str, query_execution_id: str):
+
+        table = _catalog.table(table_name)
+        key = table['partition_key']
+        column_names = [n for n, _ in table['columns']] + [key]
+
+        con.execute(f"CREATE TEMP TABLE inserted AS SELECT * FROM ({query}) AS q({', '.join(column_names)})")
+
+        values = [str(row[0]) for row in con.execute(f'SELECT DISTINCT CAST({key} AS VARCHAR) FROM inserted').fetchall()]
+
+        bucket, prefix = _split_location(table['location'])
+
+        for value in values:
+
+            path = _local_path(bucket, f"{prefix.rstrip('/')}/{key}={value}/{query_execution_id}.{table['format']}")
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+
+            # Like Athena, text output has no header row (the CSV table then
+            # skips the first row on read, as it does in Athena)
+            options = '(HEADER false)' if table['format'] == 'csv' else '(FORMAT PARQUET)'
+            con.execute(f"COPY (SELECT * EXCLUDE ({key}) FROM inserted WHERE CAST({key} AS VARCHAR) = {_sql_string(value)}) "
+                        f"TO {_sql_string(path)} {options}")
+
+        # Athena adds the partitions an INSERT writes
+        _catalog.add_partitions(table_name.split('.')[-1], values)
+
+    # Like Athena, an UNLOAD without rows writes no files
+    def _unload(self, con, query: str, location: str, query_execution_id: str):
+
+        con.execute(f'CREATE TEMP TABLE unloaded AS {query}')
+
+        if con.execute('SELECT COUNT(*) FROM unloaded').fetchone()[0] == 0:
+            return
+
+        bucket, prefix = _split_location(location)
+        path = _local_path(bucket, f"{prefix.rstrip('/')}/{query_execution_id}.parquet")
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+
+        con.execute(f'COPY unloaded TO {_sql_string(path)} (FORMAT PARQUET, COMPRESSION SNAPPY)')
+
+    def _execute(self, query: str, output_location: str, query_execution_id: str):
+
+        statement = query.strip().rstrip(';').strip()
+
+        if ADD_PARTITIONS.match(statement):
+            table = ADD_PARTITIONS.match(statement).group(1).split('.')[-1]
+            _catalog.add_partitions(table, [value for _, value in PARTITION_SPEC.findall(statement)])
+            return [], {}
+
+        if SET_PROPERTIES.match(statement):
+            table = SET_PROPERTIES.match(statement).group(1).split('.')[-1]
+            _catalog.set_parameters(table, dict(TABLE_PROPERTY.findall(statement)))
+            return [], {}
+
+        # Every local table exists up front, so IF NOT EXISTS leaves it as is
+        if CREATE_TABLE.match(statement):
+            _catalog.table(CREATE_TABLE.match(statement).group(1).split('.')[-1])
+            return [], {}
+
+        con, scanned_bytes = self._connect()
+
+        try:
+            if CREATE_VIEW.match(statement):
+                name, view_query = CREATE_VIEW.match(statement).groups()
+                con.execute(f'CREATE OR REPLACE VIEW {name} AS {view_query}')
+                _catalog.set_view(name, view_query)
+                return [], {}
+
+            if INSERT_INTO.match(statement):
+                self._insert(con, *INSERT_INTO.match(statement).groups(), query_execution_id=query_execution_id)
+                return [], scanned_bytes
+
+            if UNLOAD.match(statement):
+                self._unload(con, *UNLOAD.match(statement).groups(), query_execution_id=query_execution_id)
+                return [], scanned_bytes
+
+            if SELECT.match(statement):
+                return self._select(con, statement, output_location), scanned_bytes
+
+            raise ValueError(f'Statement not supported by the local backend: {statement[:80]}')
+
+        finally:
+            con.close()
+
+    # Athena API
+    # -----------
+
+    def start_query_execution(self, QueryString: str, ResultConfiguration: dict, QueryExecutionContext: dict = None,
+                              WorkGroup: str = 'primary', **kwargs):
+
+        query_execution_id = str(uuid.uuid4())
+        output_location = f"{ResultConfiguration['OutputLocation'].rstrip('/')}/{query_execution_id}.csv"
+
+        submitted = datetime.now(timezone.utc)
+        start = time.time()
+
+        try:
+            columns, scanned_bytes = self._execute(QueryString, output_location, query_execution_id)
+            status = {'State': 'SUCCEEDED'}
+        except Exception as e:
+            columns, scanned_bytes = [], {}
+            status = {'State': 'FAILED', 'StateChangeReason': str(e)}
+
+        # Tables the query names count as fully scanned
+        data_scanned = sum(size for name, size in scanned_bytes.items() if re.search(rf'\b{name}\b', QueryString))
+
+        query_execution = {
+            'QueryExecutionId': query_execution_id,
+            'Query': QueryString,
+            'QueryExecutionContext': QueryExecutionContext or {},
+            'WorkGroup': WorkGroup,
+            'ResultConfiguration': {'OutputLocation': output_location},
+            'Status': {**status, 'SubmissionDateTime': submitted, 'CompletionDateTime': datetime.now(timezone.utc)},
+            'Statistics': {'DataScannedInBytes': data_scanned, 'EngineExecutionTimeInMillis': int((time.time() - start) * 1000)},
+        }
+
+        with self._lock:
+            self._executions[query_execution_id] = {'execution': query_execution, 'columns': columns}
+
+        return {'QueryExecutionId': query_execution_id}
+
+    def _get_execution(self, query_execution_id: str):
+
+        if query_execution_id not in self._executions:
+            raise _client_error('InvalidRequestException', f'QueryExecution {query_execution_id} was not found', 'GetQueryExecution')
+
+        return self._executions[query_execution_id]
+
+    def get_query_execution(self, QueryExecutionId: str, **kwargs):
+
+        return {'QueryExecution': self._get_execution(QueryExecutionId)['execution']}
+
+    def batch_get_query_execution(self, QueryExecutionIds: list, **kwargs):
+
+        return {'QueryExecutions': [self._get_execution(i)['execution'] for i in QueryExecutionIds],
+                'UnprocessedQueryExecutionIds': []}
+
+    def stop_query_execution(self, QueryExecutionId: str, **kwargs):
+
+        return {}
+
+    # Each page is read on from where the previous one stopped, so paging
+    # through a result parses its CSV once instead of once per page
+    def _read_page(self, query_execution_id: str, start: int, take: int):
+
+        execution = self._get_execution(query_execution_id)
+
+        with self._lock:
+
+            cursor = execution.pop('cursor', None)
+
+            # Any other page than the next one starts a new pass over the CSV
+            if cursor is None or cursor['position'] != start:
+
+                if cursor is not None:
+                    cursor['reader'].close()
+
+                bucket, key = _split_location(execution['execution']['ResultConfiguration']['OutputLocation'])
+
+                cursor = {'reader': pd.read_csv(_local_path(bucket, key), dtype=str, keep_default_na=False, na_values=[''],
+                                                iterator=True),
+                          'position': 0, 'buffer': pd.DataFrame()}
+
+                _take_rows(cursor, start)
+
+            # One row past the page tells whether another page follows
+            page_df = _take_rows(cursor, take + 1)
+
+            cursor['buffer'] = pd.concat([page_df.iloc[take:], cursor['buffer']])
+            cursor['position'] -= len(page_df.iloc[take:])
+
+            if len(page_df) > take:
+                execution['cursor'] = cursor
+            else:
+                cursor['reader'].close()
+
+            return page_df.iloc[:take], len(page_df) > take
+
+    def get_query_results(self, QueryExecutionId: str, MaxResults: int = 1000, NextToken: str = None, **kwargs):
+
+        execution = self._get_execution(QueryExecutionId)
+
+        if execution['execution']['Status']['State'] != 'SUCCEEDED':
+            raise _client_error('InvalidRequestException', 'Query has not yet finished or failed', 'GetQueryResults')
+
+        columns = execution['columns']
+        start = int(NextToken or 0)
+
+        # Like Athena, the first page starts with the header row
+        rows = [] if start else [{'Data': [{'VarCharValue': col['Name']} for col in columns]}]
+        take = MaxResults - len(rows)
+
+        if columns:
+
+            page_df, has_more = self._read_page(QueryExecutionId, start=start, take=take)
+
+            for values in page_df.itertuples(index=False):
+                rows.append({'Data': [{} if pd.isna(v) else {'VarCharValue': v} for v in values]})
+        else:
+            has_more = False
+
+        response = {'ResultSet': {'Rows': rows, 'ResultSetMetadata': {'ColumnInfo': columns}}}
+
+        if has_more:
+            response['NextToken'] = str(start + take)
+
+        return response
+
+
+# ---------------------------------------
+# CLIENTS
+# ---------------------------------------
+
+LOCAL_CLIENTS = {
+    's3': LocalS3Client,
+    'athena': LocalAthenaClient,
+    'glue': LocalGlueClient,
+}
+
+
+def get_local_client(service: str):
+
+    if service not in LOCAL_CLIENTS:
+        raise ValueError(f'No local stand-in for {service}, expected one of {", ".join(LOCAL_CLIENTS)}')
+
+    logger.info(f'Using the local {service} backend under {LOCAL_DATA_DIR}')
+
+    return LOCAL_CLIENTS[service]()
@@ -0,0 +1,83 @@
+import json
+import os
+from botocore.exceptions import ClientError
+from loguru import logger
+
+
+# -------------------------------------
+# JSON manifest stores
+# -------------------------------------
+
+# Small JSON documents the jobs keep between runs (source fingerprints,
+# backfill checkpoints).
+
+class S3ManifestStore:
+
+    def __init__(self, bucket: str, key: str, s3_client):
+
+        self.bucket = bucket
+        self.key = key
+        self.s3_client = s3_client
+
+    def exists(self):
+
+        try:
+            self.s3_client.head_object(Bucket=self.bucket, Key=self.key)
+            return True
+
+        except ClientError as e:
+            if e.response['Error']['Code'] in ['404', 'NoSuchKey', 'NotFound']:
+                return False
+            raise
+
+    def load(self):
+
+        logger.info(f'Loading manifest from {self.bucket}/{self.key}')
+
+        response = self.s3_client.get_object(Bucket=self.bucket, Key=self.key)
+
+        return json.loads(response['Body'].read())
+
+    def save(self, manifest: dict):
+
+        logger.info(f'Writing {len(manifest)} manifest entries to {self.bucket}/{self.key}')
+
+        response = self.s3_client.put_object(
+            Bucket=self.bucket,
+            Key=self.key,
+            Body=json.dumps(manifest, indent=1, sort_keys=True).encode('utf-8')
+        )
+
+        status = response['ResponseMetadata']['HTTPStatusCode']
+
+        if status == 200:
+            logger.info(f"Successful S3 put_object response for PUT ({self.key}). Status - {status}")
+        else:
+            logger.error(f"Unsuccessful S3 put_object response for PUT ({self.key}). Status - {status}")
+
+
+class LocalManifestStore:
+
+    def __init__(self, path: str):
+
+        self.path = path
+
+    def exists(self):
+
+        return os.path.exists(self.path)
+
+    def load(self):
+
+        logger.info(f'Loading manifest from {self.path}')
+
+        with open(self.path) as f:
+            return json.load(f)
+
+    def save(self, manifest: dict):
+
+        logger.info(f'Writing {len(manifest)} manifest entries to {self.path}')
+
+        os.makedirs(os.path.dirname(os.path.abspath(self.path)), exist_ok=True)
+
+        with open(self.path, 'w') as f:
+            json.dump(manifest, f, indent=1, sort_keys=True)
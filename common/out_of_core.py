@@ -0,0 +1,250 @@
+import os
+import shutil
+import tempfile
+from loguru import logger
+import numpy as np
+import pandas as pd
+import pyarrow as pa
+import pyarrow.parquet as pq
+from common.daily_stats import (DAILY_STATS_COLUMNS, prepare_line_items, encode_keys, customer_first_order_dates,
+                                apply_customer_features, compute_daily_stats)
+
+
+# ---------------------------------------
+# OUT-OF-CORE DAILY STATS
+# ---------------------------------------
+
+# For line item histories that don't fit in memory. Rows are hash-partitioned
+# by customer into Parquet buckets on local disk as the result chunks arrive,
+# then each bucket is read back on its own and run through the same
+# first-order and daily stats functions as the in-memory path:
+#   - a customer's rows all land in one bucket, so first orders, new / repeat
+#     splits and customer counts are exact per bucket and add up across them
+#   - line items without a customer get a bucket of their own (repeat spend)
+#   - an order's line items can span buckets, so distinct orders are spilled
+#     separately, partitioned by order_id, and counted per order bucket
+# Only one bucket is in memory at a time.
+
+# Estimated in-memory size above which the out-of-core path is used
+OUT_OF_CORE_THRESHOLD_MB = int(os.environ.get('OUT_OF_CORE_THRESHOLD_MB', 4096))
+
+# Prepared line items take about this many bytes per byte of result CSV
+# (object strings for email / order_id plus the derived columns)
+IN_MEMORY_BYTES_PER_CSV_BYTE = 4
+
+# UNLOADed Snappy Parquet of the same line items is about 6 times smaller
+IN_MEMORY_BYTES_PER_PARQUET_BYTE = 24
+
+IN_MEMORY_BYTES_PER_RESULT_BYTE = {'csv': IN_MEMORY_BYTES_PER_CSV_BYTE, 'parquet': IN_MEMORY_BYTES_PER_PARQUET_BYTE}
+
+# Buckets per spill, each should fit in memory comfortably
+SPILL_BUCKETS = int(os.environ.get('SPILL_BUCKETS', 64))
+
+# Where the buckets are written, defaults to the system temp directory
+SPILL_DIR = os.environ.get('SPILL_DIR')
+
+SPILL_COLUMNS = ['order_date', 'email', 'order_id', 'product_rev']
+
+
+# Pick the path from the size of the query result
+# -----------
+
+# result_format is that of the result: 'csv', or 'parquet' for an UNLOAD
+
+def use_out_of_core(result_bytes: int, threshold_mb: int = OUT_OF_CORE_THRESHOLD_MB, result_format: str = 'csv'):
+
+    estimated_mb = result_bytes * IN_MEMORY_BYTES_PER_RESULT_BYTE[result_format] / 1024 ** 2
+
+    out_of_core = estimated_mb > threshold_mb
+
+    logger.info(f"Line items estimated at {estimated_mb:.0f} MB in memory (threshold {threshold_mb} MB), "
+                f"aggregating {'out of core' if out_of_core else 'in memory'}")
+
+    return out_of_core
+
+
+# Bucket of each row by hashed key, missing keys go to bucket_count
+# -----------
+
+def hash_buckets(values: pd.Series, bucket_count: int):
+
+    values = values.astype('object').to_numpy()
+
+    buckets = (pd.util.hash_array(values) % bucket_count).astype('int64')
+    buckets[pd.isna(values)] = bucket_count
+
+    return buckets
+
+
+class OutOfCoreDailyStats:
+
+    """Spills line item chunks to customer buckets on disk, then aggregates
+    the buckets one at a time.
+
+    Use as a context manager so the spill directory is removed afterwards.
+    """
+
+    def __init__(self, bucket_count: int = SPILL_BUCKETS, spill_dir: str = SPILL_DIR):
+
+        self.bucket_count = bucket_count
+        self.path = tempfile.mkdtemp(prefix='daily_stats_spill_', dir=spill_dir)
+        self.chunks = 0
+        self.rows = 0
+
+    def __enter__(self):
+
+        return self
+
+    def __exit__(self, *exc):
+
+        self.close()
+
+    def close(self):
+
+        shutil.rmtree(self.path, ignore_errors=True)
+
+    def _bucket_dir(self, kind: str, bucket: int):
+
+        return os.path.join(self.path, kind, f'bucket={bucket:05d}')
+
+    def _write_buckets(self, kind: str, df: pd.DataFrame, buckets: np.ndarray):
+
+        order = np.argsort(buckets, kind='stable')
+        sorted_buckets = buckets[order]
+
+        bucket_ids, starts = np.unique(sorted_buckets, return_index=True)
+        ends = np.append(starts[1:], len(order))
+
+        for bucket, start, end in zip(bucket_ids, starts, ends):
+
+            bucket_dir = self._bucket_dir(kind, bucket)
+            os.makedirs(bucket_dir, exist_ok=True)
+
+            table = pa.Table.from_pandas(df.iloc[order[start:end]], preserve_index=False)
+            pq.write_table(table, os.path.join(bucket_dir, f'part-{self.chunks:06d}.parquet'))
+
+    def _read_bucket(self, kind: str, bucket: int):
+
+        bucket_dir = self._bucket_dir(kind, bucket)
+
+        if not os.path.isdir(bucket_dir):
+            return None
+
+        df = pq.read_table(bucket_dir).to_pandas()
+        df['order_date'] = df['order_date'].astype('datetime64[ns]')
+
+        return df
+
+    # Spill one chunk of raw line items
+    # -----------
+
+    def add_chunk(self, chunk_df: pd.DataFrame):
+
+        df = prepare_line_items(chunk_df)[SPILL_COLUMNS]
+
+        self._write_buckets('customers', df, hash_buckets(df['email'], self.bucket_count))
+
+        # Distinct orders per day, rows without a date or order join no count
+        orders = df.loc[df['order_date'].notna() & df['order_id'].notna(), ['order_date', 'order_id']].drop_duplicates()
+
+        self._write_buckets('orders', orders, hash_buckets(orders['order_id'], self.bucket_count))
+
+        self.chunks += 1
+        self.rows += len(df)
+
+    def add_chunks(self, chunks):
+
+        for chunk_df in chunks:
+            self.add_chunk(chunk_df)
+
+        logger.info(f'Spilled {self.rows} line items in {self.chunks} chunks to {self.bucket_count} buckets under {self.path}')
+
+        return self
+
+    # Aggregate the buckets and combine them
+    # -----------
+
+    # state_df holds first orders from before these line items (customer state),
+    # days restricts the output to those order dates ('YYYY-MM-DD').
+    # Returns the daily stats and every customer's first order date, as
+    # add_customer_features + compute_daily_stats would.
+
+    def finalize(self, state_df: pd.DataFrame = None, days: list = None):
+
+        day_filter = None if days is None else pd.to_datetime(days)
+
+        state_buckets = None
+        if state_df is not None and len(state_df):
+            state_buckets = hash_buckets(state_df['email'], self.bucket_count)
+
+        partials = []
+        first_orders = []
+
+        # Customer buckets, plus the one for line items without a customer
+        for bucket in range(self.bucket_count + 1):
+
+            bucket_df = self._read_bucket('customers', bucket)
+
+            if bucket_df is None:
+                continue
+
+            bucket_df, key_dictionaries = encode_keys(bucket_df)
+
+            bucket_state_df = None if state_buckets is None else state_df.loc[state_buckets == bucket]
+
+            first_dates, first_order_df = customer_first_order_dates(bucket_df, customers=key_dictionaries['email'], state_df=bucket_state_df)
+
+            bucket_df = apply_customer_features(bucket_df, first_dates)
+
+            if day_filter is not None:
+                bucket_df = bucket_df.loc[bucket_df['order_date'].isin(day_filter)]
+
+            if len(bucket_df):
+                partials.append(compute_daily_stats(bucket_df))
+
+            first_orders.append(first_order_df)
+
+        order_counts = []
+
+        for bucket in range(self.bucket_count):
+
+            orders_df = self._read_bucket('orders', bucket)
+
+            if orders_df is None:
+                continue
+
+            if day_filter is not None:
+                orders_df = orders_df.loc[orders_df['order_date'].isin(day_filter)]
+
+            order_counts.append(orders_df.drop_duplicates().groupby('order_date').size())
+
+        first_order_df = pd.concat(first_orders, ignore_index=True) if first_orders else pd.DataFrame(columns=['email', 'first_order_date'])
+
+        if not partials:
+            return pd.DataFrame(columns=DAILY_STATS_COLUMNS), first_order_df
+
+        daily_stats_df = self._combine(partials, order_counts)
+
+        logger.info(f'{len(daily_stats_df)} days from {len(partials)} buckets and {len(first_order_df)} customers')
+
+        return daily_stats_df, first_order_df
+
+    @staticmethod
+    def _combine(partials: list, order_counts: list):
+
+        grouped = pd.concat(partials, ignore_index=True).groupby('order_date')
+
+        # Customers are disjoint across buckets, so counts and spends add up;
+        # a day keeps NaN new / repeat stats only if no bucket had any
+        daily_stats_df = grouped[['total_product_revenue', 'total_customer_count']].sum()
+
+        for col in ['new_customer_count', 'new_customer_spend', 'repeat_customer_count', 'repeat_customer_spend']:
+            daily_stats_df[col] = grouped[col].sum(min_count=1)
+
+        order_count = pd.concat(order_counts).groupby(level=0).sum() if order_counts else pd.Series(dtype='int64', index=pd.DatetimeIndex([]))
+        order_count.index = order_count.index.strftime('%Y-%m-%d')
+
+        daily_stats_df['total_order_count'] = order_count.reindex(daily_stats_df.index, fill_value=0)
+        daily_stats_df['daily_aov'] = daily_stats_df['total_product_revenue'] / daily_stats_df['total_order_count']
+
+        return daily_stats_df.reset_index()[DAILY_STATS_COLUMNS]
@@ -0,0 +1,79 @@
+from concurrent.futures import ProcessPoolExecutor
+import os
+from loguru import logger
+import numpy as np
+import pandas as pd
+from common.daily_stats import apply_customer_features, compute_daily_stats, customer_first_order_dates
+
+
+# ---------------------------------------
+# PARALLEL AGGREGATION ACROSS DATE SHARDS
+# ---------------------------------------
+
+# Once every customer's first order date is known the days are independent.
+# The first order dates are computed once over all line items and sent to
+# every worker as one compact array indexed by customer code; each worker
+# flags its own date range and aggregates it, and the per-day rows are
+# concatenated back together.
+
+# Worker processes, 1 keeps everything in the current process
+AGGREGATION_WORKERS = int(os.environ.get('AGGREGATION_WORKERS', 1))
+
+# Only what the aggregation reads is shipped to the workers
+SHARD_COLUMNS = ['order_date', 'customer_key', 'order_key', 'product_rev']
+
+
+# Split line items into contiguous date ranges of roughly equal row counts
+# -----------
+
+def split_by_date_range(df: pd.DataFrame, shard_count: int):
+
+    order_date = df['order_date'].to_numpy(dtype='datetime64[ns]')
+
+    dates, counts = np.unique(order_date[~np.isnat(order_date)], return_counts=True)
+
+    if len(dates) == 0:
+        return [df]
+
+    # Cut the sorted days where the running row count crosses each 1/n mark
+    cumulative = np.cumsum(counts)
+    targets = cumulative[-1] * np.arange(1, shard_count) / shard_count
+    boundaries = np.unique(dates[np.searchsorted(cumulative, targets, side='right').clip(max=len(dates) - 1)])
+
+    shard_ids = np.searchsorted(boundaries, order_date, side='right')
+
+    # Rows without an order date join no day, the aggregation drops them anyway
+    shard_ids[np.isnat(order_date)] = -1
+
+    return [df.loc[shard_ids == shard_id] for shard_id in range(len(boundaries) + 1) if (shard_ids == shard_id).any()]
+
+
+def _aggregate_date_shard(shard_df: pd.DataFrame, first_dates: np.ndarray):
+
+    return compute_daily_stats(apply_customer_features(shard_df, first_dates))
+
+
+# First order dates once, then aggregate the date shards in parallel
+# -----------
+
+# Same result as add_customer_features + compute_daily_stats. Returns the
+# daily stats and the first order date of every customer seen.
+
+def aggregate_daily_stats_parallel(shopify_line_item_df: pd.DataFrame, customers: np.ndarray, state_df: pd.DataFrame = None,
+                                   max_workers: int = AGGREGATION_WORKERS):
+
+    first_dates, first_order_df = customer_first_order_dates(shopify_line_item_df, customers=customers, state_df=state_df)
+
+    shards = split_by_date_range(shopify_line_item_df[SHARD_COLUMNS], shard_count=max_workers)
+
+    logger.info(f'Aggregating {len(shopify_line_item_df)} line items in {len(shards)} date shards with {max_workers} workers')
+
+    if max_workers <= 1 or len(shards) <= 1:
+        partials = [_aggregate_date_shard(shard, first_dates) for shard in shards]
+    else:
+        with ProcessPoolExecutor(max_workers=max_workers) as executor:
+            partials = list(executor.map(_aggregate_date_shard, shards, [first_dates] * len(shards)))
+
+    daily_stats_df = pd.concat(partials, ignore_index=True).sort_values('order_date', ignore_index=True)
+
+    return daily_stats_df, first_order_df
@@ -0,0 +1,205 @@
+from botocore.exceptions import ClientError
+from loguru import logger
+import os
+from common.athena import run_athena_queries_no_results
+from common.aws import get_glue_client
+
+
+# Partitions added per ALTER TABLE statement
+PARTITION_BATCH_SIZE = 200
+
+# Glue limits: 100 partitions per batch_create_partition, 1000 per batch_get_partition
+GLUE_CREATE_BATCH_SIZE = 100
+GLUE_GET_BATCH_SIZE = 1000
+
+# How partitions are registered: 'glue' (batch_create_partition) or 'athena' (ALTER TABLE)
+PARTITION_REGISTRATION = os.environ.get('PARTITION_REGISTRATION', 'glue')
+
+
+# Build one ALTER TABLE that adds many partitions
+# -----------
+
+def build_add_partitions_query(partition_dates: list, table: str = 'shopify_daily_stats', partition_key: str = 'partition_date'):
+
+    partition_specs = '\n'.join(f"  PARTITION ({partition_key} = '{d}')" for d in partition_dates)
+
+    return f"""
+
+ALTER TABLE {table} ADD IF NOT EXISTS
+{partition_specs}
+
+"""
+
+
+# ---------------------------------------
+# PARTITION REGISTRAR
+# ---------------------------------------
+
+class PartitionRegistrar:
+
+    """Collects new partition_date values and registers them in bulk.
+
+    Partitions already in the Glue catalog are skipped, the rest are added
+    with batch_create_partition or multi-partition ALTER TABLE statements.
+    flush() returns the partitions that could not be registered.
+    """
+
+    def __init__(self, table: str = 'shopify_daily_stats', database: str = 'prymal-analytics', glue_client=None,
+                 method: str = PARTITION_REGISTRATION, region: str = 'us-east-1', partition_key: str = 'partition_date'):
+
+        self.table = table
+        self.partition_key = partition_key
+        self.database = database
+        self.glue_client = glue_client if glue_client is not None else get_glue_client(region)
+        self.method = method
+        self.pending = set()
+
+    def add(self, partition_date: str):
+
+        self.pending.add(partition_date)
+
+    def add_many(self, partition_dates: list):
+
+        self.pending.update(partition_dates)
+
+    # Look up which of the given partitions the catalog already has
+    # -----------
+
+    def existing_partitions(self, partition_dates: list):
+
+        existing = set()
+
+        for i in range(0, len(partition_dates), GLUE_GET_BATCH_SIZE):
+
+            response = self.glue_client.batch_get_partition(
+                DatabaseName=self.database,
+                TableName=self.table,
+                PartitionsToGet=[{'Values': [d]} for d in partition_dates[i:i + GLUE_GET_BATCH_SIZE]]
+            )
+
+            existing.update(p['Values'][0] for p in response.get('Partitions', []))
+
+        return existing
+
+    # Tables with partition projection resolve partitions from their properties
+    # -----------
+
+    def uses_partition_projection(self):
+
+        try:
+            table = self.glue_client.get_table(DatabaseName=self.database, Name=self.table)['Table']
+        except ClientError as e:
+            logger.error(f"Unable to read table {self.table}: {e}")
+            return False
+
+        return table.get('Parameters', {}).get('projection.enabled', 'false').lower() == 'true'
+
+    # Register every pending partition not already in the catalog
+    # -----------
+
+    # Returns the ones that failed, so callers can keep those days pending
+
+    def flush(self):
+
+        partition_dates = sorted(self.pending)
+        self.pending = set()
+
+        if not partition_dates:
+            logger.info('No partitions to register')
+            return []
+
+        if self.uses_partition_projection():
+            logger.info(f'{self.table} uses partition projection, skipping registration of {len(partition_dates)} partitions')
+            return []
+
+        try:
+            existing = self.existing_partitions(partition_dates)
+        except ClientError as e:
+            logger.error(f"Unable to read existing partitions, registering all: {e}")
+            existing = set()
+
+        new_dates = [d for d in partition_dates if d not in existing]
+
+        logger.info(f'{len(existing)} partitions already registered on {self.table}, registering {len(new_dates)}')
+
+        if not new_dates:
+            return []
+
+        if self.method == 'glue':
+            failed_dates = self._create_glue_partitions(new_dates)
+        else:
+            failed_dates = self._run_alter_table(new_dates)
+
+        if failed_dates:
+            logger.error(f'{len(failed_dates)} partitions were not registered on {self.table}')
+
+        return failed_dates
+
+    def _run_alter_table(self, partition_dates: list):
+
+        batches = [partition_dates[i:i + PARTITION_BATCH_SIZE] for i in range(0, len(partition_dates), PARTITION_BATCH_SIZE)]
+
+        queries = [build_add_partitions_query(batch, table=self.table, partition_key=self.partition_key) for batch in batches]
+
+        logger.info(f'Registering {len(partition_dates)} partitions on {self.table} in {len(queries)} queries')
+
+        try:
+            query_executions = run_athena_queries_no_results(queries=queries, database=self.database)
+        except Exception as e:
+            logger.error(f"Unable to run the ALTER TABLE queries on {self.table}: {e}")
+            return sorted(partition_dates)
+
+        return sorted(d for batch, query_execution in zip(batches, query_executions)
+                      if query_execution['Status']['State'] != 'SUCCEEDED'
+                      for d in batch)
+
+    def _create_glue_partitions(self, partition_dates: list):
+
+        # Partitions inherit the table's storage descriptor with their own location
+        storage_descriptor = self.glue_client.get_table(DatabaseName=self.database, Name=self.table)['Table']['StorageDescriptor']
+        table_location = storage_descriptor['Location'].rstrip('/')
+
+        logger.info(f'Registering {len(partition_dates)} partitions on {self.table} with batch_create_partition')
+
+        failed_dates = []
+
+        for i in range(0, len(partition_dates), GLUE_CREATE_BATCH_SIZE):
+
+            batch = partition_dates[i:i + GLUE_CREATE_BATCH_SIZE]
+
+            try:
+                response = self.glue_client.batch_create_partition(
+                    DatabaseName=self.database,
+                    TableName=self.table,
+                    PartitionInputList=[{
+                        'Values': [d],
+                        'StorageDescriptor': {**storage_descriptor, 'Location': f'{table_location}/{self.partition_key}={d}/'}
+                    } for d in batch]
+                )
+
+            except ClientError as e:
+                logger.error(f"Failed to register partitions {batch[0]} - {batch[-1]}: {e}")
+                failed_dates.extend(batch)
+                continue
+
+            for error in response.get('Errors', []):
+                if error['ErrorDetail']['ErrorCode'] != 'AlreadyExistsException':
+                    logger.error(f"Failed to register partition {error['PartitionValues']}: {error['ErrorDetail']}")
+                    failed_dates.extend(error['PartitionValues'])
+
+        return sorted(failed_dates)
+
+
+# Register partitions in batches instead of one query per day
+# -----------
+
+# Returns the partitions that could not be registered
+
+def register_partitions(partition_dates: list, table: str = 'shopify_daily_stats', database: str = 'prymal-analytics',
+                        partition_key: str = 'partition_date'):
+
+    registrar = PartitionRegistrar(table=table, database=database, partition_key=partition_key)
+
+    registrar.add_many(partition_dates)
+
+    return registrar.flush()
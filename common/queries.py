@@ -0,0 +1,214 @@
+
+# ---------------------------------------
+# SHOPIFY LINE ITEMS QUERY BUILDER
+# ---------------------------------------
+
+# Only the columns the daily stats are built from
+LINE_ITEM_COLUMNS = ['order_date', 'email', 'order_id', 'quantity', 'price']
+
+
+# Build a SELECT over shopify_line_items with column and date-range pushdown
+# -----------
+
+# start_date / end_date are inclusive 'YYYY-MM-DD' strings, either may be None.
+# partition_dates, if given, selects those days only. Filtering on
+# partition_date lets Athena prune partitions instead of scanning the full table.
+
+def build_line_items_query(columns: list = LINE_ITEM_COLUMNS, start_date: str = None, end_date: str = None,
+                           date_column: str = 'partition_date', table: str = 'shopify_line_items', partition_dates: list = None):
+
+    predicates = []
+
+    if partition_dates is not None:
+        predicates.append(f"{date_column} IN ({_partition_list(partition_dates)})")
+
+    if start_date is not None and start_date == end_date:
+        predicates.append(f"{date_column} = DATE '{start_date}'")
+    else:
+        if start_date is not None:
+            predicates.append(f"{date_column} >= DATE '{start_date}'")
+        if end_date is not None:
+            predicates.append(f"{date_column} <= DATE '{end_date}'")
+
+    query = f"""SELECT {', '.join(columns)}
+                FROM {table}"""
+
+    if predicates:
+        query += f"""
+                WHERE {' AND '.join(predicates)}"""
+
+    return query
+
+
+# ---------------------------------------
+# SERVER-SIDE DAILY STATS
+# ---------------------------------------
+
+# Athena equivalent of common/daily_stats.py - one row per order_date. First
+# order dates need every earlier order, so only end_date is pushed down into
+# the line items scan; start_date filters the aggregated days.
+# -----------
+
+def build_daily_stats_query(start_date: str = None, end_date: str = None, table: str = 'shopify_line_items'):
+
+    scan_predicate = f"WHERE partition_date <= DATE '{end_date}'" if end_date is not None else ''
+
+    day_predicates = ['order_date IS NOT NULL']
+
+    if start_date is not None:
+        day_predicates.append(f"order_date >= DATE '{start_date}'")
+    if end_date is not None:
+        day_predicates.append(f"order_date <= DATE '{end_date}'")
+
+    query = f"""WITH line_items AS (
+                    SELECT CAST(SUBSTR(CAST(order_date AS VARCHAR), 1, 10) AS DATE) AS order_date
+                        , email
+                        , order_id
+                        , CAST(quantity AS DOUBLE) * CAST(price AS DOUBLE) AS product_rev
+                    FROM {table}
+                    {scan_predicate}
+                )
+                , line_items_with_first_order AS (
+                    SELECT *
+                        , CASE WHEN email IS NOT NULL THEN MIN(order_date) OVER (PARTITION BY email) END AS first_order_date
+                    FROM line_items
+                )
+                , flagged AS (
+                    SELECT *
+                        , COALESCE(order_date = first_order_date, FALSE) AS first_order_fl
+                    FROM line_items_with_first_order
+                    WHERE {' AND '.join(day_predicates)}
+                )
+                SELECT order_date
+                    , SUM(product_rev) AS total_product_revenue
+                    , COUNT(DISTINCT order_id) AS total_order_count
+                    , COUNT(DISTINCT email) AS total_customer_count
+                    , SUM(product_rev) / COUNT(DISTINCT order_id) AS daily_aov
+                    , CASE WHEN COUNT_IF(first_order_fl) > 0 THEN COUNT(DISTINCT CASE WHEN first_order_fl THEN email END) END AS new_customer_count
+                    , SUM(CASE WHEN first_order_fl THEN product_rev END) AS new_customer_spend
+                    , CASE WHEN COUNT_IF(NOT first_order_fl) > 0 THEN COUNT(DISTINCT CASE WHEN NOT first_order_fl THEN email END) END AS repeat_customer_count
+                    , SUM(CASE WHEN NOT first_order_fl THEN product_rev END) AS repeat_customer_spend
+                FROM flagged
+                GROUP BY order_date
+                ORDER BY order_date
+            """
+
+    return query
+
+
+# INSERT the server-side daily stats straight into shopify_daily_stats_parquet
+# -----------
+
+# Athena writes the files under the table location and adds the partitions
+# itself. INSERT INTO appends, so existing data for the days must be removed
+# once the INSERT has succeeded.
+#
+# Only the Parquet table is a valid target: Athena writes INSERT output to a
+# text table without a header row, and the CSV table skips the first line of
+# every file (skip.header.line.count), which would drop the day's only row.
+
+def build_daily_stats_insert_query(start_date: str = None, end_date: str = None,
+                                   source_table: str = 'prymal.shopify_line_items',
+                                   target_table: str = 'shopify_daily_stats_parquet'):
+
+    stats_query = build_daily_stats_query(start_date=start_date, end_date=end_date, table=source_table)
+
+    query = f"""INSERT INTO {target_table}
+                SELECT order_date
+                    , CAST(total_product_revenue AS DOUBLE)
+                    , CAST(total_order_count AS INTEGER)
+                    , CAST(total_customer_count AS INTEGER)
+                    , CAST(daily_aov AS DOUBLE)
+                    , CAST(new_customer_count AS INTEGER)
+                    , CAST(new_customer_spend AS DOUBLE)
+                    , CAST(repeat_customer_count AS INTEGER)
+                    , CAST(repeat_customer_spend AS DOUBLE)
+                    , order_date AS partition_date
+                FROM ({stats_query.strip()})
+            """
+
+    return query
+
+
+# First order date per customer (used to seed the customer state store)
+# -----------
+
+# With a start_date only partitions from it on are scanned - the first orders
+# of the customers seen in them, as of those partitions.
+
+def build_first_orders_query(end_date: str = None, table: str = 'shopify_line_items', start_date: str = None):
+
+    scan_predicates = []
+
+    if start_date is not None:
+        scan_predicates.append(f"AND partition_date >= DATE '{start_date}'")
+    if end_date is not None:
+        scan_predicates.append(f"AND partition_date <= DATE '{end_date}'")
+
+    scan_predicate = '\n                '.join(scan_predicates)
+
+    query = f"""SELECT email
+                    , MIN(SUBSTR(CAST(order_date AS VARCHAR), 1, 10)) AS first_order_date
+                FROM {table}
+                WHERE email IS NOT NULL
+                {scan_predicate}
+                GROUP BY email
+            """
+
+    return query
+
+
+# ---------------------------------------
+# SOURCE CHANGE DETECTION
+# ---------------------------------------
+
+def _partition_list(partition_dates: list):
+
+    return ', '.join(f"DATE '{d}'" for d in partition_dates)
+
+
+# Line item count per source partition
+# -----------
+
+def build_partition_row_counts_query(partition_dates: list, table: str = 'shopify_line_items'):
+
+    query = f"""SELECT CAST(partition_date AS VARCHAR) AS partition_date
+                    , COUNT(*) AS row_count
+                FROM {table}
+                WHERE partition_date IN ({_partition_list(partition_dates)})
+                GROUP BY partition_date
+            """
+
+    return query
+
+
+# Order dates of the line items in the given source partitions
+# -----------
+
+# Only the days whose own line items changed. A restated order can also move
+# a customer's first order, which flips new vs repeat on another day - those
+# days come from comparing first order dates (see backfill/restate.py), not
+# from the customers' full history.
+
+def build_affected_order_dates_query(partition_dates: list, table: str = 'shopify_line_items'):
+
+    query = f"""SELECT DISTINCT SUBSTR(CAST(order_date AS VARCHAR), 1, 10) AS order_date
+                FROM {table}
+                WHERE partition_date IN ({_partition_list(partition_dates)})
+                  AND order_date IS NOT NULL
+            """
+
+    return query
+
+
+# First and last source partition (default range of a backfill)
+# -----------
+
+def build_partition_bounds_query(table: str = 'shopify_line_items'):
+
+    query = f"""SELECT CAST(MIN(partition_date) AS VARCHAR) AS min_partition_date
+                    , CAST(MAX(partition_date) AS VARCHAR) AS max_partition_date
+                FROM {table}
+            """
+
+    return query
@@ -0,0 +1,161 @@
+import base64
+import hashlib
+from botocore.exceptions import BotoCoreError, ClientError, NoCredentialsError, PartialCredentialsError
+from loguru import logger
+from common.aws import get_s3_client
+from common.throttle import call_with_backoff
+
+
+REGION = 'us-east-1'
+
+
+def _log_s3_error(e: Exception):
+
+    if isinstance(e, NoCredentialsError):
+        # Handle missing AWS credentials
+        logger.error("No AWS credentials found. Please configure your credentials.")
+
+    elif isinstance(e, PartialCredentialsError):
+        # Handle incomplete AWS credentials
+        logger.error(f"Partial AWS credentials error: {e}")
+
+    elif isinstance(e, ClientError):
+        # Handle S3-specific errors
+        if e.response['Error']['Code'] == 'NoSuchBucket':
+            logger.error(f"The specified bucket does not exist: {e}")
+        elif e.response['Error']['Code'] == 'NoSuchKey':
+            logger.error(f"The specified object key does not exist: {e}")
+        else:
+            logger.error(f"AWS S3 Error: {e}")
+
+    elif isinstance(e, BotoCoreError):
+        # Handle general BotoCore errors (e.g., network issues)
+        logger.error(f"BotoCore Error: {e}")
+
+    else:
+        # Handle other exceptions
+        logger.error(f"Other Exception: {e}")
+
+
+# Check S3 Path for Existing Data
+# -----------
+
+def check_path_for_objects(bucket: str, s3_prefix:str, s3_client=None):
+
+    logger.info(f'Checking for existing data in {bucket}/{s3_prefix}')
+
+    if s3_client is None:
+        s3_client = get_s3_client(REGION)
+
+    # List objects in s3_prefix
+    result = s3_client.list_objects_v2(Bucket=bucket, Prefix=s3_prefix)
+
+    # Instantiate objects_exist
+    objects_exist=False
+
+    # Set objects_exist to true if objects are in prefix
+    if 'Contents' in result:
+        objects_exist=True
+
+        logger.info('Data already exists!')
+
+    return objects_exist
+
+
+# List & delete the objects under an S3 prefix
+# -----------
+
+def list_s3_keys(bucket: str, s3_prefix: str, s3_client=None):
+
+    if s3_client is None:
+        s3_client = get_s3_client(REGION)
+
+    paginator = s3_client.get_paginator('list_objects_v2')
+
+    return [obj['Key'] for page in paginator.paginate(Bucket=bucket, Prefix=s3_prefix) for obj in page.get('Contents', [])]
+
+
+def delete_s3_keys(bucket: str, keys: list, s3_client=None):
+
+    if s3_client is None:
+        s3_client = get_s3_client(REGION)
+
+    # delete_objects takes up to 1000 keys per call
+    for i in range(0, len(keys), 1000):
+        response = s3_client.delete_objects(
+            Bucket=bucket,
+            Delete={'Objects': [{'Key': key} for key in keys[i:i + 1000]]}
+        )
+
+        if response.get('Errors'):
+            raise RuntimeError(f"Unable to delete {len(response['Errors'])} objects, e.g. {response['Errors'][0]}")
+
+    logger.info(f"Deleted {len(keys)} objects" if keys else "No objects to delete")
+
+
+def delete_s3_prefix_data(bucket:str, s3_prefix:str, s3_client=None):
+
+    logger.info(f'Deleting existing data from {bucket}/{s3_prefix}')
+
+    delete_s3_keys(bucket=bucket, keys=list_s3_keys(bucket=bucket, s3_prefix=s3_prefix, s3_client=s3_client), s3_client=s3_client)
+
+
+# Write an object only if its content changed
+# -----------
+
+# The MD5 of the new body is compared with the stored object's (kept in
+# metadata, falling back to the ETag of a single-part upload). Unchanged
+# objects cost one HEAD and no write, changed ones are replaced by a single
+# PUT - S3 swaps the object in place, so readers never see it missing.
+#
+# Returns True if the object was written, False if it was already current.
+
+def content_md5(body: bytes):
+
+    return hashlib.md5(body).hexdigest()
+
+
+def get_object_md5(bucket: str, key: str, s3_client=None):
+
+    if s3_client is None:
+        s3_client = get_s3_client(REGION)
+
+    try:
+        response = call_with_backoff(s3_client.head_object, Bucket=bucket, Key=key)
+
+    except ClientError as e:
+        if e.response['Error']['Code'] in ['404', 'NoSuchKey', 'NotFound']:
+            return None
+        raise
+
+    return response.get('Metadata', {}).get('content-md5') or response.get('ETag', '').strip('"')
+
+
+def put_object_if_changed(bucket: str, key: str, body: bytes, s3_client=None):
+
+    if s3_client is None:
+        s3_client = get_s3_client(REGION)
+
+    md5 = content_md5(body)
+
+    if get_object_md5(bucket=bucket, key=key, s3_client=s3_client) == md5:
+        logger.info(f'Unchanged, skipping PUT ({key})')
+        return False
+
+    response = call_with_backoff(
+        s3_client.put_object,
+        Bucket=bucket,
+        Key=key,
+        Body=body,
+        ContentMD5=base64.b64encode(bytes.fromhex(md5)).decode('ascii'),
+        Metadata={'content-md5': md5}
+    )
+
+    status = response['ResponseMetadata']['HTTPStatusCode']
+
+    if status != 200:
+        raise RuntimeError(f"Unsuccessful S3 put_object response for PUT ({key}). Status - {status}")
+
+    logger.info(f"Successful S3 put_object response for PUT ({key}). Status - {status}")
+
+    return True
@@ -0,0 +1,166 @@
+from concurrent.futures import ThreadPoolExecutor
+import io
+import os
+from loguru import logger
+import pandas as pd
+import pyarrow as pa
+import pyarrow.parquet as pq
+from common.s3 import _log_s3_error, delete_s3_keys, list_s3_keys, put_object_if_changed
+
+
+# Partitions uploaded at once during a backfill
+WRITE_WORKERS = 10
+
+# Output format of the daily stats: 'csv' or 'parquet'
+OUTPUT_FORMAT = os.environ.get('DAILY_STATS_OUTPUT_FORMAT', 'csv')
+
+# S3 layout & Athena table for each output format
+DAILY_STATS_OUTPUTS = {
+    'csv': {'prefix': 'shopify/daily_stats', 'extension': 'csv', 'table': 'shopify_daily_stats'},
+    'parquet': {'prefix': 'shopify/daily_stats_parquet', 'extension': 'parquet', 'table': 'shopify_daily_stats_parquet'},
+}
+
+# Parquet schema, matches create_table_parquet.sql (partition_date lives in the path)
+DAILY_STATS_SCHEMA = pa.schema([
+    ('order_date', pa.date32()),
+    ('total_product_revenue', pa.float64()),
+    ('total_order_count', pa.int32()),
+    ('total_customer_count', pa.int32()),
+    ('daily_aov', pa.float64()),
+    ('new_customer_count', pa.int32()),
+    ('new_customer_spend', pa.float64()),
+    ('repeat_customer_count', pa.int32()),
+    ('repeat_customer_spend', pa.float64()),
+])
+
+
+def daily_stats_table(output_format: str = OUTPUT_FORMAT):
+
+    return DAILY_STATS_OUTPUTS[output_format]['table']
+
+
+def daily_stats_partition_prefix(order_date: str, output_format: str = OUTPUT_FORMAT):
+
+    return f"{DAILY_STATS_OUTPUTS[output_format]['prefix']}/partition_date={order_date}/"
+
+
+def daily_stats_key(order_date: str, output_format: str = OUTPUT_FORMAT):
+
+    extension = DAILY_STATS_OUTPUTS[output_format]['extension']
+
+    return f"{daily_stats_partition_prefix(order_date, output_format)}shopify_daily_stats_{order_date}.{extension}"
+
+
+# Serialize the stats in the given output format
+# -----------
+
+# Amounts are rounded and counts written as integers first, so the same stats
+# serialize to the same bytes whether pandas or Athena computed them (float
+# sums differ in the last digits depending on summation order). Content
+# hashing relies on this to skip unchanged partitions.
+#
+# Values are snapped to SNAP_DECIMALS first, so last-digit noise can't push
+# an exact tie (e.g. 29.0671875) to different sides of the final rounding.
+
+FLOAT_DECIMALS = 6
+SNAP_DECIMALS = 10
+
+
+def canonicalize_daily_stats(df: pd.DataFrame):
+
+    df = df[DAILY_STATS_SCHEMA.names].copy()
+
+    for field in DAILY_STATS_SCHEMA:
+        if pa.types.is_integer(field.type):
+            df[field.name] = df[field.name].astype('Int32')
+        elif pa.types.is_floating(field.type):
+            df[field.name] = df[field.name].astype(float).round(SNAP_DECIMALS).round(FLOAT_DECIMALS)
+
+    return df
+
+
+def serialize_daily_stats(df: pd.DataFrame, output_format: str = OUTPUT_FORMAT):
+
+    df = canonicalize_daily_stats(df)
+
+    if output_format == 'csv':
+
+        with io.StringIO() as csv_buffer:
+            df.to_csv(csv_buffer, index=False)
+            return csv_buffer.getvalue().encode('utf-8')
+
+    # Cast to the explicit schema so dates stay dates
+    df['order_date'] = pd.to_datetime(df['order_date']).dt.date
+
+    table = pa.Table.from_pandas(df, schema=DAILY_STATS_SCHEMA, preserve_index=False)
+
+    with io.BytesIO() as parquet_buffer:
+        pq.write_table(table, parquet_buffer, compression='snappy')
+        return parquet_buffer.getvalue()
+
+
+# Write one day of stats to its partition
+# -----------
+
+# Skips the PUT when the partition already holds identical content. Any
+# other object in the partition (e.g. files an athena_insert run wrote) is
+# deleted afterwards, or the table would read both.
+# Returns True once the partition holds the stats, False on failure.
+
+def write_daily_stats(s3_client, bucket: str, order_date: str, df: pd.DataFrame, output_format: str = OUTPUT_FORMAT):
+
+    # Log number of rows
+    logger.info(f'{len(df)} rows in daily_stats_df ({order_date})')
+
+    # Configure S3 Prefix
+    S3_PREFIX_PATH = daily_stats_key(order_date, output_format=output_format)
+
+    try:
+        put_object_if_changed(bucket=bucket, key=S3_PREFIX_PATH,
+                              body=serialize_daily_stats(df, output_format=output_format),
+                              s3_client=s3_client)
+
+        stale_keys = [key for key in list_s3_keys(bucket=bucket, s3_prefix=daily_stats_partition_prefix(order_date, output_format),
+                                                  s3_client=s3_client)
+                      if key != S3_PREFIX_PATH]
+
+        if stale_keys:
+            delete_s3_keys(bucket=bucket, keys=stale_keys, s3_client=s3_client)
+
+        return True
+
+    except Exception as e:
+        _log_s3_error(e)
+        return False
+
+
+# Split the stats by day once and upload the partitions concurrently
+# -----------
+
+# order_dates, if given, are written even without stats (an empty partition
+# for a day without orders). Returns the order dates that were written successfully.
+
+def write_daily_stats_partitions(s3_client, bucket: str, daily_stats_df: pd.DataFrame, max_workers: int = WRITE_WORKERS,
+                                 output_format: str = OUTPUT_FORMAT, order_dates: list = None):
+
+    if order_dates is None:
+        partitions = list(daily_stats_df.groupby('order_date', sort=True))
+    else:
+        partitions = [(order_date, daily_stats_df.loc[daily_stats_df['order_date'] == order_date]) for order_date in sorted(order_dates)]
+
+    logger.info(f'Writing {len(partitions)} daily_stats partitions ({output_format}) with {max_workers} workers')
+
+    def write_partition(partition):
+        order_date, df = partition
+        return order_date, write_daily_stats(s3_client=s3_client, bucket=bucket, order_date=order_date, df=df,
+                                             output_format=output_format)
+
+    with ThreadPoolExecutor(max_workers=max_workers) as executor:
+        results = list(executor.map(write_partition, partitions))
+
+    written_dates = [order_date for order_date, written in results if written]
+
+    if len(written_dates) < len(partitions):
+        logger.error(f'{len(partitions) - len(written_dates)} daily_stats partitions failed to write')
+
+    return written_dates
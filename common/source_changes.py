@@ -0,0 +1,98 @@
+import hashlib
+import re
+from loguru import logger
+from common.athena import split_s3_uri
+
+
+# -------------------------------------
+# Source partition fingerprints
+# -------------------------------------
+
+# Each shopify_line_items partition is fingerprinted from its S3 listing
+# (keys, ETags, sizes, last-modified times). Comparing against the manifest
+# from the previous run tells which partitions were rewritten or added since,
+# without reading any of the data.
+
+SOURCE_PARTITION_PATTERN = re.compile(r'/partition_date=([0-9]{4}-[0-9]{2}-[0-9]{2})/')
+
+SOURCE_MANIFEST_KEY = 'shopify/daily_stats_manifests/shopify_line_items_fingerprints.json'
+
+# First order date of every customer as of the fingerprinted partitions
+FIRST_ORDERS_SNAPSHOT_KEY = 'shopify/daily_stats_manifests/shopify_line_items_first_orders.csv'
+
+
+def get_table_location(glue_client, database: str, table: str):
+
+    return glue_client.get_table(DatabaseName=database, Name=table)['Table']['StorageDescriptor']['Location']
+
+
+# Fingerprint every partition under a table location
+# -----------
+
+def fingerprint_source_partitions(s3_client, location: str):
+
+    bucket, prefix = split_s3_uri(location.rstrip('/') + '/')
+
+    objects = {}
+
+    paginator = s3_client.get_paginator('list_objects_v2')
+
+    for page in paginator.paginate(Bucket=bucket, Prefix=prefix):
+        for obj in page.get('Contents', []):
+            match = SOURCE_PARTITION_PATTERN.search('/' + obj['Key'])
+            if match:
+                objects.setdefault(match.group(1), []).append(obj)
+
+    fingerprints = {}
+
+    for partition_date, partition_objects in objects.items():
+
+        digest = hashlib.md5()
+
+        for obj in sorted(partition_objects, key=lambda o: o['Key']):
+            digest.update(f"{obj['Key']}|{obj.get('ETag', '')}|{obj.get('Size', 0)}|{obj.get('LastModified', '')}\n".encode('utf-8'))
+
+        fingerprints[partition_date] = {
+            'fingerprint': digest.hexdigest(),
+            'objects': len(partition_objects),
+            'bytes': sum(obj.get('Size', 0) for obj in partition_objects),
+            'last_modified': max(str(obj.get('LastModified', '')) for obj in partition_objects),
+        }
+
+    logger.info(f'Fingerprinted {len(fingerprints)} source partitions under {location}')
+
+    return fingerprints
+
+
+# Earliest partition under a table location
+# -----------
+
+# S3 lists keys in order, and partition_date=YYYY-MM-DD keys sort by date, so
+# the first matching key is the first day.
+
+def first_source_partition(s3_client, location: str):
+
+    bucket, prefix = split_s3_uri(location.rstrip('/') + '/')
+
+    paginator = s3_client.get_paginator('list_objects_v2')
+
+    for page in paginator.paginate(Bucket=bucket, Prefix=prefix):
+        for obj in page.get('Contents', []):
+            match = SOURCE_PARTITION_PATTERN.search('/' + obj['Key'])
+            if match:
+                return match.group(1)
+
+    return None
+
+
+# Partitions added, rewritten or removed since the previous fingerprints
+# -----------
+
+def changed_partitions(previous: dict, current: dict):
+
+    changed = [d for d, entry in current.items()
+               if d not in previous or previous[d]['fingerprint'] != entry['fingerprint']]
+
+    removed = [d for d in previous if d not in current]
+
+    return sorted(changed + removed)
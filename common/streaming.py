@@ -0,0 +1,230 @@
+from loguru import logger
+import numpy as np
+import pandas as pd
+from common.daily_stats import DAILY_STATS_COLUMNS
+
+
+# ---------------------------------------
+# STREAMING DAILY STATS
+# ---------------------------------------
+
+# Builds the same daily stats as prepare_line_items -> add_customer_features
+# -> compute_daily_stats from a stream of line item chunks, without ever
+# holding all line items at once. Each chunk is reduced into mergeable
+# aggregates:
+#   - revenue and row count per day
+#   - revenue per (day, customer), which also gives each customer's first
+#     order date and the new / repeat split once the stream ends
+#   - distinct (day, order) pairs
+#   - revenue and row count per day of line items without a customer
+# Memory grows with distinct customer-days and orders, not line items.
+
+# Pending partials are merged into the running totals once they outgrow them
+# (and at least this many rows), which keeps merging cost amortised linear.
+MIN_COMPACT_ROWS = 1000000
+
+
+class _MergeableSum:
+
+    """Sums per index key, accumulated from many partial Series/DataFrames."""
+
+    def __init__(self):
+
+        self.total = None
+        self.pending = []
+        self.pending_rows = 0
+
+    def add(self, partial):
+
+        self.pending.append(partial)
+        self.pending_rows += len(partial)
+
+        if self.pending_rows >= max(MIN_COMPACT_ROWS, 0 if self.total is None else len(self.total)):
+            self.compact()
+
+    def compact(self):
+
+        parts = ([self.total] if self.total is not None else []) + self.pending
+
+        if parts:
+            combined = pd.concat(parts)
+            self.total = combined.groupby(level=list(range(combined.index.nlevels)), sort=False).sum()
+
+        self.pending = []
+        self.pending_rows = 0
+
+        return self.total
+
+
+class _MergeableSet:
+
+    """Distinct rows, accumulated from many partial DataFrames."""
+
+    def __init__(self):
+
+        self.total = None
+        self.pending = []
+        self.pending_rows = 0
+
+    def add(self, partial: pd.DataFrame):
+
+        self.pending.append(partial)
+        self.pending_rows += len(partial)
+
+        if self.pending_rows >= max(MIN_COMPACT_ROWS, 0 if self.total is None else len(self.total)):
+            self.compact()
+
+    def compact(self):
+
+        parts = ([self.total] if self.total is not None else []) + self.pending
+
+        if parts:
+            self.total = pd.concat(parts, ignore_index=True).drop_duplicates(ignore_index=True)
+
+        self.pending = []
+        self.pending_rows = 0
+
+        return self.total
+
+
+class StreamingDailyStats:
+
+    """Mergeable per-day aggregates fed one chunk of line items at a time.
+
+    Days are kept as day numbers, customers as codes into a running email
+    dictionary and orders as 64-bit hashes of order_id, so the aggregates
+    hold no strings besides one copy of each customer's email.
+    """
+
+    def __init__(self):
+
+        self.day_totals = _MergeableSum()
+        self.customer_days = _MergeableSum()
+        self.order_days = _MergeableSet()
+        self.anonymous_days = _MergeableSum()
+        self.email_codes = {}
+        self.rows = 0
+
+    def _encode_emails(self, email: pd.Series):
+
+        codes, uniques = pd.factorize(email)
+
+        chunk_codes = np.array([self.email_codes.setdefault(e, len(self.email_codes)) for e in uniques], dtype='int64')
+
+        return np.where(codes >= 0, chunk_codes[codes.clip(min=0)] if len(chunk_codes) else -1, -1)
+
+    # Reduce one chunk of raw line items
+    # -----------
+
+    def add_chunk(self, chunk_df: pd.DataFrame):
+
+        self.rows += len(chunk_df)
+
+        order_date = pd.to_datetime(chunk_df['order_date'])
+
+        if order_date.dt.tz is not None:
+            order_date = order_date.dt.tz_localize(None)
+
+        # Line items without an order date belong to no day
+        dated = order_date.notna().to_numpy()
+
+        day = order_date.dt.normalize().to_numpy(dtype='datetime64[D]')[dated].astype('int64')
+        customer = self._encode_emails(chunk_df['email'].astype('object'))[dated]
+        product_rev = (chunk_df['quantity'].astype(float) * chunk_df['price'].astype(float)).to_numpy()[dated]
+        order_id = chunk_df['order_id'].astype('object').to_numpy()[dated]
+
+        has_email = customer >= 0
+        has_order = ~pd.isna(order_id)
+
+        self.day_totals.add(pd.Series(product_rev, index=day).groupby(level=0).agg(['sum', 'size']))
+
+        # (day, customer) packed into one int64 key
+        customer_day_key = (day[has_email] << 32) | customer[has_email]
+        self.customer_days.add(pd.Series(product_rev[has_email], index=customer_day_key).groupby(level=0).sum())
+
+        self.anonymous_days.add(pd.Series(product_rev[~has_email], index=day[~has_email]).groupby(level=0).agg(['sum', 'size']))
+
+        self.order_days.add(pd.DataFrame({'day': day[has_order],
+                                          'order': pd.util.hash_array(order_id[has_order])}).drop_duplicates())
+
+    def add_chunks(self, chunks):
+
+        for chunk_df in chunks:
+            self.add_chunk(chunk_df)
+
+        logger.info(f'Streamed {self.rows} line items')
+
+        return self
+
+    # Combine the aggregates into daily stats
+    # -----------
+
+    # state_df holds first orders from before the stream (customer state),
+    # days restricts the output to those order dates ('YYYY-MM-DD').
+    # Returns the daily stats and every streamed customer's first order date.
+
+    def finalize(self, state_df: pd.DataFrame = None, days: list = None):
+
+        day_totals = self.day_totals.compact()
+        customer_days = self.customer_days.compact()
+        anonymous_days = self.anonymous_days.compact()
+        order_days = self.order_days.compact()
+
+        if day_totals is None or len(day_totals) == 0:
+            return pd.DataFrame(columns=DAILY_STATS_COLUMNS), pd.DataFrame(columns=['email', 'first_order_date'])
+
+        emails = np.empty(len(self.email_codes), dtype='object')
+        emails[list(self.email_codes.values())] = list(self.email_codes.keys())
+
+        keys = customer_days.index.to_numpy(dtype='int64')
+        customer_days = pd.DataFrame({'day': keys >> 32,
+                                      'customer': keys & 0xFFFFFFFF,
+                                      'product_rev': customer_days.to_numpy()})
+
+        # First order per customer, earlier stored first orders take precedence
+        first_days = customer_days.groupby('customer')['day'].min()
+
+        first_dates = first_days.to_numpy().astype('datetime64[D]').astype('datetime64[ns]')
+
+        if state_df is not None and len(state_df):
+            stored_first_dates = pd.to_datetime(state_df.set_index('email')['first_order_date'])
+            first_dates = np.fmin(first_dates, pd.Series(emails[first_days.index]).map(stored_first_dates).to_numpy(dtype='datetime64[ns]'))
+
+        first_order_df = pd.DataFrame({'email': emails[first_days.index], 'first_order_date': first_dates})
+
+        first_by_customer = pd.Series(first_dates.astype('datetime64[D]').astype('int64'), index=first_days.index)
+
+        customer_days['first_order_fl'] = customer_days['day'].to_numpy() == customer_days['customer'].map(first_by_customer).to_numpy()
+
+        new_custs = customer_days.loc[customer_days['first_order_fl']].groupby('day')['product_rev'].agg(['size', 'sum'])
+        repeat_custs = customer_days.loc[~customer_days['first_order_fl']].groupby('day')['product_rev'].agg(['size', 'sum'])
+
+        index = day_totals.index.sort_values()
+
+        daily_stats_df = pd.DataFrame(index=index)
+        daily_stats_df['total_product_revenue'] = day_totals['sum']
+        daily_stats_df['total_order_count'] = order_days.groupby('day').size().reindex(index, fill_value=0)
+        daily_stats_df['total_customer_count'] = customer_days.groupby('day').size().reindex(index, fill_value=0)
+        daily_stats_df['daily_aov'] = daily_stats_df['total_product_revenue'] / daily_stats_df['total_order_count']
+
+        # Only days with first-order line items get new customer stats
+        daily_stats_df['new_customer_count'] = new_custs['size']
+        daily_stats_df['new_customer_spend'] = new_custs['sum']
+
+        # Line items without a customer count as repeat spend but not as a repeat customer
+        repeat_rows = repeat_custs['size'].reindex(index, fill_value=0) + anonymous_days['size'].reindex(index, fill_value=0)
+        has_repeat = repeat_rows > 0
+
+        daily_stats_df['repeat_customer_count'] = repeat_custs['size'].reindex(index, fill_value=0).where(has_repeat)
+        daily_stats_df['repeat_customer_spend'] = (repeat_custs['sum'].reindex(index, fill_value=0)
+                                                   + anonymous_days['sum'].reindex(index, fill_value=0)).where(has_repeat)
+
+        daily_stats_df = daily_stats_df.reset_index(drop=True)
+        daily_stats_df.insert(0, 'order_date', pd.to_datetime(index.to_numpy().astype('datetime64[D]')).strftime('%Y-%m-%d'))
+
+        if days is not None:
+            daily_stats_df = daily_stats_df.loc[daily_stats_df['order_date'].isin(days)].reset_index(drop=True)
+
+        logger.info(f'{len(daily_stats_df)} days from {len(customer_days)} customer-days and {len(first_order_df)} customers')
+
+        return daily_stats_df, first_order_df
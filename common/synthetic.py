@@ -0,0 +1,157 @@
+from loguru import logger
+import numpy as np
+import pandas as pd
+
+
+# ---------------------------------------
+# SYNTHETIC SHOPIFY LINE ITEMS
+# ---------------------------------------
+
+# Generates shopify_line_items rows shaped like the real table, for local runs
+# and benchmarks:
+#   - every customer places a first order on a uniform day of the span, and
+#     after each order orders again with probability repeat_probability, an
+#     exponential number of days later (orders past the span are dropped)
+#   - each order has 1 + Poisson(line_items_per_order - 1) line items, with
+#     products drawn from a Zipf-like catalog of log-normal prices
+#   - a share of orders are guest checkouts without an email
+# Customers are generated in batches, so any size can be written out without
+# holding it all in memory. The same seed always gives the same rows.
+
+DEFAULT_CUSTOMER_COUNT = 100000
+DEFAULT_REPEAT_PROBABILITY = 0.35
+DEFAULT_DAYS_BETWEEN_ORDERS = 45
+DEFAULT_LINE_ITEMS_PER_ORDER = 2.5
+DEFAULT_GUEST_ORDER_SHARE = 0.02
+DEFAULT_DAYS = 365
+
+PRODUCT_COUNT = 500
+
+# Customers per generated batch, about 1M line items with the defaults
+CUSTOMER_BATCH_SIZE = 250000
+
+# Customers sampled to estimate line items per customer
+PILOT_CUSTOMERS = 20000
+
+
+def _product_catalog(rng: np.random.Generator, product_count: int = PRODUCT_COUNT):
+
+    prices = np.round(rng.lognormal(mean=3.2, sigma=0.5, size=product_count), 2)
+
+    popularity = 1 / np.arange(1, product_count + 1) ** 1.1
+
+    return prices, popularity / popularity.sum()
+
+
+# One batch of customers' line items
+# -----------
+
+def _generate_batch(rng: np.random.Generator, customer_start: int, customer_count: int, order_id_start: int, start_date: pd.Timestamp,
+                    days: int, repeat_probability: float, days_between_orders: float, line_items_per_order: float,
+                    guest_order_share: float, prices: np.ndarray, popularity: np.ndarray):
+
+    # Orders per customer: the first, then another with repeat_probability each time
+    orders_per_customer = rng.geometric(1 - repeat_probability, size=customer_count)
+
+    order_customer = np.repeat(np.arange(customer_count), orders_per_customer)
+
+    # Days since the customer's first order, gaps accumulated per customer
+    gaps = rng.exponential(days_between_orders, size=len(order_customer))
+    customer_starts = np.concatenate([[0], np.cumsum(orders_per_customer)[:-1]])
+    gaps[customer_starts] = 0
+
+    elapsed = np.cumsum(gaps)
+    elapsed -= np.repeat(elapsed[customer_starts], orders_per_customer)
+
+    order_day = rng.integers(0, days, size=customer_count)[order_customer] + elapsed.astype('int64')
+
+    in_span = order_day < days
+    order_customer = order_customer[in_span]
+    order_day = order_day[in_span]
+
+    order_count = len(order_customer)
+
+    order_time = (np.datetime64(start_date.date(), 'D') + order_day.astype('timedelta64[D]')).astype('datetime64[s]') \
+        + rng.integers(0, 86400, size=order_count).astype('timedelta64[s]')
+
+    emails = pd.Series([f'customer{customer_start + i}@example.com' for i in range(customer_count)], dtype='object')
+    order_email = emails.to_numpy()[order_customer]
+    order_email[rng.random(order_count) < guest_order_share] = None
+
+    # Line items
+    items_per_order = 1 + rng.poisson(max(line_items_per_order - 1, 0), size=order_count)
+
+    item_order = np.repeat(np.arange(order_count), items_per_order)
+    product = rng.choice(len(prices), size=len(item_order), p=popularity)
+
+    order_ids = pd.Series(order_id_start + np.arange(order_count)).astype(str).to_numpy()
+
+    line_items_df = pd.DataFrame({
+        'order_date': order_time[item_order].astype('datetime64[ns]'),
+        'email': order_email[item_order],
+        'order_id': order_ids[item_order],
+        'quantity': (1 + rng.poisson(0.3, size=len(item_order))).astype('int32'),
+        'price': prices[product],
+    })
+
+    line_items_df['partition_date'] = line_items_df['order_date'].dt.date
+
+    return line_items_df.sort_values('order_date', kind='stable', ignore_index=True), order_count
+
+
+# Stream line items batch by batch
+# -----------
+
+# end_date defaults to yesterday, so the newest partition is the one the
+# daily transformation reads.
+
+def iter_line_items(customer_count: int = DEFAULT_CUSTOMER_COUNT, days: int = DEFAULT_DAYS, end_date: str = None,
+                    repeat_probability: float = DEFAULT_REPEAT_PROBABILITY, days_between_orders: float = DEFAULT_DAYS_BETWEEN_ORDERS,
+                    line_items_per_order: float = DEFAULT_LINE_ITEMS_PER_ORDER, guest_order_share: float = DEFAULT_GUEST_ORDER_SHARE,
+                    seed: int = 0, batch_size: int = CUSTOMER_BATCH_SIZE):
+
+    rng = np.random.default_rng(seed)
+
+    end_date = pd.Timestamp(end_date) if end_date is not None else pd.Timestamp.today().normalize() - pd.Timedelta(days=1)
+    start_date = end_date - pd.Timedelta(days=days - 1)
+
+    prices, popularity = _product_catalog(rng)
+
+    order_id_start = 5000000000000
+
+    for customer_start in range(0, customer_count, batch_size):
+
+        batch_df, order_count = _generate_batch(rng, customer_start=customer_start,
+                                                customer_count=min(batch_size, customer_count - customer_start),
+                                                order_id_start=order_id_start, start_date=start_date, days=days,
+                                                repeat_probability=repeat_probability, days_between_orders=days_between_orders,
+                                                line_items_per_order=line_items_per_order, guest_order_share=guest_order_share,
+                                                prices=prices, popularity=popularity)
+
+        order_id_start += order_count
+
+        yield batch_df
+
+
+def generate_line_items(customer_count: int = DEFAULT_CUSTOMER_COUNT, **kwargs):
+
+    line_items_df = pd.concat(iter_line_items(customer_count=customer_count, **kwargs), ignore_index=True)
+
+    logger.info(f'Generated {len(line_items_df)} line items for {customer_count} customers')
+
+    return line_items_df
+
+
+# Customer count that gives about row_count line items
+# -----------
+
+# Orders past the span are dropped, so line items per customer depend on
+# every parameter; a small pilot with the same parameters measures it.
+
+def customers_for_rows(row_count: int, **kwargs):
+
+    kwargs.pop('seed', None)
+
+    pilot_df = generate_line_items(customer_count=PILOT_CUSTOMERS, seed=1, **kwargs)
+
+    return max(1, round(row_count * PILOT_CUSTOMERS / len(pilot_df)))
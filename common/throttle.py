@@ -0,0 +1,157 @@
+import os
+import random
+import threading
+import time
+from botocore.exceptions import ClientError
+from loguru import logger
+
+
+# ---------------------------------------
+# THROTTLING
+# ---------------------------------------
+
+# Error codes AWS returns when a caller is going too fast
+THROTTLING_ERROR_CODES = {
+    'TooManyRequestsException',    # Athena: concurrent query / API rate limit
+    'ThrottlingException',
+    'Throttling',
+    'RequestLimitExceeded',
+    'SlowDown',                    # S3: request rate on a prefix
+    'ProvisionedThroughputExceededException',
+}
+
+# Failure reasons of queries Athena rejected for capacity rather than SQL
+THROTTLED_QUERY_REASONS = ('TooManyRequestsException', 'Rate exceeded', 'ThrottlingException')
+
+# Ceiling on queries in flight per workgroup (Athena's default DML quota is 20-25)
+ATHENA_MAX_CONCURRENT = int(os.environ.get('ATHENA_MAX_CONCURRENT', 20))
+
+ATHENA_WORKGROUP = os.environ.get('ATHENA_WORKGROUP', 'primary')
+
+
+def is_throttling_error(e: Exception):
+
+    return isinstance(e, ClientError) and e.response.get('Error', {}).get('Code') in THROTTLING_ERROR_CODES
+
+
+def is_throttled_query(query_execution: dict):
+
+    if query_execution['Status']['State'] != 'FAILED':
+        return False
+
+    reason = query_execution['Status'].get('StateChangeReason', '')
+
+    return any(r in reason for r in THROTTLED_QUERY_REASONS)
+
+
+# Exponential backoff with full jitter
+# -----------
+
+def backoff_delay(attempt: int, base_delay: float = 0.5, max_delay: float = 20.0):
+
+    return random.uniform(0, min(max_delay, base_delay * 2 ** attempt))
+
+
+# ---------------------------------------
+# ADAPTIVE CONCURRENCY LIMITER
+# ---------------------------------------
+
+class AdaptiveConcurrencyLimiter:
+
+    """Caps calls in flight and adapts the cap to what the account allows.
+
+    The limit grows by one for every limit's worth of successful calls and
+    halves on throttling (additive increase, multiplicative decrease), so it
+    settles just under the point where AWS starts pushing back. Thread-safe,
+    one limiter is shared by everything talking to the same workgroup.
+    """
+
+    def __init__(self, initial: int = 4, minimum: int = 1, maximum: int = ATHENA_MAX_CONCURRENT):
+
+        self.minimum = minimum
+        self.maximum = maximum
+        self.limit = float(min(max(initial, minimum), maximum))
+        self.in_flight = 0
+        self._condition = threading.Condition()
+
+    def has_capacity(self):
+
+        with self._condition:
+            return self.in_flight < int(self.limit)
+
+    def acquire(self):
+
+        with self._condition:
+            while self.in_flight >= int(self.limit):
+                self._condition.wait()
+            self.in_flight += 1
+
+    def release(self):
+
+        with self._condition:
+            self.in_flight = max(self.in_flight - 1, 0)
+            self._condition.notify_all()
+
+    def on_success(self):
+
+        with self._condition:
+            previous = int(self.limit)
+            self.limit = min(self.limit + 1 / self.limit, self.maximum)
+
+            if int(self.limit) > previous:
+                self._condition.notify_all()
+
+    def on_throttle(self):
+
+        with self._condition:
+            self.limit = max(self.limit / 2, self.minimum)
+
+        logger.warning(f'Throttled, concurrency limit lowered to {int(self.limit)}')
+
+
+_limiters = {}
+_limiters_lock = threading.Lock()
+
+
+def get_workgroup_limiter(workgroup: str = ATHENA_WORKGROUP, maximum: int = ATHENA_MAX_CONCURRENT):
+
+    with _limiters_lock:
+        if workgroup not in _limiters:
+            _limiters[workgroup] = AdaptiveConcurrencyLimiter(maximum=maximum)
+
+        return _limiters[workgroup]
+
+
+# Call an AWS API, backing off and retrying while it is throttled
+# -----------
+
+# Anything other than throttling is raised straight away, and so is the last
+# throttling error once max_attempts is used up, so callers never mistake a
+# throttled call for an empty result.
+
+def call_with_backoff(fn, *args, max_attempts: int = 8, base_delay: float = 0.5, max_delay: float = 20.0,
+                      limiter: AdaptiveConcurrencyLimiter = None, **kwargs):
+
+    for attempt in range(max_attempts):
+
+        try:
+            result = fn(*args, **kwargs)
+
+        except ClientError as e:
+            if not is_throttling_error(e) or attempt == max_attempts - 1:
+                raise
+
+            if limiter is not None:
+                limiter.on_throttle()
+
+            delay = backoff_delay(attempt, base_delay=base_delay, max_delay=max_delay)
+
+            logger.warning(f"{e.response['Error']['Code']} on attempt {attempt + 1}, retrying in {delay:.2f}s")
+
+            time.sleep(delay)
+            continue
+
+        if limiter is not None:
+            limiter.on_success()
+
+        return result
@@ -0,0 +1,124 @@
+from concurrent.futures import ThreadPoolExecutor
+import glob
+import io
+import os
+import uuid
+from loguru import logger
+import pandas as pd
+import pyarrow as pa
+import pyarrow.parquet as pq
+
+
+# Parquet files are read this many at a time
+PARQUET_READ_WORKERS = 8
+
+
+# ---------------------------------------
+# UNLOAD QUERY
+# ---------------------------------------
+
+# Wrap a SELECT in an UNLOAD to a fresh prefix under output_location
+# -----------
+
+def build_unload_query(query: str, output_location: str):
+
+    unload_location = f"{output_location.rstrip('/')}/unload/{uuid.uuid4()}/"
+
+    unload_query = f"""UNLOAD ({query.strip().rstrip(';')})
+                       TO '{unload_location}'
+                       WITH (format = 'PARQUET', compression = 'SNAPPY')
+                    """
+
+    return unload_query, unload_location
+
+
+# ---------------------------------------
+# PARALLEL PARQUET READERS
+# ---------------------------------------
+
+# Athena decimals arrive as decimal128, convert them to float64 like the CSV path
+# -----------
+
+def _decimals_to_float(table: pa.Table):
+
+    for i, field in enumerate(table.schema):
+        if pa.types.is_decimal(field.type):
+            table = table.set_column(i, field.name, table.column(i).cast(pa.float64()))
+
+    return table
+
+
+def _read_parquet_files(read_file, paths: list, max_workers: int):
+
+    if not paths:
+        return pd.DataFrame()
+
+    with ThreadPoolExecutor(max_workers=max_workers) as executor:
+        tables = list(executor.map(read_file, paths))
+
+    table = _decimals_to_float(pa.concat_tables(tables, promote_options='default'))
+
+    logger.info(f'Read {table.num_rows} rows from {len(paths)} parquet files')
+
+    return table.to_pandas()
+
+
+# Read every parquet file under an S3 prefix
+# -----------
+
+def list_s3_parquet_objects(s3_client, bucket: str, prefix: str):
+
+    objects = []
+
+    paginator = s3_client.get_paginator('list_objects_v2')
+
+    for page in paginator.paginate(Bucket=bucket, Prefix=prefix):
+        objects.extend([obj for obj in page.get('Contents', []) if obj['Size'] > 0])
+
+    return objects
+
+
+def read_s3_parquet_prefix(s3_client, bucket: str, prefix: str, max_workers: int = PARQUET_READ_WORKERS):
+
+    keys = [obj['Key'] for obj in list_s3_parquet_objects(s3_client=s3_client, bucket=bucket, prefix=prefix)]
+
+    logger.info(f'Reading {len(keys)} parquet files from {bucket}/{prefix}')
+
+    def read_file(key):
+        response = s3_client.get_object(Bucket=bucket, Key=key)
+        return pq.read_table(io.BytesIO(response['Body'].read()))
+
+    return _read_parquet_files(read_file, keys, max_workers)
+
+
+# Stream the parquet files under an S3 prefix back in chunks
+# -----------
+
+# One file is held at a time, handed out chunksize rows at a time
+
+def iter_s3_parquet_prefix_chunks(s3_client, bucket: str, prefix: str, chunksize: int):
+
+    keys = [obj['Key'] for obj in list_s3_parquet_objects(s3_client=s3_client, bucket=bucket, prefix=prefix)]
+
+    logger.info(f'Streaming {len(keys)} parquet files from {bucket}/{prefix}')
+
+    for key in keys:
+
+        response = s3_client.get_object(Bucket=bucket, Key=key)
+
+        parquet_file = pq.ParquetFile(io.BytesIO(response['Body'].read()))
+
+        for batch in parquet_file.iter_batches(batch_size=chunksize):
+            yield _decimals_to_float(pa.Table.from_batches([batch])).to_pandas()
+
+
+# Local directory stand-in for read_s3_parquet_prefix
+# -----------
+
+def read_local_parquet_dir(path: str, max_workers: int = PARQUET_READ_WORKERS):
+
+    paths = sorted(p for p in glob.glob(os.path.join(path, '**', '*'), recursive=True) if os.path.isfile(p))
+
+    logger.info(f'Reading {len(paths)} parquet files from {path}')
+
+    return _read_parquet_files(pq.read_table, paths, max_workers)
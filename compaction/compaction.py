@@ -0,0 +1,100 @@
+from loguru import logger
+import os
+import sys
+
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from common.athena import run_athena_query_no_results
+from common.aws import get_s3_client
+from common.compaction import (COMPACTION_MANIFEST_KEY, MONTHLY_PREFIX, MONTHLY_TABLE, build_compacted_view_query,
+                               closed_months, compact_months, compaction_watermark, list_partition_objects,
+                               list_partition_values, month_fingerprints)
+from common.manifests import S3ManifestStore
+from common.sinks import DAILY_STATS_OUTPUTS, OUTPUT_FORMAT, daily_stats_table
+
+
+# ========================================================================
+# Compact closed months of shopify_daily_stats into monthly Parquet files
+# ========================================================================
+
+DATABASE = 'prymal-analytics'
+REGION = 'us-east-1'
+BUCKET = os.environ['S3_PRYMAL_ANALYTICS']
+
+# Comma separated months (YYYY-MM) to compact again, e.g. after a day was restated.
+# By default closed months without a monthly file, or whose daily files changed
+# since they were compacted, are compacted.
+COMPACT_MONTHS = [m for m in os.environ.get('COMPACT_MONTHS', '').split(',') if m]
+
+DAILY_TABLE = daily_stats_table()
+DAILY_PREFIX = DAILY_STATS_OUTPUTS[OUTPUT_FORMAT]['prefix']
+
+s3_client = get_s3_client(REGION)
+
+
+# Find the months to compact
+# -----------
+
+daily_objects = list_partition_objects(s3_client=s3_client, bucket=BUCKET, prefix=DAILY_PREFIX, partition_key='partition_date')
+compacted_months = list_partition_values(s3_client=s3_client, bucket=BUCKET, prefix=MONTHLY_PREFIX, partition_key='partition_month')
+
+daily_months = closed_months(list(daily_objects))
+
+# Taken before the months are queried, so a day changing mid-run is picked up next run
+fingerprints = month_fingerprints(daily_objects)
+
+manifest_store = S3ManifestStore(bucket=BUCKET, key=COMPACTION_MANIFEST_KEY, s3_client=s3_client)
+compacted_fingerprints = manifest_store.load() if manifest_store.exists() else {}
+
+# Monthly files older than a restated day (or compacted before fingerprints were kept)
+changed_months = [month for month in daily_months
+                  if month in compacted_months and compacted_fingerprints.get(month) != fingerprints[month]]
+
+months_to_compact = sorted(set(COMPACT_MONTHS) | (set(daily_months) - set(compacted_months)) | set(changed_months))
+
+logger.info(f'{len(daily_months)} closed months in {DAILY_TABLE}, {len(compacted_months)} already compacted '
+            f'({len(changed_months)} changed since), compacting {len(months_to_compact)}')
+
+
+# Roll each month into one file
+# -----------
+
+written_months, failed_months = compact_months(s3_client=s3_client, bucket=BUCKET, months=months_to_compact,
+                                               fingerprints=fingerprints, manifest_store=manifest_store,
+                                               daily_table=DAILY_TABLE, database=DATABASE, region=REGION)
+
+
+# Swap the view over to the new watermark
+# -----------
+
+# The monthly files are written and registered before the view moves, so
+# readers see each month exactly once throughout. Only months whose monthly
+# file matches their daily files are served from it - a changed month that
+# failed to compact again stays in the daily table until it succeeds.
+
+current_months = ({month for month in compacted_months if compacted_fingerprints.get(month) == fingerprints.get(month)}
+                  | set(written_months)) - set(failed_months)
+
+watermark = compaction_watermark(daily_months=daily_months, compacted_months=current_months)
+
+view_failed = False
+
+if watermark is None:
+    logger.info('No closed months yet, leaving the view as is')
+
+else:
+    logger.info(f'Serving months before {watermark} from {MONTHLY_TABLE}')
+
+    try:
+        run_athena_query_no_results(query=build_compacted_view_query(watermark=watermark, daily_table=DAILY_TABLE),
+                                    database=DATABASE)
+    except Exception as e:
+        logger.error(f'Unable to move the view to {watermark}: {e}')
+        view_failed = True
+
+
+# Fail the run so the months and the view are retried
+if failed_months:
+    logger.error(f'{len(failed_months)} months were not compacted: {failed_months}')
+
+if failed_months or view_failed:
+    sys.exit(1)
@@ -1,13 +1,19 @@
 
-import boto3
 from botocore.exceptions import BotoCoreError, ClientError, NoCredentialsError, PartialCredentialsError, ParamValidationError, WaiterError
 import pandas as pd
 import os
 import loguru
 from loguru import logger
 import io
+import string
+import sys
 import time
 
+sys.path.append(os.path.dirname(os.path.dirname(os.path.dirname(os.path.abspath(__file__)))))
+from common.aws import get_glue_client, get_s3_client
+from common.athena import execute_athena_query
+from common.source_changes import first_source_partition, get_table_location
+
 
 # -------------------------------------
 # Variables
@@ -18,8 +24,38 @@ DATABASE = 'prymal-analytics'
 CRAWLER_NAME = 'shopify_daily_stats'
 
 
+# Partition projection: Athena computes partitions from partition_date
+# instead of reading them from the Glue catalog, so new days need no registration
+PARTITION_PROJECTION = os.environ.get('PARTITION_PROJECTION', 'false').lower() == 'true'
+
 # Transformation SQL Query as code (path)
-QUERY_PATH = 'create_table/shopify_daily_stats/create_table.sql'
+if PARTITION_PROJECTION:
+    QUERY_PATH = 'create_table/shopify_daily_stats/create_table_projection.sql'
+else:
+    QUERY_PATH = 'create_table/shopify_daily_stats/create_table.sql'
+
+# Turns projection on for a table created without it
+ENABLE_PROJECTION_QUERY_PATH = 'create_table/shopify_daily_stats/enable_partition_projection.sql'
+
+# First day of the projected range: PROJECTION_RANGE_START, else the first
+# shopify_line_items partition (days before it have no stats)
+PROJECTION_RANGE_START = os.environ.get('PROJECTION_RANGE_START')
+SOURCE_DATABASE = 'prymal'
+SOURCE_TABLE = 'shopify_line_items'
+DEFAULT_PROJECTION_RANGE_START = '2020-01-01'
+
+# Parquet copy of the table, written when DAILY_STATS_OUTPUT_FORMAT=parquet
+OUTPUT_FORMAT = os.environ.get('DAILY_STATS_OUTPUT_FORMAT', 'csv')
+
+if PARTITION_PROJECTION:
+    PARQUET_QUERY_PATH = 'create_table/shopify_daily_stats/create_table_parquet_projection.sql'
+else:
+    PARQUET_QUERY_PATH = 'create_table/shopify_daily_stats/create_table_parquet.sql'
+
+ENABLE_PARQUET_PROJECTION_QUERY_PATH = 'create_table/shopify_daily_stats/enable_partition_projection_parquet.sql'
+
+# Monthly files written by compaction/compaction.py
+MONTHLY_QUERY_PATH = 'create_table/shopify_daily_stats/create_table_monthly.sql'
 
 # AWS Credentials
 AWS_ACCESS_KEY_ID=os.environ['AWS_ACCESS_KEY']
@@ -40,10 +76,7 @@ def check_path_for_objects(bucket: str, s3_prefix:str):
     try:
 
         # Create s3 client
-        s3_client = boto3.client('s3', 
-                                region_name = REGION,
-                                aws_access_key_id=AWS_ACCESS_KEY_ID,
-                                aws_secret_access_key=AWS_SECRET_ACCESS_KEY)
+        s3_client = get_s3_client(REGION)
 
         # List objects in s3_prefix
         result = s3_client.list_objects_v2(Bucket=bucket, Prefix=s3_prefix )
@@ -93,10 +126,7 @@ def delete_s3_prefix_data(bucket:str, s3_prefix:str):
     logger.info(f'Deleting existing data from {bucket}/{s3_prefix}')
 
     # Create an S3 client
-    s3_client = boto3.client('s3', 
-                            region_name = REGION,
-                            aws_access_key_id=AWS_ACCESS_KEY_ID,
-                            aws_secret_access_key=AWS_SECRET_ACCESS_KEY)
+    s3_client = get_s3_client(REGION)
 
     try:
                                                                                 
@@ -153,10 +183,7 @@ def run_glue_crawler(crawler_name:str):
     logger.info(f'Running glue crawler: {crawler_name}')
 
     # Create an AWS Glue client
-    glue_client = boto3.client('glue', 
-                          region_name = REGION,
-                          aws_access_key_id=AWS_ACCESS_KEY_ID,
-                          aws_secret_access_key=AWS_SECRET_ACCESS_KEY)
+    glue_client = get_glue_client(REGION)
 
     try:
         # Trigger the Crawler run using the 'start_crawler' method
@@ -217,90 +244,91 @@ def read_query_to_string(path: str):
     # Return query as string
     return query_str
 
+# First day of the projected partition range
+# -----------
 
-def run_athena_query(query:str, database: str):
+def get_projection_range_start():
 
-        
-    # Initialize Athena client
-    athena_client = boto3.client('athena', 
-                                 region_name='us-east-1',
-                                 aws_access_key_id=AWS_ACCESS_KEY_ID,
-                                 aws_secret_access_key=AWS_SECRET_ACCESS_KEY)
+    if PROJECTION_RANGE_START:
+        return PROJECTION_RANGE_START
 
-    # Execute the query
-    try:
-        response = athena_client.start_query_execution(
-            QueryString=query,
-            QueryExecutionContext={
-                'Database': database
-            },
-            ResultConfiguration={
-                'OutputLocation': 's3://prymal-ops/athena_query_results/'  # Specify your S3 bucket for query results
-            }
-        )
-
-        query_execution_id = response['QueryExecutionId']
-
-        # Wait for the query to complete
-        state = 'RUNNING'
-
-        while (state in ['RUNNING', 'QUEUED']):
-            response = athena_client.get_query_execution(QueryExecutionId = query_execution_id)
-            logger.info(f'Query is in {state} state..')
-            if 'QueryExecution' in response and 'Status' in response['QueryExecution'] and 'State' in response['QueryExecution']['Status']:
-                # Get currentstate
-                state = response['QueryExecution']['Status']['State']
-
-                if state == 'FAILED':
-                    logger.error('Query Failed!')
-                elif state == 'SUCCEEDED':
-                    logger.info('Query Succeeded!')
-
-                    
-    except ParamValidationError as e:
-        logger.error(f"Validation Error (potential SQL query issue): {e}")
-        # Handle invalid parameters in the request, such as an invalid SQL query
-
-    except WaiterError as e:
-        logger.error(f"Waiter Error: {e}")
-        # Handle errors related to waiting for query execution
+    source_location = get_table_location(get_glue_client(REGION), database=SOURCE_DATABASE, table=SOURCE_TABLE)
 
-    except ClientError as e:
-        error_code = e.response['Error']['Code']
-        error_message = e.response['Error']['Message']
-        
-        if error_code == 'InvalidRequestException':
-            logger.error(f"Invalid Request Exception: {error_message}")
-            # Handle issues with the Athena request, such as invalid SQL syntax
-            
-        elif error_code == 'ResourceNotFoundException':
-            logger.error(f"Resource Not Found Exception: {error_message}")
-            # Handle cases where the database or query execution does not exist
-            
-        elif error_code == 'AccessDeniedException':
-            logger.error(f"Access Denied Exception: {error_message}")
-            # Handle cases where the IAM role does not have sufficient permissions
-            
-        else:
-            logger.error(f"Athena Error: {error_code} - {error_message}")
-            # Handle other Athena-related errors
+    range_start = first_source_partition(s3_client=get_s3_client(REGION), location=source_location)
 
-    except Exception as e:
-        logger.error(f"Other Exception: {str(e)}")
-        # Handle any other unexpected exceptions
+    if range_start is None:
+        logger.warning(f'No partitions under {source_location}, projecting from {DEFAULT_PROJECTION_RANGE_START}')
+        return DEFAULT_PROJECTION_RANGE_START
+
+    return range_start
+
+# Fill the projection range start into a query (other ${...} are left for Athena)
+# -----------
+
+def read_projection_query(path: str, range_start: str):
+
+    return string.Template(read_query_to_string(path=path)).safe_substitute(projection_range_start=range_start)
 
 
 # ============================================================================
 # EXECUTE CODE
 # ============================================================================
 
+# Each statement runs through the shared executor (polling with backoff) and
+# raises if it does not succeed, failing the job instead of carrying on
+
+if PARTITION_PROJECTION:
+    PROJECTION_RANGE = get_projection_range_start()
+    logger.info(f'Projecting partitions from {PROJECTION_RANGE}')
+
 # Read sql from .sql to string
-QUERY_STR = read_query_to_string(path=QUERY_PATH)
+if PARTITION_PROJECTION:
+    QUERY_STR = read_projection_query(path=QUERY_PATH, range_start=PROJECTION_RANGE)
+else:
+    QUERY_STR = read_query_to_string(path=QUERY_PATH)
 
 # Log Athena query 
 logger.info(QUERY_STR)
 
 # Run Athena query
-response = run_athena_query(query=QUERY_STR, database=DATABASE)
+query_execution = execute_athena_query(query=QUERY_STR, database=DATABASE, region=REGION)
+
+
+# Enable projection on an existing table (CREATE ... IF NOT EXISTS leaves it as is)
+if PARTITION_PROJECTION:
+
+    QUERY_STR = read_projection_query(path=ENABLE_PROJECTION_QUERY_PATH, range_start=PROJECTION_RANGE)
+
+    logger.info(QUERY_STR)
+
+    query_execution = execute_athena_query(query=QUERY_STR, database=DATABASE, region=REGION)
+
+
+# Create the Parquet table alongside the CSV one
+if OUTPUT_FORMAT == 'parquet':
+
+    if PARTITION_PROJECTION:
+        QUERY_STR = read_projection_query(path=PARQUET_QUERY_PATH, range_start=PROJECTION_RANGE)
+    else:
+        QUERY_STR = read_query_to_string(path=PARQUET_QUERY_PATH)
+
+    logger.info(QUERY_STR)
+
+    query_execution = execute_athena_query(query=QUERY_STR, database=DATABASE, region=REGION)
+
+    # Same projection as the CSV table, also on an existing Parquet table
+    if PARTITION_PROJECTION:
+
+        QUERY_STR = read_projection_query(path=ENABLE_PARQUET_PROJECTION_QUERY_PATH, range_start=PROJECTION_RANGE)
+
+        logger.info(QUERY_STR)
+
+        query_execution = execute_athena_query(query=QUERY_STR, database=DATABASE, region=REGION)
+
+
+# Companion table for compacted months
+QUERY_STR = read_query_to_string(path=MONTHLY_QUERY_PATH)
+
+logger.info(QUERY_STR)
 
-logger.info(response)
\ No newline at end of file
+query_execution = execute_athena_query(query=QUERY_STR, database=DATABASE, region=REGION)
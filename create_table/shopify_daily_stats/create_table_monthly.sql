@@ -0,0 +1,18 @@
+CREATE EXTERNAL TABLE IF NOT EXISTS shopify_daily_stats_monthly(
+order_date DATE
+, total_product_revenue DOUBLE
+, total_order_count INT
+, total_customer_count INT
+, daily_aov DOUBLE
+, new_customer_count INT
+, new_customer_spend DOUBLE
+, repeat_customer_count INT
+, repeat_customer_spend DOUBLE
+)
+PARTITIONED BY 
+(
+partition_month STRING 
+)
+STORED AS PARQUET
+LOCATION 's3://prymal-analytics/shopify/daily_stats_monthly/' 
+TBLPROPERTIES ("parquet.compression"="SNAPPY")
@@ -0,0 +1,27 @@
+CREATE EXTERNAL TABLE IF NOT EXISTS shopify_daily_stats_parquet(
+order_date DATE
+, total_product_revenue DOUBLE
+, total_order_count INT
+, total_customer_count INT
+, daily_aov DOUBLE
+, new_customer_count INT
+, new_customer_spend DOUBLE
+, repeat_customer_count INT
+, repeat_customer_spend DOUBLE
+)
+PARTITIONED BY 
+(
+partition_date DATE 
+)
+STORED AS PARQUET
+LOCATION 's3://prymal-analytics/shopify/daily_stats_parquet/' 
+TBLPROPERTIES (
+"parquet.compression"="SNAPPY"
+, "projection.enabled"="true"
+, "projection.partition_date.type"="date"
+, "projection.partition_date.format"="yyyy-MM-dd"
+, "projection.partition_date.range"="${projection_range_start},NOW"
+, "projection.partition_date.interval"="1"
+, "projection.partition_date.interval.unit"="DAYS"
+, "storage.location.template"="s3://prymal-analytics/shopify/daily_stats_parquet/partition_date=${partition_date}/"
+)
\ No newline at end of file
@@ -0,0 +1,9 @@
+ALTER TABLE shopify_daily_stats_parquet SET TBLPROPERTIES (
+"projection.enabled"="true"
+, "projection.partition_date.type"="date"
+, "projection.partition_date.format"="yyyy-MM-dd"
+, "projection.partition_date.range"="${projection_range_start},NOW"
+, "projection.partition_date.interval"="1"
+, "projection.partition_date.interval.unit"="DAYS"
+, "storage.location.template"="s3://prymal-analytics/shopify/daily_stats_parquet/partition_date=${partition_date}/"
+)
\ No newline at end of file
@@ -0,0 +1,72 @@
+import os
+import runpy
+import sys
+import pytest
+
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+import common.aws
+import common.local_backend
+from common.local_backend import LocalCatalog
+from common.synthetic import generate_line_items
+
+
+# ---------------------------------------
+# SHARED FIXTURES
+# ---------------------------------------
+
+REPO_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+BUCKET = 'prymal-analytics'
+
+# A month of synthetic line items ending on LAST_DAY
+LAST_DAY = '2026-01-31'
+
+
+@pytest.fixture(scope='session')
+def line_items_df():
+
+    return generate_line_items(customer_count=2000, days=31, end_date=LAST_DAY, seed=0)
+
+
+# The local backend (PIPELINE_BACKEND=local) over a temporary directory,
+# with line_items_df as shopify_line_items
+@pytest.fixture
+def local_backend(tmp_path, monkeypatch, line_items_df):
+
+    line_items_dir = str(tmp_path / 'shopify_line_items')
+
+    for partition_date, day_df in line_items_df.groupby('partition_date'):
+        os.makedirs(os.path.join(line_items_dir, f'partition_date={partition_date}'))
+        day_df.drop(columns='partition_date').to_parquet(os.path.join(line_items_dir, f'partition_date={partition_date}', 'part-0.parquet'),
+                                                          index=False)
+
+    monkeypatch.setattr(common.local_backend, 'LOCAL_DATA_DIR', str(tmp_path))
+    monkeypatch.setattr(common.local_backend, 'LOCAL_LINE_ITEMS_DIR', line_items_dir)
+    monkeypatch.setattr(common.local_backend, '_catalog', LocalCatalog(path=str(tmp_path / 'catalog.json')))
+    monkeypatch.setattr(common.aws, 'PIPELINE_BACKEND', 'local')
+    monkeypatch.setattr(common.aws, '_clients', {})
+
+    return tmp_path
+
+
+# Runs a pipeline script (path from the repo root) in this process against
+# the local backend and returns its exit code
+@pytest.fixture
+def run_script(local_backend, monkeypatch):
+
+    monkeypatch.setenv('AWS_ACCESS_KEY', 'local')
+    monkeypatch.setenv('AWS_ACCESS_SECRET', 'local')
+    monkeypatch.setenv('S3_PRYMAL_ANALYTICS', BUCKET)
+
+    def run(script: str, *args):
+
+        monkeypatch.setattr(sys, 'argv', [script, *args])
+
+        try:
+            runpy.run_path(os.path.join(REPO_DIR, script), run_name='__main__')
+        except SystemExit as e:
+            return e.code or 0
+
+        return 0
+
+    return run
@@ -0,0 +1,54 @@
+import pandas as pd
+import pytest
+from common.athena import AthenaQueryResult, run_athena_queries_no_results, run_athena_query_no_results
+from common.engines import PandasEngine
+from common.queries import LINE_ITEM_COLUMNS, build_line_items_query
+
+
+# ---------------------------------------
+# ATHENA QUERIES WITHOUT RESULTS
+# ---------------------------------------
+
+DATABASE = 'prymal-analytics'
+
+FAILING_QUERY = 'SELECT * FROM no_such_table'
+
+
+def test_failed_query_raises(local_backend):
+
+    with pytest.raises(RuntimeError, match='FAILED'):
+        run_athena_query_no_results(query=FAILING_QUERY, database=DATABASE)
+
+
+def test_queries_return_every_final_state(local_backend):
+
+    query_executions = run_athena_queries_no_results(queries=['SELECT 1', FAILING_QUERY], database=DATABASE)
+
+    assert [query_execution['Status']['State'] for query_execution in query_executions] == ['SUCCEEDED', 'FAILED']
+
+
+# ---------------------------------------
+# UNLOAD RESULTS WITHOUT ROWS
+# ---------------------------------------
+
+# An UNLOAD of a day without orders writes no files
+
+EMPTY_DAY = '2025-12-31'
+
+
+def test_empty_unload_keeps_the_query_columns(local_backend):
+
+    result = AthenaQueryResult(query=build_line_items_query(start_date=EMPTY_DAY, end_date=EMPTY_DAY), database=DATABASE,
+                               region='us-east-1', fetch_mode='unload')
+
+    line_items_df = result.read()
+
+    assert line_items_df.empty
+    assert list(line_items_df.columns) == LINE_ITEM_COLUMNS
+    assert pd.api.types.is_numeric_dtype(line_items_df['quantity'])
+    assert pd.api.types.is_numeric_dtype(line_items_df['price'])
+
+    daily_stats_df, first_order_df = PandasEngine(max_workers=1).compute(line_items_df, days=[EMPTY_DAY])
+
+    assert daily_stats_df.empty
+    assert first_order_df.empty
@@ -0,0 +1,114 @@
+import pandas as pd
+import pytest
+import common.sinks
+from common.athena import run_athena_query
+from common.aws import get_s3_client
+from common.checkpoints import parse_shard, shard_dates
+from common.customer_state import CUSTOMER_STATE_KEY, S3CustomerStateStore
+from common.engines import PandasEngine
+from common.queries import LINE_ITEM_COLUMNS
+from common.sinks import canonicalize_daily_stats
+from conftest import BUCKET, LAST_DAY
+
+
+# ---------------------------------------
+# SHARDED & RESUMABLE BACKFILL
+# ---------------------------------------
+
+# backfill/backfill.py over the month of fixtures, split into shards and
+# chunks, compared with one computation over the whole month.
+
+DATABASE = 'prymal'
+REGION = 'us-east-1'
+
+FIRST_DAY = '2026-01-01'
+
+FAILED_DAY = '2026-01-12'
+
+
+def _canonical(df: pd.DataFrame):
+
+    df = canonicalize_daily_stats(df)
+    df['order_date'] = pd.to_datetime(df['order_date']).dt.strftime('%Y-%m-%d')
+
+    return df.sort_values('order_date', ignore_index=True)
+
+
+def _assert_backfilled(line_items_df: pd.DataFrame):
+
+    daily_stats_df = run_athena_query(query='SELECT * FROM shopify_daily_stats', database=DATABASE, region=REGION)
+
+    expected_df, _ = PandasEngine(max_workers=1).compute(line_items_df[LINE_ITEM_COLUMNS])
+
+    pd.testing.assert_frame_equal(_canonical(daily_stats_df), _canonical(expected_df))
+
+
+@pytest.fixture
+def written_dates(monkeypatch):
+
+    written = []
+
+    write_daily_stats_partitions = common.sinks.write_daily_stats_partitions
+
+    def recording_write_daily_stats_partitions(**kwargs):
+        dates = write_daily_stats_partitions(**kwargs)
+        written.extend(dates)
+        return dates
+
+    monkeypatch.setattr(common.sinks, 'write_daily_stats_partitions', recording_write_daily_stats_partitions)
+
+    return written
+
+
+def test_shards_split_the_range_into_contiguous_blocks():
+
+    shards = [shard_dates(FIRST_DAY, LAST_DAY, shard_index=i, shard_count=3) for i in range(3)]
+
+    assert sum(shards, []) == pd.date_range(FIRST_DAY, LAST_DAY, freq='D').strftime('%Y-%m-%d').tolist()
+    assert [len(shard) for shard in shards] == [11, 10, 10]
+
+    with pytest.raises(ValueError):
+        parse_shard('3/3')
+
+
+def test_sharded_backfill_matches_a_single_run(run_script, line_items_df):
+
+    state_store = S3CustomerStateStore(bucket=BUCKET, key=CUSTOMER_STATE_KEY, s3_client=get_s3_client(REGION))
+
+    for shard in ['0/3', '1/3', '2/3']:
+
+        assert run_script('backfill/backfill.py', '--start', FIRST_DAY, '--end', LAST_DAY, '--shard', shard, '--chunk-days', '4') == 0
+
+        # Only the last shard reseeds the customer state
+        assert state_store.exists() == (shard == '2/3')
+
+    _assert_backfilled(line_items_df)
+    assert state_store.load_state_through() == LAST_DAY
+
+
+def test_rerun_resumes_from_the_checkpoint(run_script, line_items_df, written_dates, monkeypatch):
+
+    write_daily_stats_partitions = common.sinks.write_daily_stats_partitions
+
+    def failing_write_daily_stats_partitions(**kwargs):
+        return [d for d in write_daily_stats_partitions(**kwargs) if d != FAILED_DAY]
+
+    monkeypatch.setattr(common.sinks, 'write_daily_stats_partitions', failing_write_daily_stats_partitions)
+
+    assert run_script('backfill/backfill.py', '--start', FIRST_DAY, '--end', LAST_DAY, '--chunk-days', '7') == 1
+
+    # Only the failed day is computed & written again
+    monkeypatch.setattr(common.sinks, 'write_daily_stats_partitions', write_daily_stats_partitions)
+    written_dates.clear()
+
+    assert run_script('backfill/backfill.py', '--start', FIRST_DAY, '--end', LAST_DAY, '--chunk-days', '7') == 0
+
+    assert written_dates == [FAILED_DAY]
+    _assert_backfilled(line_items_df)
+
+    # --restart redoes every day
+    written_dates.clear()
+
+    assert run_script('backfill/backfill.py', '--start', FIRST_DAY, '--end', LAST_DAY, '--chunk-days', '7', '--restart') == 0
+
+    assert sorted(written_dates) == pd.date_range(FIRST_DAY, LAST_DAY, freq='D').strftime('%Y-%m-%d').tolist()
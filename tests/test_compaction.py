@@ -0,0 +1,88 @@
+import pandas as pd
+import common.compaction
+from common.athena import run_athena_query
+from common.aws import get_s3_client
+from common.compaction import COMPACTED_VIEW, MONTHLY_PREFIX
+from common.engines import PandasEngine
+from common.partitions import register_partitions
+from common.queries import LINE_ITEM_COLUMNS
+from common.s3 import list_s3_keys
+from common.sinks import canonicalize_daily_stats, daily_stats_table, write_daily_stats_partitions
+from conftest import BUCKET
+
+
+# ---------------------------------------
+# MONTHLY COMPACTION
+# ---------------------------------------
+
+# compaction/compaction.py over a month of daily partitions (January 2026,
+# a closed month), read back through the compacted view.
+
+DATABASE = 'prymal-analytics'
+REGION = 'us-east-1'
+
+RESTATED_DAY = '2026-01-10'
+
+
+def _write_daily_stats(daily_stats_df: pd.DataFrame):
+
+    written_dates = write_daily_stats_partitions(s3_client=get_s3_client(REGION), bucket=BUCKET, daily_stats_df=daily_stats_df)
+
+    assert register_partitions(partition_dates=written_dates, table=daily_stats_table()) == []
+
+
+def _canonical(df: pd.DataFrame):
+
+    df = canonicalize_daily_stats(df)
+    df['order_date'] = pd.to_datetime(df['order_date']).dt.strftime('%Y-%m-%d')
+
+    return df.sort_values('order_date', ignore_index=True)
+
+
+def _view_stats():
+
+    return _canonical(run_athena_query(query=f'SELECT * FROM {COMPACTED_VIEW}', database=DATABASE, region=REGION))
+
+
+def _daily_stats(line_items_df: pd.DataFrame):
+
+    daily_stats_df, _ = PandasEngine(max_workers=1).compute(line_items_df[LINE_ITEM_COLUMNS])
+
+    return daily_stats_df
+
+
+def test_view_serves_compacted_months(run_script, line_items_df):
+
+    daily_stats_df = _daily_stats(line_items_df)
+    _write_daily_stats(daily_stats_df)
+
+    assert run_script('compaction/compaction.py') == 0
+
+    assert list_s3_keys(bucket=BUCKET, s3_prefix=f'{MONTHLY_PREFIX}/partition_month=') == \
+        [f'{MONTHLY_PREFIX}/partition_month=2026-01/shopify_daily_stats_2026-01.parquet']
+
+    pd.testing.assert_frame_equal(_view_stats(), _canonical(daily_stats_df))
+
+    # Nothing changed, nothing to compact
+    assert run_script('compaction/compaction.py') == 0
+
+
+def test_failed_recompaction_serves_the_daily_files(run_script, line_items_df, monkeypatch):
+
+    daily_stats_df = _daily_stats(line_items_df)
+    _write_daily_stats(daily_stats_df)
+
+    assert run_script('compaction/compaction.py') == 0
+
+    # A restated day, then the month's monthly file fails to be rewritten
+    restated_df = daily_stats_df.loc[daily_stats_df['order_date'] == RESTATED_DAY].assign(total_product_revenue=1.0)
+    _write_daily_stats(restated_df)
+
+    monkeypatch.setattr(common.compaction, 'write_monthly_stats', lambda **kwargs: False)
+
+    assert run_script('compaction/compaction.py') == 1
+
+    view_df = _view_stats()
+
+    assert view_df.loc[view_df['order_date'] == RESTATED_DAY, 'total_product_revenue'].tolist() == [1.0]
+    assert len(view_df) == len(daily_stats_df)
@@ -0,0 +1,49 @@
+import pytest
+from common.aws import get_glue_client
+from conftest import REPO_DIR
+
+
+# ---------------------------------------
+# PARTITION PROJECTION
+# ---------------------------------------
+
+# create_table.py with PARTITION_PROJECTION=true projects both the CSV and
+# the Parquet table, from the first shopify_line_items partition on
+
+DATABASE = 'prymal-analytics'
+
+TABLES = ['shopify_daily_stats', 'shopify_daily_stats_parquet']
+
+
+@pytest.fixture
+def create_tables(run_script, monkeypatch):
+
+    monkeypatch.chdir(REPO_DIR)
+    monkeypatch.setenv('PARTITION_PROJECTION', 'true')
+    monkeypatch.setenv('DAILY_STATS_OUTPUT_FORMAT', 'parquet')
+
+    def create():
+
+        assert run_script('create_table/shopify_daily_stats/create_table.py') == 0
+
+        glue_client = get_glue_client('us-east-1')
+
+        return {table: glue_client.get_table(DatabaseName=DATABASE, Name=table)['Table']['Parameters'] for table in TABLES}
+
+    return create
+
+
+def test_projection_starts_at_the_first_source_partition(create_tables, line_items_df):
+
+    for table, parameters in create_tables().items():
+        assert parameters['projection.enabled'] == 'true'
+        assert parameters['projection.partition_date.range'] == f"{line_items_df['partition_date'].min()},NOW"
+        assert parameters['storage.location.template'].endswith(f'/{table.replace("shopify_", "")}/partition_date=${{partition_date}}/')
+
+
+def test_projection_range_start_can_be_set(create_tables, monkeypatch):
+
+    monkeypatch.setenv('PROJECTION_RANGE_START', '2023-06-01')
+
+    for parameters in create_tables().values():
+        assert parameters['projection.partition_date.range'] == '2023-06-01,NOW'
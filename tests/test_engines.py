@@ -0,0 +1,139 @@
+import os
+import pandas as pd
+import pyarrow as pa
+import pytest
+from common.customer_state import STATE_COLUMNS, empty_customer_state, merge_customer_state
+from common.engines import DuckDBEngine, PandasEngine, PolarsEngine
+from common.out_of_core import OutOfCoreDailyStats
+from common.queries import LINE_ITEM_COLUMNS
+from common.sinks import canonicalize_daily_stats
+from common.streaming import StreamingDailyStats
+from conftest import LAST_DAY
+
+
+# ---------------------------------------
+# DAILY STATS ENGINES vs PANDAS
+# ---------------------------------------
+
+# Every way the daily stats are computed must match the pandas reference
+# (PandasEngine in one process) on the same line items, customer state and days.
+
+STATE_THROUGH = '2026-01-20'
+
+CHUNK_ROWS = 5000
+
+
+def _streaming(line_items_df: pd.DataFrame, state_df: pd.DataFrame, days: list):
+
+    chunks = [line_items_df.iloc[i:i + CHUNK_ROWS] for i in range(0, len(line_items_df), CHUNK_ROWS)]
+
+    return StreamingDailyStats().add_chunks(chunks).finalize(state_df=state_df, days=days)
+
+
+def _out_of_core(line_items_df: pd.DataFrame, state_df: pd.DataFrame, days: list):
+
+    chunks = [line_items_df.iloc[i:i + CHUNK_ROWS] for i in range(0, len(line_items_df), CHUNK_ROWS)]
+
+    with OutOfCoreDailyStats(bucket_count=4) as out_of_core_stats:
+        return out_of_core_stats.add_chunks(chunks).finalize(state_df=state_df, days=days)
+
+
+COMPUTATIONS = {
+    'duckdb': lambda line_items_df, state_df, days: DuckDBEngine(threads=1).compute(line_items_df, state_df=state_df, days=days),
+    'polars': lambda line_items_df, state_df, days: PolarsEngine(threads=1).compute(line_items_df, state_df=state_df, days=days),
+    'parallel_pandas': lambda line_items_df, state_df, days: PandasEngine(max_workers=2).compute(line_items_df, state_df=state_df, days=days),
+    'streaming': _streaming,
+    'out_of_core': _out_of_core,
+}
+
+
+def _canonical_daily_stats(df: pd.DataFrame):
+
+    df = canonicalize_daily_stats(df)
+    df['order_date'] = pd.to_datetime(df['order_date']).dt.strftime('%Y-%m-%d')
+
+    return df.sort_values('order_date', ignore_index=True)
+
+
+def _canonical_first_orders(df: pd.DataFrame):
+
+    df = df[STATE_COLUMNS].astype(str)
+    df['first_order_date'] = pd.to_datetime(df['first_order_date']).dt.strftime('%Y-%m-%d')
+
+    return df.sort_values('email', ignore_index=True)
+
+
+# Line items, customer state and days of each case
+# -----------
+
+def _case(line_items_df: pd.DataFrame, case: str):
+
+    line_items_df = line_items_df.assign(partition_date=line_items_df['partition_date'].astype(str))
+
+    if case == 'full_history':
+        return line_items_df[LINE_ITEM_COLUMNS], None, None
+
+    # The daily job: state from the earlier days, only the later days scanned
+    earlier_df = line_items_df.loc[line_items_df['partition_date'] <= STATE_THROUGH, LINE_ITEM_COLUMNS]
+    _, first_order_df = PandasEngine(max_workers=1).compute(earlier_df)
+    state_df = merge_customer_state(state_df=empty_customer_state(), first_order_df=first_order_df)
+
+    later_df = line_items_df.loc[line_items_df['partition_date'] > STATE_THROUGH, LINE_ITEM_COLUMNS]
+
+    if case == 'state_and_days':
+        return later_df, state_df, sorted(line_items_df['partition_date'].unique())[-3:]
+
+    # A day without orders
+    if case == 'empty_day':
+        return later_df, state_df, ['2026-02-15']
+
+    # No line items at all
+    return later_df.iloc[:0], state_df, [LAST_DAY]
+
+
+@pytest.mark.parametrize('case', ['full_history', 'state_and_days', 'empty_day', 'no_line_items'])
+@pytest.mark.parametrize('computation', list(COMPUTATIONS))
+def test_matches_pandas_reference(line_items_df, computation, case):
+
+    line_items, state_df, days = _case(line_items_df, case)
+
+    expected_stats_df, expected_first_order_df = PandasEngine(max_workers=1).compute(line_items, state_df=state_df, days=days)
+    daily_stats_df, first_order_df = COMPUTATIONS[computation](line_items, state_df, days)
+
+    assert list(daily_stats_df.columns) == list(expected_stats_df.columns)
+
+    pd.testing.assert_frame_equal(_canonical_daily_stats(daily_stats_df), _canonical_daily_stats(expected_stats_df))
+    pd.testing.assert_frame_equal(_canonical_first_orders(first_order_df), _canonical_first_orders(expected_first_order_df))
+
+
+# Arrow & Parquet input
+# -----------
+
+# Each engine also takes a pyarrow Table or a directory of Parquet files, one
+# per day like the UNLOAD output, with the same result as the DataFrame
+
+ENGINES = {
+    'pandas': lambda: PandasEngine(max_workers=1),
+    'duckdb': lambda: DuckDBEngine(threads=1),
+    'polars': lambda: PolarsEngine(threads=1),
+}
+
+
+@pytest.mark.parametrize('input_format', ['arrow', 'parquet'])
+@pytest.mark.parametrize('engine', list(ENGINES))
+def test_arrow_and_parquet_input_match_the_dataframe(line_items_df, tmp_path, engine, input_format):
+
+    line_items, state_df, days = _case(line_items_df, 'state_and_days')
+
+    if input_format == 'arrow':
+        engine_input = pa.Table.from_pandas(line_items, preserve_index=False)
+    else:
+        for i, (_, day_df) in enumerate(line_items.groupby(line_items['order_date'].dt.strftime('%Y-%m-%d'))):
+            day_df.to_parquet(os.path.join(tmp_path, f'part-{i}.parquet'), index=False)
+        engine_input = str(tmp_path)
+
+    expected_stats_df, expected_first_order_df = PandasEngine(max_workers=1).compute(line_items, state_df=state_df, days=days)
+    daily_stats_df, first_order_df = ENGINES[engine]().compute(engine_input, state_df=state_df, days=days)
+
+    pd.testing.assert_frame_equal(_canonical_daily_stats(daily_stats_df), _canonical_daily_stats(expected_stats_df))
+    pd.testing.assert_frame_equal(_canonical_first_orders(first_order_df), _canonical_first_orders(expected_first_order_df))
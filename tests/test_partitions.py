@@ -0,0 +1,118 @@
+import pytest
+from botocore.exceptions import ClientError
+import common.partitions
+from common.athena import run_athena_query_no_results
+from common.aws import get_glue_client
+from common.local_backend import LocalGlueClient
+from common.partitions import PartitionRegistrar
+
+
+# ---------------------------------------
+# PARTITION REGISTRAR
+# ---------------------------------------
+
+# PartitionRegistrar on the local Glue catalog, with the calls it makes
+# recorded. Batch sizes are shrunk so a week of days spans several batches.
+
+DATABASE = 'prymal-analytics'
+TABLE = 'shopify_daily_stats'
+
+WEEK = [f'2026-01-0{d}' for d in range(1, 8)]
+
+
+@pytest.fixture
+def created_batches(local_backend, monkeypatch):
+
+    batches = []
+
+    batch_create_partition = LocalGlueClient.batch_create_partition
+
+    def recording_batch_create_partition(self, DatabaseName: str, TableName: str, PartitionInputList: list, **kwargs):
+        batches.append([p['Values'][0] for p in PartitionInputList])
+        return batch_create_partition(self, DatabaseName=DatabaseName, TableName=TableName, PartitionInputList=PartitionInputList)
+
+    monkeypatch.setattr(LocalGlueClient, 'batch_create_partition', recording_batch_create_partition)
+    monkeypatch.setattr(common.partitions, 'GLUE_CREATE_BATCH_SIZE', 3)
+
+    return batches
+
+
+def _registered():
+
+    return sorted(p['Values'][0] for p in get_glue_client('us-east-1').get_partitions(DatabaseName=DATABASE, TableName=TABLE)['Partitions'])
+
+
+def _register(partition_dates: list, method: str = 'glue'):
+
+    registrar = PartitionRegistrar(table=TABLE, database=DATABASE, method=method)
+    registrar.add_many(partition_dates)
+
+    return registrar.flush()
+
+
+def test_glue_partitions_are_created_in_batches(created_batches):
+
+    assert _register(WEEK) == []
+
+    assert created_batches == [WEEK[0:3], WEEK[3:6], WEEK[6:7]]
+    assert _registered() == WEEK
+
+
+def test_registered_partitions_are_skipped(created_batches):
+
+    assert _register(WEEK[:5]) == []
+
+    created_batches.clear()
+    assert _register(WEEK) == []
+
+    assert created_batches == [WEEK[5:7]]
+
+    created_batches.clear()
+    assert _register(WEEK) == []
+
+    assert created_batches == []
+    assert _registered() == WEEK
+
+
+def test_failed_glue_batch_is_returned(created_batches, monkeypatch):
+
+    batch_create_partition = LocalGlueClient.batch_create_partition
+
+    def failing_batch_create_partition(self, PartitionInputList: list, **kwargs):
+        if PartitionInputList[0]['Values'] == [WEEK[3]]:
+            raise ClientError({'Error': {'Code': 'InternalServiceException', 'Message': 'failed'}}, 'BatchCreatePartition')
+        return batch_create_partition(self, PartitionInputList=PartitionInputList, **kwargs)
+
+    monkeypatch.setattr(LocalGlueClient, 'batch_create_partition', failing_batch_create_partition)
+
+    assert _register(WEEK) == WEEK[3:6]
+    assert _registered() == WEEK[0:3] + WEEK[6:7]
+
+
+def test_alter_table_statements_are_batched(local_backend, monkeypatch):
+
+    recorded_queries = []
+
+    run_athena_queries_no_results = common.partitions.run_athena_queries_no_results
+
+    def recording_run_athena_queries_no_results(queries: list, database: str):
+        recorded_queries.extend(queries)
+        return run_athena_queries_no_results(queries=queries, database=database)
+
+    monkeypatch.setattr(common.partitions, 'run_athena_queries_no_results', recording_run_athena_queries_no_results)
+    monkeypatch.setattr(common.partitions, 'PARTITION_BATCH_SIZE', 3)
+
+    assert _register(WEEK, method='athena') == []
+
+    assert [q.count('PARTITION (') for q in recorded_queries] == [3, 3, 1]
+    assert _registered() == WEEK
+
+
+def test_projected_tables_are_not_registered(created_batches):
+
+    run_athena_query_no_results(query=f'ALTER TABLE {TABLE} SET TBLPROPERTIES ("projection.enabled"="true")', database=DATABASE)
+
+    assert _register(WEEK) == []
+
+    assert created_batches == []
+    assert _registered() == []
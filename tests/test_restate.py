@@ -0,0 +1,119 @@
+import os
+import pandas as pd
+import pytest
+from common.athena import AthenaQueryExecutor, run_athena_query
+from common.engines import PandasEngine
+from common.queries import LINE_ITEM_COLUMNS
+from common.sinks import canonicalize_daily_stats
+from conftest import LAST_DAY
+
+
+# ---------------------------------------
+# RESTATING CHANGED SOURCE PARTITIONS
+# ---------------------------------------
+
+# backfill/restate.py after a backfill of the month: partitions are rewritten
+# and a new day arrives, then the restated stats must match a fresh
+# computation without ever scanning the full line items history.
+
+DATABASE = 'prymal'
+REGION = 'us-east-1'
+
+NEW_DAY = '2026-02-01'
+
+
+def _write_partition(local_backend, partition_date: str, day_df: pd.DataFrame):
+
+    path = os.path.join(local_backend, 'shopify_line_items', f'partition_date={partition_date}')
+
+    os.makedirs(path, exist_ok=True)
+
+    day_df[LINE_ITEM_COLUMNS].to_parquet(os.path.join(path, 'part-0.parquet'), index=False)
+
+
+def _canonical(df: pd.DataFrame):
+
+    df = canonicalize_daily_stats(df)
+    df['order_date'] = pd.to_datetime(df['order_date']).dt.strftime('%Y-%m-%d')
+
+    return df.sort_values('order_date', ignore_index=True)
+
+
+@pytest.fixture
+def athena_queries(monkeypatch):
+
+    queries = []
+
+    start = AthenaQueryExecutor.start
+
+    def recording_start(self, query: str, database: str):
+        queries.append(query)
+        return start(self, query=query, database=database)
+
+    monkeypatch.setattr(AthenaQueryExecutor, 'start', recording_start)
+
+    return queries
+
+
+# Two restatements that move first orders, and one new day
+# -----------
+
+def _restate_sources(local_backend, line_items_df: pd.DataFrame):
+
+    line_items_df = line_items_df.assign(partition_date=line_items_df['partition_date'].astype(str))
+
+    first_orders = line_items_df.dropna(subset=['email']).groupby('email')['partition_date'].agg(['min', 'nunique'])
+
+    # A customer's first order removed from 2026-01-10, so their next order becomes the first
+    removed_email = first_orders.loc[(first_orders['min'] == '2026-01-10') & (first_orders['nunique'] > 1)].index[0]
+    removed = (line_items_df['partition_date'] == '2026-01-10') & (line_items_df['email'] == removed_email)
+
+    # An earlier order for a customer first seen on 2026-01-25
+    moved_email = first_orders.loc[first_orders['min'] == '2026-01-25'].index[0]
+    added_df = line_items_df.loc[line_items_df['email'] == moved_email].head(1).assign(order_date=pd.Timestamp('2026-01-05 12:00'),
+                                                                                         partition_date='2026-01-05')
+
+    new_day_df = line_items_df.loc[line_items_df['partition_date'] == LAST_DAY].assign(
+        order_date=lambda df: df['order_date'] + pd.Timedelta(days=1), partition_date=NEW_DAY)
+
+    restated_df = pd.concat([line_items_df.loc[~removed], added_df, new_day_df], ignore_index=True)
+
+    for partition_date in ['2026-01-05', '2026-01-10', NEW_DAY]:
+        _write_partition(local_backend, partition_date, restated_df.loc[restated_df['partition_date'] == partition_date])
+
+    return restated_df
+
+
+def test_restate_matches_a_fresh_computation(run_script, local_backend, line_items_df, athena_queries):
+
+    assert run_script('backfill/backfill.py', '--start', '2026-01-01', '--end', LAST_DAY) == 0
+
+    backfilled_df = run_athena_query(query='SELECT * FROM shopify_daily_stats', database=DATABASE, region=REGION)
+
+    # The first run records the fingerprints, with the first orders taken from the customer state
+    athena_queries.clear()
+    assert run_script('backfill/restate.py') == 0
+    assert athena_queries == []
+
+    restated_df = _restate_sources(local_backend, line_items_df)
+
+    athena_queries.clear()
+    assert run_script('backfill/restate.py') == 0
+
+    # Only the partitions from the first changed one on are scanned for first orders
+    first_order_queries = [q for q in athena_queries if 'MIN(SUBSTR(CAST(order_date' in q]
+    assert first_order_queries and all('partition_date >=' in q for q in first_order_queries)
+    assert not any('OVER (PARTITION BY email)' in q for q in athena_queries)
+
+    daily_stats_df = run_athena_query(query='SELECT * FROM shopify_daily_stats', database=DATABASE, region=REGION)
+
+    expected_df, _ = PandasEngine(max_workers=1).compute(restated_df.loc[restated_df['partition_date'] <= LAST_DAY, LINE_ITEM_COLUMNS])
+
+    # The new day is left to the daily job
+    pd.testing.assert_frame_equal(_canonical(daily_stats_df), _canonical(expected_df))
+    assert not _canonical(backfilled_df).equals(_canonical(expected_df))
+
+    # Nothing changed since
+    athena_queries.clear()
+    assert run_script('backfill/restate.py') == 0
+    assert athena_queries == []
@@ -0,0 +1,124 @@
+import importlib
+import os
+import pandas as pd
+import pytest
+from datetime import timedelta
+import common.sinks
+from common.athena import execute_athena_query, run_athena_query
+from common.engines import PandasEngine
+from common.queries import LINE_ITEM_COLUMNS, build_daily_stats_insert_query, build_daily_stats_query
+from common.sinks import canonicalize_daily_stats
+from common.synthetic import generate_line_items
+from conftest import LAST_DAY
+
+
+# ---------------------------------------
+# SERVER-SIDE DAILY STATS vs PANDAS
+# ---------------------------------------
+
+# The Athena modes ('athena', 'athena_insert') run common/queries.py on the
+# local DuckDB backend and must match the pandas reference day for day.
+
+DATABASE = 'prymal'
+REGION = 'us-east-1'
+
+YESTERDAY = pd.to_datetime(pd.to_datetime('today') - timedelta(1)).strftime('%Y-%m-%d')
+
+
+def _canonical(df: pd.DataFrame):
+
+    df = canonicalize_daily_stats(df)
+    df['order_date'] = pd.to_datetime(df['order_date']).dt.strftime('%Y-%m-%d')
+
+    return df.sort_values('order_date', ignore_index=True)
+
+
+def _pandas_daily_stats(line_items_df: pd.DataFrame, start_date: str = None, end_date: str = None):
+
+    line_items_df = line_items_df[line_items_df['partition_date'].astype(str) <= (end_date or LAST_DAY)]
+
+    daily_stats_df, _ = PandasEngine(max_workers=1).compute(line_items_df[LINE_ITEM_COLUMNS])
+
+    daily_stats_df = _canonical(daily_stats_df)
+
+    return daily_stats_df[daily_stats_df['order_date'] >= (start_date or '')].reset_index(drop=True)
+
+
+@pytest.mark.parametrize('start_date, end_date', [(None, None), ('2026-01-20', LAST_DAY), (LAST_DAY, LAST_DAY), ('2026-01-10', '2026-01-15')])
+def test_daily_stats_query_matches_pandas(local_backend, line_items_df, start_date, end_date):
+
+    daily_stats_df = run_athena_query(query=build_daily_stats_query(start_date=start_date, end_date=end_date),
+                                      database=DATABASE, region=REGION)
+
+    pd.testing.assert_frame_equal(_canonical(daily_stats_df), _pandas_daily_stats(line_items_df, start_date, end_date))
+
+
+def test_daily_stats_insert_matches_pandas(local_backend, line_items_df):
+
+    execute_athena_query(query=build_daily_stats_insert_query(start_date='2026-01-25', end_date=LAST_DAY),
+                         database=DATABASE, region=REGION)
+
+    inserted_df = run_athena_query(query='SELECT * FROM shopify_daily_stats_parquet', database=DATABASE, region=REGION)
+
+    # One partition per inserted day, holding that day's row
+    assert (inserted_df['partition_date'].astype(str) == pd.to_datetime(inserted_df['order_date']).dt.strftime('%Y-%m-%d')).all()
+
+    pd.testing.assert_frame_equal(_canonical(inserted_df), _pandas_daily_stats(line_items_df, '2026-01-25', LAST_DAY))
+
+
+def test_window_without_orders_returns_no_rows(local_backend, line_items_df):
+
+    daily_stats_df = run_athena_query(query=build_daily_stats_query(start_date='2026-02-10', end_date='2026-02-12'),
+                                      database=DATABASE, region=REGION)
+
+    assert daily_stats_df.empty
+    assert list(daily_stats_df.columns) == list(_pandas_daily_stats(line_items_df).columns)
+
+
+# The daily job in each server-side mode
+# -----------
+
+# Line items for the week up to yesterday, the day the job computes, are
+# added to the month of fixtures
+
+@pytest.fixture
+def recent_line_items_df(local_backend, line_items_df):
+
+    recent_df = generate_line_items(customer_count=200, days=7, end_date=YESTERDAY, seed=2)
+    recent_df['partition_date'] = recent_df['partition_date'].astype(str)
+
+    for partition_date, day_df in recent_df.groupby('partition_date'):
+        path = os.path.join(local_backend, 'shopify_line_items', f'partition_date={partition_date}')
+        os.makedirs(path, exist_ok=True)
+        day_df[LINE_ITEM_COLUMNS].to_parquet(os.path.join(path, 'part-0.parquet'), index=False)
+
+    return pd.concat([line_items_df.assign(partition_date=line_items_df['partition_date'].astype(str)), recent_df], ignore_index=True)
+
+
+# DAILY_STATS_OUTPUT_FORMAT is read when common.sinks is imported
+@pytest.fixture
+def output_format(monkeypatch):
+
+    def set_output_format(output_format: str):
+        monkeypatch.setenv('DAILY_STATS_OUTPUT_FORMAT', output_format)
+        importlib.reload(common.sinks)
+
+    yield set_output_format
+
+    monkeypatch.delenv('DAILY_STATS_OUTPUT_FORMAT', raising=False)
+    importlib.reload(common.sinks)
+
+
+@pytest.mark.parametrize('stats_mode, table', [('athena', 'shopify_daily_stats'), ('athena_insert', 'shopify_daily_stats_parquet')])
+def test_daily_job_matches_pandas(run_script, recent_line_items_df, output_format, monkeypatch, stats_mode, table):
+
+    monkeypatch.setenv('DAILY_STATS_MODE', stats_mode)
+    output_format('parquet' if stats_mode == 'athena_insert' else 'csv')
+
+    assert run_script('transformation/transformation.py') == 0
+
+    daily_stats_df = run_athena_query(query=f'SELECT * FROM {table}', database=DATABASE, region=REGION)
+
+    expected_df, _ = PandasEngine(max_workers=1).compute(recent_line_items_df[LINE_ITEM_COLUMNS], days=[YESTERDAY])
+
+    pd.testing.assert_frame_equal(_canonical(daily_stats_df), _canonical(expected_df))
@@ -0,0 +1,79 @@
+import pandas as pd
+from common.athena import execute_athena_query, run_athena_query
+from common.aws import get_s3_client
+from common.engines import PandasEngine
+from common.partitions import register_partitions
+from common.queries import LINE_ITEM_COLUMNS, build_daily_stats_insert_query
+from common.s3 import list_s3_keys
+from common.sinks import daily_stats_key, daily_stats_partition_prefix, write_daily_stats_partitions
+from conftest import BUCKET
+
+
+# ---------------------------------------
+# DAILY STATS PARTITION WRITES
+# ---------------------------------------
+
+DATABASE = 'prymal-analytics'
+REGION = 'us-east-1'
+
+DAY = '2026-01-10'
+
+
+def _daily_stats(line_items_df: pd.DataFrame):
+
+    daily_stats_df, _ = PandasEngine(max_workers=1).compute(line_items_df[LINE_ITEM_COLUMNS])
+
+    return daily_stats_df
+
+
+def _count_puts(monkeypatch):
+
+    s3_client = get_s3_client(REGION)
+    keys = []
+
+    put_object = s3_client.put_object
+
+    def counting_put_object(**kwargs):
+        keys.append(kwargs['Key'])
+        return put_object(**kwargs)
+
+    monkeypatch.setattr(s3_client, 'put_object', counting_put_object)
+
+    return keys
+
+
+def test_unchanged_partitions_are_not_rewritten(local_backend, line_items_df, monkeypatch):
+
+    daily_stats_df = _daily_stats(line_items_df)
+
+    write_daily_stats_partitions(s3_client=get_s3_client(REGION), bucket=BUCKET, daily_stats_df=daily_stats_df)
+
+    put_keys = _count_puts(monkeypatch)
+
+    changed_df = daily_stats_df.copy()
+    changed_df.loc[changed_df['order_date'] == DAY, 'total_product_revenue'] += 1
+
+    written_dates = write_daily_stats_partitions(s3_client=get_s3_client(REGION), bucket=BUCKET, daily_stats_df=changed_df)
+
+    assert written_dates == sorted(daily_stats_df['order_date'])
+    assert put_keys == [daily_stats_key(DAY)]
+
+
+def test_write_replaces_files_an_insert_left(local_backend, line_items_df):
+
+    execute_athena_query(query=build_daily_stats_insert_query(start_date=DAY, end_date=DAY), database=DATABASE, region=REGION)
+
+    daily_stats_df = _daily_stats(line_items_df)
+
+    written_dates = write_daily_stats_partitions(s3_client=get_s3_client(REGION), bucket=BUCKET, output_format='parquet',
+                                                 daily_stats_df=daily_stats_df.loc[daily_stats_df['order_date'] == DAY])
+
+    assert register_partitions(partition_dates=written_dates, table='shopify_daily_stats_parquet') == []
+
+    assert list_s3_keys(bucket=BUCKET, s3_prefix=daily_stats_partition_prefix(DAY, output_format='parquet')) == \
+        [daily_stats_key(DAY, output_format='parquet')]
+
+    count_df = run_athena_query(query=f"SELECT COUNT(*) AS row_count FROM shopify_daily_stats_parquet WHERE partition_date = DATE '{DAY}'",
+                                database=DATABASE, region=REGION)
+
+    assert count_df['row_count'].tolist() == [1]
@@ -0,0 +1,87 @@
+import os
+import pandas as pd
+from datetime import timedelta
+from common.athena import run_athena_query
+from common.aws import get_s3_client
+from common.customer_state import CUSTOMER_STATE_KEY, S3CustomerStateStore, empty_customer_state, merge_customer_state
+from common.engines import PandasEngine
+from common.queries import LINE_ITEM_COLUMNS
+from common.s3 import list_s3_keys
+from common.sinks import canonicalize_daily_stats
+from common.synthetic import generate_line_items
+from conftest import BUCKET
+
+
+# ---------------------------------------
+# DAILY TRANSFORMATION
+# ---------------------------------------
+
+# transformation/transformation.py in 'pandas' mode, with line items up to
+# yesterday (the day the job computes) added to the month of fixtures.
+
+DATABASE = 'prymal'
+REGION = 'us-east-1'
+
+YESTERDAY = pd.to_datetime(pd.to_datetime('today') - timedelta(1)).strftime('%Y-%m-%d')
+
+
+def _write_recent_line_items(local_backend, days: int):
+
+    recent_df = generate_line_items(customer_count=200, days=days, end_date=YESTERDAY, seed=1)
+    recent_df['partition_date'] = recent_df['partition_date'].astype(str)
+
+    for partition_date, day_df in recent_df.groupby('partition_date'):
+        path = os.path.join(local_backend, 'shopify_line_items', f'partition_date={partition_date}')
+        os.makedirs(path, exist_ok=True)
+        day_df[LINE_ITEM_COLUMNS].to_parquet(os.path.join(path, 'part-0.parquet'), index=False)
+
+    return recent_df
+
+
+def _canonical(df: pd.DataFrame):
+
+    df = canonicalize_daily_stats(df)
+    df['order_date'] = pd.to_datetime(df['order_date']).dt.strftime('%Y-%m-%d')
+
+    return df.sort_values('order_date', ignore_index=True)
+
+
+def test_unknown_mode_fails_before_querying(run_script, monkeypatch):
+
+    monkeypatch.setenv('DAILY_STATS_MODE', 'sql')
+
+    assert run_script('transformation/transformation.py') == 1
+    assert list_s3_keys(bucket=BUCKET, s3_prefix='shopify/', s3_client=get_s3_client(REGION)) == []
+
+
+# Days missed since the customer state watermark are computed in one run
+# -----------
+
+def test_missed_days_are_caught_up(run_script, local_backend, line_items_df):
+
+    recent_df = _write_recent_line_items(local_backend, days=4)
+    all_df = pd.concat([line_items_df.assign(partition_date=line_items_df['partition_date'].astype(str)), recent_df], ignore_index=True)
+
+    # The state stops at the first recent day, the three days after it were missed
+    watermark = recent_df['partition_date'].min()
+    missed_days = sorted(recent_df.loc[recent_df['partition_date'] > watermark, 'partition_date'].unique())
+
+    _, first_order_df = PandasEngine(max_workers=1).compute(all_df.loc[all_df['partition_date'] <= watermark, LINE_ITEM_COLUMNS])
+
+    state_store = S3CustomerStateStore(bucket=BUCKET, key=CUSTOMER_STATE_KEY, s3_client=get_s3_client(REGION))
+    state_store.save(merge_customer_state(state_df=empty_customer_state(), first_order_df=first_order_df), state_through=watermark)
+
+    assert run_script('transformation/transformation.py') == 0
+
+    daily_stats_df = run_athena_query(query='SELECT * FROM shopify_daily_stats', database=DATABASE, region=REGION)
+
+    expected_df, expected_first_order_df = PandasEngine(max_workers=1).compute(all_df[LINE_ITEM_COLUMNS], days=missed_days)
+
+    pd.testing.assert_frame_equal(_canonical(daily_stats_df), _canonical(expected_df))
+
+    # The watermark moves to yesterday, with the missed days' new customers in the state
+    assert state_store.load_state_through() == YESTERDAY
+
+    expected_state_df = merge_customer_state(state_df=empty_customer_state(), first_order_df=expected_first_order_df)
+    pd.testing.assert_frame_equal(state_store.load().sort_values('email', ignore_index=True),
+                                  expected_state_df.sort_values('email', ignore_index=True), check_dtype=False)
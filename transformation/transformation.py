@@ -4,7 +4,9 @@ from botocore.exceptions import BotoCoreError, ClientError, NoCredentialsError,
 import loguru
 from loguru import logger
 import os
+import sys
 import io
+import itertools
 from io import BytesIO, StringIO
 import pandas as pd
 import numpy as np
@@ -12,280 +14,23 @@ import datetime
 from datetime import datetime 
 from datetime import timedelta
 
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from common.aws import get_s3_client
+from common.athena import AthenaQueryResult, iter_athena_query_chunks, run_athena_query, run_athena_query_no_results
+from common.engines import DAILY_STATS_ENGINE, get_engine
+from common.queries import build_line_items_query, build_daily_stats_query, build_daily_stats_insert_query
+from common.s3 import delete_s3_keys, list_s3_keys
+from common.sinks import OUTPUT_FORMAT, daily_stats_table, daily_stats_partition_prefix, write_daily_stats_partitions
+from common.partitions import register_partitions
+from common.streaming import StreamingDailyStats
+from common.out_of_core import OutOfCoreDailyStats, use_out_of_core
+from common.customer_state import CUSTOMER_STATE_KEY, S3CustomerStateStore, empty_customer_state, merge_customer_state
+
 
 AWS_ACCESS_KEY_ID=os.environ['AWS_ACCESS_KEY']
 AWS_SECRET_ACCESS_KEY=os.environ['AWS_ACCESS_SECRET']
 
 
-# ---------------------------------------
-# FUNCTIONS
-# ---------------------------------------
-
-# FUNCTION TO EXECUTE ATHENA QUERY AND RETURN RESULTS
-# ----------
-
-def run_athena_query(query:str, database: str, region:str):
-
-        
-    # Initialize Athena client
-    athena_client = boto3.client('athena', 
-                                 region_name=region,
-                                 aws_access_key_id=AWS_ACCESS_KEY_ID,
-                                 aws_secret_access_key=AWS_SECRET_ACCESS_KEY)
-
-    # Execute the query
-    try:
-        response = athena_client.start_query_execution(
-            QueryString=query,
-            QueryExecutionContext={
-                'Database': database
-            },
-            ResultConfiguration={
-                'OutputLocation': 's3://prymal-ops/athena_query_results/'  # Specify your S3 bucket for query results
-            }
-        )
-
-        query_execution_id = response['QueryExecutionId']
-
-        # Wait for the query to complete
-        state = 'RUNNING'
-
-        while (state in ['RUNNING', 'QUEUED']):
-            response = athena_client.get_query_execution(QueryExecutionId = query_execution_id)
-            logger.info(f'Query is in {state} state..')
-            if 'QueryExecution' in response and 'Status' in response['QueryExecution'] and 'State' in response['QueryExecution']['Status']:
-                # Get currentstate
-                state = response['QueryExecution']['Status']['State']
-
-                if state == 'FAILED':
-                    logger.error('Query Failed!')
-                elif state == 'SUCCEEDED':
-                    logger.info('Query Succeeded!')
-            
-
-        # OBTAIN DATA
-
-        # --------------
-
-
-
-        query_results = athena_client.get_query_results(QueryExecutionId=query_execution_id,
-                                                MaxResults= 1000)
-        
-
-
-        # Extract qury result column names into a list  
-
-        cols = query_results['ResultSet']['ResultSetMetadata']['ColumnInfo']
-        col_names = [col['Name'] for col in cols]
-
-
-
-        # Extract query result data rows
-        data_rows = query_results['ResultSet']['Rows'][1:]
-
-
-
-        # Convert data rows into a list of lists
-        query_results_data = [[r['VarCharValue'] if 'VarCharValue' in r else np.NaN for r in row['Data']] for row in data_rows]
-
-
-
-        # Paginate Results if necessary
-        while 'NextToken' in query_results:
-                query_results = athena_client.get_query_results(QueryExecutionId=query_execution_id,
-                                                NextToken=query_results['NextToken'],
-                                                MaxResults= 1000)
-
-
-
-                # Extract quuery result data rows
-                data_rows = query_results['ResultSet']['Rows'][1:]
-
-
-                # Convert data rows into a list of lists
-                query_results_data.extend([[r['VarCharValue'] if 'VarCharValue' in r else np.NaN for r in row['Data']] for row in data_rows])
-
-
-
-        results_df = pd.DataFrame(query_results_data, columns = col_names)
-        
-        return results_df
-
-
-    except ParamValidationError as e:
-        logger.error(f"Validation Error (potential SQL query issue): {e}")
-        # Handle invalid parameters in the request, such as an invalid SQL query
-
-    except WaiterError as e:
-        logger.error(f"Waiter Error: {e}")
-        # Handle errors related to waiting for query execution
-
-    except ClientError as e:
-        error_code = e.response['Error']['Code']
-        error_message = e.response['Error']['Message']
-        
-        if error_code == 'InvalidRequestException':
-            logger.error(f"Invalid Request Exception: {error_message}")
-            # Handle issues with the Athena request, such as invalid SQL syntax
-            
-        elif error_code == 'ResourceNotFoundException':
-            logger.error(f"Resource Not Found Exception: {error_message}")
-            # Handle cases where the database or query execution does not exist
-            
-        elif error_code == 'AccessDeniedException':
-            logger.error(f"Access Denied Exception: {error_message}")
-            # Handle cases where the IAM role does not have sufficient permissions
-            
-        else:
-            logger.error(f"Athena Error: {error_code} - {error_message}")
-            # Handle other Athena-related errors
-
-    except Exception as e:
-        logger.error(f"Other Exception: {str(e)}")
-        # Handle any other unexpected exceptions
-
-
-# Check S3 Path for Existing Data
-# -----------
-
-def check_path_for_objects(bucket: str, s3_prefix:str):
-
-  logger.info(f'Checking for existing data in {bucket}/{s3_prefix}')
-
-  # Create s3 client
-  s3_client = boto3.client('s3', 
-                          region_name = REGION,
-                          aws_access_key_id=AWS_ACCESS_KEY_ID,
-                          aws_secret_access_key=AWS_SECRET_ACCESS_KEY)
-
-  # List objects in s3_prefix
-  result = s3_client.list_objects_v2(Bucket=bucket, Prefix=s3_prefix)
-
-  # Instantiate objects_exist
-  objects_exist=False
-
-  # Set objects_exist to true if objects are in prefix
-  if 'Contents' in result:
-      objects_exist=True
-
-      logger.info('Data already exists!')
-
-  return objects_exist
-
-# Delete Existing Data from S3 Path
-# -----------
-
-def delete_s3_prefix_data(bucket:str, s3_prefix:str):
-
-
-  logger.info(f'Deleting existing data from {bucket}/{s3_prefix}')
-
-  # Create an S3 client
-  s3_client = boto3.client('s3', 
-                          region_name = REGION,
-                          aws_access_key_id=AWS_ACCESS_KEY_ID,
-                          aws_secret_access_key=AWS_SECRET_ACCESS_KEY)
-
-  # Use list_objects_v2 to list all objects within the specified prefix
-  objects_to_delete = s3_client.list_objects_v2(Bucket=bucket, Prefix=s3_prefix)
-
-  # Extract the list of object keys
-  keys_to_delete = [obj['Key'] for obj in objects_to_delete.get('Contents', [])]
-
-  # Check if there are objects to delete
-  if keys_to_delete:
-      # Delete the objects using 'delete_objects'
-      response = s3_client.delete_objects(
-          Bucket=bucket,
-          Delete={'Objects': [{'Key': key} for key in keys_to_delete]}
-      )
-      logger.info(f"Deleted {len(keys_to_delete)} objects")
-  else:
-      logger.info("No objects to delete")
-
-
-
-
-# --------------
-# Function to run Athena query , not return results
-# --------------
-
-
-def run_athena_query_no_results(query:str, database: str):
-
-        
-    # Initialize Athena client
-    athena_client = boto3.client('athena', 
-                                 region_name='us-east-1',
-                                 aws_access_key_id=AWS_ACCESS_KEY_ID,
-                                 aws_secret_access_key=AWS_SECRET_ACCESS_KEY)
-
-    # Execute the query
-    try:
-        response = athena_client.start_query_execution(
-            QueryString=query,
-            QueryExecutionContext={
-                'Database': database
-            },
-            ResultConfiguration={
-                'OutputLocation': 's3://prymal-ops/athena_query_results/'  # Specify your S3 bucket for query results
-            }
-        )
-
-        query_execution_id = response['QueryExecutionId']
-
-        # Wait for the query to complete
-        state = 'RUNNING'
-
-        while (state in ['RUNNING', 'QUEUED']):
-            response = athena_client.get_query_execution(QueryExecutionId = query_execution_id)
-            logger.info(f'Query is in {state} state..')
-            if 'QueryExecution' in response and 'Status' in response['QueryExecution'] and 'State' in response['QueryExecution']['Status']:
-                # Get currentstate
-                state = response['QueryExecution']['Status']['State']
-
-                if state == 'FAILED':
-                    logger.error('Query Failed!')
-                elif state == 'SUCCEEDED':
-                    logger.info('Query Succeeded!')
-
-                    
-    except ParamValidationError as e:
-        logger.error(f"Validation Error (potential SQL query issue): {e}")
-        # Handle invalid parameters in the request, such as an invalid SQL query
-
-    except WaiterError as e:
-        logger.error(f"Waiter Error: {e}")
-        # Handle errors related to waiting for query execution
-
-    except ClientError as e:
-        error_code = e.response['Error']['Code']
-        error_message = e.response['Error']['Message']
-        
-        if error_code == 'InvalidRequestException':
-            logger.error(f"Invalid Request Exception: {error_message}")
-            # Handle issues with the Athena request, such as invalid SQL syntax
-            
-        elif error_code == 'ResourceNotFoundException':
-            logger.error(f"Resource Not Found Exception: {error_message}")
-            # Handle cases where the database or query execution does not exist
-            
-        elif error_code == 'AccessDeniedException':
-            logger.error(f"Access Denied Exception: {error_message}")
-            # Handle cases where the IAM role does not have sufficient permissions
-            
-        else:
-            logger.error(f"Athena Error: {error_code} - {error_message}")
-            # Handle other Athena-related errors
-
-    except Exception as e:
-        logger.error(f"Other Exception: {str(e)}")
-        # Handle any other unexpected exceptions
-
-
-
-
 # ========================================================================
 # Execute Code
 # ========================================================================
@@ -293,6 +38,9 @@ def run_athena_query_no_results(query:str, database: str):
 DATABASE = 'prymal'
 REGION = 'us-east-1'
 
+# How query results are fetched: 'auto', 'paginate', 's3_csv' or 'unload' (Parquet)
+FETCH_MODE = os.environ.get('ATHENA_FETCH_MODE', 'auto')
+
 
 # Construct query to pull data by product
 # ----
@@ -302,100 +50,122 @@ yesterday_y = pd.to_datetime(pd.to_datetime('today') - timedelta(1)).strftime('%
 yesterday_m = pd.to_datetime(pd.to_datetime('today') - timedelta(1)).strftime('%m')
 yesterday_d = pd.to_datetime(pd.to_datetime('today') - timedelta(1)).strftime('%d')
 
-QUERY = f"""SELECT *
-            FROM shopify_line_items
-        """
+# Create s3 client
+s3_client = get_s3_client(REGION)
 
-# Query datalake to get quantiy sold per sku for the last 120 days
-# ----
+# Set bucket
+BUCKET = os.environ['S3_PRYMAL_ANALYTICS']
 
-result_df = run_athena_query(query=QUERY, database=DATABASE, region=REGION)
-# result_df.columns = ['partition_date','order_date','sku','sku_name','qty_sold']
+# Where the daily stats are computed:
+#   'pandas'        - pull line items and aggregate them with DAILY_STATS_ENGINE (common/engines.py:
+#                     pandas reference, duckdb or polars), out of core above OUT_OF_CORE_THRESHOLD_MB
+#   'streaming'     - same as 'pandas' but aggregates the results chunk by chunk,
+#                     memory grows with customer-days instead of line items
+#   'athena'        - aggregate inside Athena and pull back one row per day
+#   'athena_insert' - aggregate inside Athena and INSERT INTO shopify_daily_stats_parquet directly
+#                     (DAILY_STATS_OUTPUT_FORMAT=parquet only, see build_daily_stats_insert_query)
+# The Athena modes do not maintain the customer state, re-run the backfill to
+# reseed it before switching back to 'pandas' or 'streaming'.
+STATS_MODE = os.environ.get('DAILY_STATS_MODE', 'pandas')
 
-logger.info(result_df.head(3))
-logger.info(result_df.info())
-logger.info(f"Count of NULL RECORDS: {len(result_df.loc[result_df['order_date'].isna()])}")
-# Format datatypes & new columns
-result_df['order_date'] = pd.to_datetime(result_df['order_date']).dt.strftime('%Y-%m-%d')
-result_df['week'] = pd.to_datetime(result_df['order_date']).dt.strftime('%Y-%W')
-result_df['product_rev'] = result_df['quantity'].astype(float) * result_df['price'].astype(float)
+STATS_MODES = ('pandas', 'streaming', 'athena', 'athena_insert')
 
-logger.info(f"MIN DATE: {result_df['order_date'].min()}")
-logger.info(f"MAX DATE: {result_df['order_date'].max()}")
+if STATS_MODE not in STATS_MODES:
+    logger.error(f"Unknown DAILY_STATS_MODE '{STATS_MODE}', expected one of {', '.join(STATS_MODES)}")
+    sys.exit(1)
 
+logger.info(f'Computing daily stats in {STATS_MODE} mode')
 
-# Create dataframe copy
-shopify_line_item_df = result_df.copy()
+if STATS_MODE == 'athena_insert' and OUTPUT_FORMAT != 'parquet':
+    logger.error('athena_insert writes the Parquet table only, set DAILY_STATS_OUTPUT_FORMAT=parquet')
+    sys.exit(1)
 
-# --------------------
-# calculate first order date & age at time of purchase
-# --------------------
+CUSTOMER_STATE_MODES = ('pandas', 'streaming')
 
-first_order_df = shopify_line_item_df.groupby('email',as_index=False).agg({
-                                    'order_date':'min'
+# Days computed & written by this run
+STATS_DAYS = [yesterday]
 
-})
+if STATS_MODE in CUSTOMER_STATE_MODES:
 
-first_order_df.columns = ['email','first_order_date']
+    # Customer state (email -> first_order_date) persisted between daily runs
+    customer_state_store = S3CustomerStateStore(bucket=BUCKET, key=CUSTOMER_STATE_KEY, s3_client=s3_client)
 
-shopify_line_item_df = shopify_line_item_df.merge(first_order_df, how='left',on='email')
-shopify_line_item_df['age'] = (pd.to_datetime(shopify_line_item_df['order_date'])- pd.to_datetime(shopify_line_item_df['first_order_date'])).dt.days
-shopify_line_item_df['cuttoff_60_days'] = pd.to_datetime(pd.to_datetime(shopify_line_item_df['first_order_date']) + timedelta(60)).dt.strftime('%Y-%m-%d')
-shopify_line_item_df['first_order_month'] = pd.to_datetime(shopify_line_item_df['first_order_date']).dt.strftime('%Y-%m')
+    state_through = customer_state_store.load_state_through() if customer_state_store.exists() else None
 
+    if state_through is not None:
 
-shopify_line_item_df['first_order_fl'] = 0
-shopify_line_item_df.loc[shopify_line_item_df['order_date']==shopify_line_item_df['first_order_date'],'first_order_fl'] = 1
+        # Every day after the watermark, usually only yesterday. Days left behind
+        # by a failed or skipped run are caught up, so their first-time customers
+        # reach the state before any later order of theirs is counted
+        customer_state_df = customer_state_store.load()
 
-# --------------------
-# Calculate summary statistics for each day
-# --------------------
+        scan_start = min((pd.Timestamp(state_through) + timedelta(1)).strftime('%Y-%m-%d'), yesterday)
 
-df = shopify_line_item_df.loc[shopify_line_item_df['order_date']==yesterday].copy()
+        STATS_DAYS = pd.date_range(scan_start, yesterday, freq='D').strftime('%Y-%m-%d').tolist()
 
+        logger.info(f'Customer state through {state_through}, computing {scan_start} - {yesterday}')
 
-# Group by order date and agg
-daily_stats_df = df.groupby('order_date',as_index=False).agg(
-                                total_product_revenue=('product_rev', 'sum'),
-                                total_order_count=('order_id', 'nunique'),
-                                total_customer_count=('email', 'nunique')
+        QUERY = build_line_items_query(start_date=scan_start, end_date=yesterday)
 
-                     
+    else:
 
-)
+        # No state (or one without a watermark) - scan the full history once to seed it
+        logger.info('No customer state watermark found, seeding it from the full shopify_line_items history')
 
-#Calulate lifetime AOV
-daily_stats_df['daily_aov'] = daily_stats_df['total_product_revenue'] / daily_stats_df['total_order_count']
+        customer_state_df = empty_customer_state()
 
-logger.info(daily_stats_df.columns)
+        QUERY = build_line_items_query()
 
+if STATS_MODE == 'streaming':
 
-# --------------------
-# Calculate (and merge) additional metrics
+    # Line items are reduced chunk by chunk straight from the query results
+    daily_stats_df, first_order_df = (StreamingDailyStats()
+                                      .add_chunks(iter_athena_query_chunks(query=QUERY, database=DATABASE, region=REGION))
+                                      .finalize(state_df=customer_state_df, days=STATS_DAYS))
 
-# --- new vs returning cust count
-# --- 
-# --------------------
+    logger.info(daily_stats_df.head())
+
+elif STATS_MODE == 'pandas':
 
-new_custs = df.loc[df['first_order_fl']==1].groupby('order_date',as_index=False).agg(
-                                                new_customer_count=('email','nunique'),
-                                                new_customer_spend=('product_rev','sum')
-)
+    # Query datalake to get line items
+    # ----
 
-repeat_custs = df.loc[df['first_order_fl']==0].groupby('order_date',as_index=False).agg(
-                                                repeat_customer_count=('email','nunique'),
-                                                repeat_customer_spend=('product_rev','sum')
-)
+    # With 'unload' the query runs as an UNLOAD and its Parquet output is sized & read
+    line_items_result = AthenaQueryResult(query=QUERY, database=DATABASE, region=REGION, fetch_mode=FETCH_MODE)
 
-logger.info(new_custs.head())
-logger.info(repeat_custs.head())
+    # Above the memory threshold line items are spilled to customer buckets
+    # on disk and aggregated one bucket at a time, with the same result
+    if use_out_of_core(line_items_result.result_bytes(), result_format=line_items_result.result_format):
 
-# Merge additinal stats
-daily_stats_df = daily_stats_df.merge(new_custs,how='left',on='order_date').merge(repeat_custs,how='left',on='order_date')
+        with OutOfCoreDailyStats() as out_of_core_stats:
+            daily_stats_df, first_order_df = (out_of_core_stats
+                                              .add_chunks(line_items_result.iter_chunks())
+                                              .finalize(state_df=customer_state_df, days=STATS_DAYS))
+
+        logger.info(daily_stats_df.head())
+
+    else:
 
+        result_df = line_items_result.read()
 
-logger.info(daily_stats_df.columns)
-logger.info(daily_stats_df.head())
+        logger.info(result_df.head(3))
+        logger.info(result_df.info())
+
+        # First order dates & summary statistics for yesterday, with the
+        # configured engine (pandas reference, duckdb or polars)
+        daily_stats_df, first_order_df = get_engine(DAILY_STATS_ENGINE).compute(result_df, state_df=customer_state_df, days=STATS_DAYS)
+
+elif STATS_MODE == 'athena':
+
+    # One row for yesterday, computed server side
+    daily_stats_df = run_athena_query(query=build_daily_stats_query(start_date=yesterday, end_date=yesterday),
+                                      database=DATABASE,
+                                      region=REGION,
+                                      fetch_mode='paginate')
+
+    daily_stats_df['order_date'] = pd.to_datetime(daily_stats_df['order_date']).dt.strftime('%Y-%m-%d')
+
+    logger.info(daily_stats_df.head())
 
 
 # --------------------
@@ -404,63 +174,57 @@ logger.info(daily_stats_df.head())
 
 yesterday_date = pd.to_datetime(pd.to_datetime('today') - timedelta(1)).strftime('%Y-%m-%d')
 
+# Partition prefix for yesterday
+S3_PARTITION_PREFIX = daily_stats_partition_prefix(yesterday_date)
 
-# Create s3 client
-s3_client = boto3.client('s3', 
-                          region_name = REGION,
-                          aws_access_key_id=AWS_ACCESS_KEY_ID,
-                          aws_secret_access_key=AWS_SECRET_ACCESS_KEY
-                          )
-
-# Set bucket
-BUCKET = os.environ['S3_PRYMAL_ANALYTICS']
-
-# Log number of rows
-logger.info(f'{len(daily_stats_df)} rows in daily_stats_df')
- 
-# Configure S3 Prefix
-S3_PREFIX_PATH = f"shopify/daily_stats/partition_date={yesterday_date}/shopify_daily_stats_{yesterday_date}.csv"
+logger.info(f'Writing daily stats as {OUTPUT_FORMAT} to {daily_stats_table()}')
 
-# Check if data already exists for this partition
-data_already_exists = check_path_for_objects(bucket=BUCKET, s3_prefix=S3_PREFIX_PATH)
+if STATS_MODE == 'athena_insert':
 
-# If data already exists, delete it .. 
-if data_already_exists == True:
-   
-   # Delete data 
-   delete_s3_prefix_data(bucket=BUCKET, s3_prefix=S3_PREFIX_PATH)
+    # INSERT INTO appends, so the day's current files are removed, but only
+    # once the INSERT succeeded - a failed INSERT leaves the day as it was
+    previous_keys = list_s3_keys(bucket=BUCKET, s3_prefix=S3_PARTITION_PREFIX, s3_client=s3_client)
 
+    # Athena writes the files and registers the partition itself, a failed
+    # INSERT raises before anything is deleted
+    run_athena_query_no_results(query=build_daily_stats_insert_query(start_date=yesterday_date,
+                                                                     end_date=yesterday_date,
+                                                                     target_table=daily_stats_table()),
+                                database='prymal-analytics')
 
-logger.info(f'Writing to {S3_PREFIX_PATH}')
+    delete_s3_keys(bucket=BUCKET, keys=previous_keys, s3_client=s3_client)
+    failed_dates = []
 
+else:
 
-with io.StringIO() as csv_buffer:
-    daily_stats_df.to_csv(csv_buffer, index=False)
+    # Every day of the run gets its partition, empty for a day without orders
+    written_dates = write_daily_stats_partitions(s3_client=s3_client, bucket=BUCKET, daily_stats_df=daily_stats_df, order_dates=STATS_DAYS)
 
-    response = s3_client.put_object(
-        Bucket=BUCKET, 
-        Key=S3_PREFIX_PATH, 
-        Body=csv_buffer.getvalue()
-    )
+    # --------------------
+    # RUN 'ATHENA ALTER TABLE' TO UPDATE TABLE 
+    # --------------------
 
-    status = response['ResponseMetadata']['HTTPStatusCode']
+    unregistered_dates = register_partitions(partition_dates=written_dates, table=daily_stats_table())
 
-    if status == 200:
-        logger.info(f"Successful S3 put_object response for PUT ({S3_PREFIX_PATH}). Status - {status}")
-    else:
-        logger.error(f"Unsuccessful S3 put_object response for PUT ({S3_PREFIX_PATH}. Status - {status}")
+    failed_dates = sorted((set(STATS_DAYS) - set(written_dates)) | set(unregistered_dates))
 
 
 # --------------------
-# RUN 'ATHENA ALTER TABLE' TO UPDATE TABLE 
+# UPDATE CUSTOMER STATE
 # --------------------
 
+# Only once the days are written, and the watermark only moves through the
+# days before the first failed one, which the next run scans again
+if STATS_MODE in CUSTOMER_STATE_MODES:
+
+    completed_days = list(itertools.takewhile(lambda day: day not in failed_dates, STATS_DAYS))
 
-QUERY = f"""
+    if completed_days:
+        customer_state_store.save(merge_customer_state(state_df=customer_state_df, first_order_df=first_order_df),
+                                  state_through=completed_days[-1])
 
-ALTER TABLE shopify_daily_stats ADD
-  PARTITION (partition_date = '{yesterday_date}')
-  
-"""
 
-run_athena_query_no_results(query=QUERY, database='prymal-analytics')
+# Fail the run so a missing day is retried instead of silently skipped
+if failed_dates:
+    logger.error(f'daily_stats for {failed_dates} were not written')
+    sys.exit(1)